@@ -1,8 +1,133 @@
-from django.contrib import admin
-from .models import Transaction
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from . import audit
+from .bulk import normalize_msisdn
+from .models import ArchivedTransaction, AuditRecord, CallbackEvent, Transaction
+from .reconcile import reconcile_selected
+
+logger = logging.getLogger(__name__)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never counts a whole large table.
+
+    An unfiltered changelist on PostgreSQL uses the planner's row estimate.
+    Any other changelist counts at most PAYMENTS_ADMIN_COUNT_LIMIT rows, so
+    the count stops at the cap and later pages are reached by narrowing
+    the filters.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.PAYMENTS_ADMIN_COUNT_LIMIT
+        if not queryset.query.where and connections[queryset.db].vendor == 'postgresql':
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > limit:
+                return int(row[0])
+        return queryset[:limit].count()
+
+
+# Admin actions that call Daraja run here, one at a time, off the request thread.
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='payments-admin')
+
+
+def run_in_background(fn, *args):
+    def run():
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception("Background admin task failed", extra={"task": fn.__name__})
+        finally:
+            # Buffered audit rows and this thread's connections would otherwise linger.
+            audit.flush(force=True)
+            connections.close_all()
+    _background.submit(run)
+
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ('phone_number', 'amount', 'status', 'created_at')
+    # A created_at range filter rather than date_hierarchy: the hierarchy's
+    # DISTINCT year/month/day queries can't use the created_at index.
+    list_filter = ('status', ('created_at', admin.DateFieldListFilter))
+    # Matched by get_search_results with exact or prefix lookups only.
+    search_fields = ('=phone_number', '^mpesa_receipt_number', '=checkout_request_id')
+    search_help_text = "Phone number, receipt number or its prefix, or CheckoutRequestID."
+    ordering = ('-created_at', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['requery_pending']
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search one indexed column chosen by the shape of the term.
+
+        Phone numbers are normalized and matched exactly. CheckoutRequestIDs
+        are matched exactly, and anything else is treated as a receipt prefix.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        phone_number = normalize_msisdn(term)
+        if phone_number:
+            return queryset.filter(phone_number=phone_number), False
+        if term.startswith('ws_CO_'):
+            return queryset.filter(checkout_request_id=term), False
+        return queryset.filter(mpesa_receipt_number__startswith=term.upper()), False
+
+    @admin.action(description="Re-query selected PENDING transactions with M-PESA")
+    def requery_pending(self, request, queryset):
+        pks = list(queryset.pending().filter(checkout_request_id__isnull=False).values_list('pk', flat=True))
+        if not pks:
+            self.message_user(request, "None of the selected transactions is PENDING with a CheckoutRequestID.",
+                              messages.WARNING)
+            return
+        run_in_background(reconcile_selected, pks)
+        self.message_user(request, f"Re-querying {len(pks)} PENDING transactions in the background; "
+                                   "refresh to see their status.")
+
+@admin.register(CallbackEvent)
+class CallbackEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'received_at', 'processed_at', 'attempts', 'retry_at', 'error')
+    readonly_fields = ('payload', 'received_at')
+
+@admin.register(ArchivedTransaction)
+class ArchivedTransactionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'phone_number', 'amount', 'status', 'created_at', 'archived_at')
     list_filter = ('status',)
-    search_fields = ('phone_number', 'mpesa_receipt_number')
+    search_fields = ('=mpesa_receipt_number', '=checkout_request_id', '=phone_number')
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(AuditRecord)
+class AuditRecordAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'checkout_request_id', 'receipt', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('=checkout_request_id', '=receipt')
+    fields = ('kind', 'checkout_request_id', 'receipt', 'created_at', 'body')
+    readonly_fields = fields
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def body(self, obj):
+        return obj.body()
@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "payments"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.core.signals import request_finished
+        from django.db.models.signals import post_save
+
+        from . import audit, checks, events, metrics, pagecache, rollups, signals  # noqa: F401 (checks registers on import)
+        from .models import Transaction
+
+        connection_created.connect(metrics.install_db_wrapper)
+        post_save.connect(rollups.count_created, sender=Transaction, dispatch_uid="payments_rollup_created")
+        post_save.connect(signals.forward_saved, sender=Transaction, dispatch_uid="payments_forward_saved")
+        signals.transactions_changed.connect(pagecache.bump_version, dispatch_uid="payments_list_cache")
+        signals.transactions_changed.connect(events.publish_changes, dispatch_uid="payments_status_events")
+        request_finished.connect(audit.flush_finished, dispatch_uid="payments_audit_flush")
+        metrics.registry.add_collector(metrics.runtime_collector)
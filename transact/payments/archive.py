@@ -0,0 +1,88 @@
+"""Tiering of settled transactions into ArchivedTransaction.
+
+SUCCESS and FAILED rows older than the retention window are copied to the
+archive table and deleted from ``Transaction`` in small batches. Each batch
+is its own short transaction, so row locks are held only for one batch and
+live callbacks and pushes keep flowing. PENDING rows are never moved.
+
+``find_transaction`` looks in the hot table first and then in the archive.
+Historical lookups work by id, CheckoutRequestID or receipt number.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import pagecache
+from .models import ArchivedTransaction, Transaction
+
+ARCHIVED_FIELDS = (
+    'id', 'phone_number', 'amount', 'checkout_request_id', 'mpesa_receipt_number',
+    'status', 'created_at', 'updated_at',
+)
+
+
+def archive_batch(cutoff, batch_size):
+    """Move up to ``batch_size`` settled rows created before ``cutoff``; returns how many moved."""
+    with transaction.atomic():
+        rows = list(
+            Transaction.objects.filter(status__in=('SUCCESS', 'FAILED'), created_at__lt=cutoff)
+            .select_for_update(skip_locked=True)
+            .order_by('created_at', 'id')
+            .values(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        # ignore_conflicts: a batch interrupted after its insert can be re-run.
+        ArchivedTransaction.objects.bulk_create(
+            [ArchivedTransaction(**row) for row in rows], ignore_conflicts=True,
+        )
+        Transaction.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        transaction.on_commit(pagecache.bump_version)
+    return len(rows)
+
+
+def archive_settled(days=None, batch_size=None, pause=0.0, limit=None, progress=None):
+    """Archive settled rows older than ``days``; returns the number moved.
+
+    ``pause`` seconds are slept between batches to leave room for live
+    traffic; ``progress`` is called with the running total after each batch.
+    """
+    days = settings.PAYMENTS_ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or settings.PAYMENTS_ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    moved = 0
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        count = archive_batch(cutoff, size)
+        moved += count
+        if progress:
+            progress(moved)
+        if count < size:
+            break
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def find_transaction(pk=None, checkout_request_id=None, receipt=None):
+    """Find a transaction in either tier by one identifier.
+
+    Returns a dict of its fields plus ``"archived"``, or None. The hot table
+    is checked first; both lookups are single indexed reads.
+    """
+    lookup = {
+        name: value for name, value in (
+            ('pk', pk), ('checkout_request_id', checkout_request_id), ('mpesa_receipt_number', receipt),
+        ) if value is not None
+    }
+    if len(lookup) != 1:
+        raise ValueError("Pass exactly one of pk, checkout_request_id or receipt.")
+    for model, archived in ((Transaction, False), (ArchivedTransaction, True)):
+        row = model.objects.filter(**lookup).values(*ARCHIVED_FIELDS).first()
+        if row is not None:
+            return {**row, "archived": archived}
+    return None
+
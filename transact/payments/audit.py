@@ -0,0 +1,169 @@
+"""Batched, append-only audit trail of raw Daraja traffic.
+
+``record`` only appends to an in-process buffer. The buffer is written with
+one ``bulk_create`` once it holds PAYMENTS_AUDIT_BATCH_SIZE entries or its
+oldest entry is PAYMENTS_AUDIT_FLUSH_INTERVAL seconds old. Flushes run from
+the ``request_finished`` signal, after the response has gone out, and from a
+timer thread every interval, so a quiet worker doesn't sit on entries. The
+buffer is also flushed at interpreter exit (worker shutdown or recycle).
+Callbacks never wait on the audit insert. Rows are looked up by
+CheckoutRequestID or receipt number (``lookup``). ``compact``
+zlib-compresses old payloads in place.
+
+Only a process killed outright (SIGKILL, OOM) loses its last interval of
+entries. Set PAYMENTS_AUDIT_BATCH_SIZE to 1 to write each entry when its
+request finishes.
+"""
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from .daraja import parse_callback
+from .models import AuditRecord
+
+logger = logging.getLogger(__name__)
+
+
+class AuditBuffer:
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._entries = []
+        self._since = None
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        with self._lock:
+            if not self._entries:
+                self._since = self._clock()
+            self._entries.append(record)
+
+    def take(self, force=False):
+        """Remove and return the buffered records if a flush is due (or ``force``)."""
+        with self._lock:
+            due = len(self._entries) >= settings.PAYMENTS_AUDIT_BATCH_SIZE or (
+                self._entries and self._clock() - self._since >= settings.PAYMENTS_AUDIT_FLUSH_INTERVAL
+            )
+            if not (due or force):
+                return []
+            entries, self._entries = self._entries, []
+            return entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+buffer = AuditBuffer()
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_periodically(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            close_old_connections()
+            flush()
+        except Exception:
+            logger.exception("Audit flush failed")
+
+
+def _start_flusher():
+    """Start this process's timer thread and exit hook; a no-op once running."""
+    global _flusher_pid
+    if not settings.PAYMENTS_AUDIT_BACKGROUND_FLUSH or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        # Compared by pid: threads don't survive a fork (gunicorn --preload).
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_periodically, args=(settings.PAYMENTS_AUDIT_FLUSH_INTERVAL,),
+                         name='payments-audit', daemon=True).start()
+        atexit.register(flush, force=True)
+
+
+def record(kind, payload, checkout_request_id=None, receipt=None):
+    """Buffer one raw body (``str``, or anything JSON-serializable)."""
+    if not isinstance(payload, str):
+        payload = json.dumps(payload, default=str)
+    buffer.append(AuditRecord(
+        kind=kind, payload=payload, checkout_request_id=checkout_request_id,
+        receipt=receipt, created_at=timezone.now(),
+    ))
+    _start_flusher()
+
+
+def record_callback(raw, data=None):
+    """Buffer a callback body exactly as received; returns its ``parse_callback`` fields.
+
+    Pass ``data`` when the body is already decoded. A body that doesn't parse
+    is still recorded, without ids.
+    """
+    try:
+        parsed = parse_callback(json.loads(raw) if data is None else data)
+    except (ValueError, AttributeError):
+        parsed = parse_callback({})
+    record('callback', raw, parsed["checkout_id"], parsed["receipt"])
+    return parsed
+
+
+def flush(force=False):
+    """Write the buffer if a flush is due; returns how many rows were written."""
+    entries = buffer.take(force)
+    if not entries:
+        return 0
+    try:
+        AuditRecord.objects.bulk_create(entries)
+    except DatabaseError:
+        # Auditing must never fail a payment; the batch is reported instead.
+        logger.exception("Dropped audit batch", extra={"dropped": len(entries)})
+        return 0
+    return len(entries)
+
+
+
+def flush_finished(sender=None, **kwargs):
+    """``request_finished`` receiver."""
+    flush()
+
+
+def lookup(checkout_request_id=None, receipt=None):
+    """Audit rows for one CheckoutRequestID or receipt number, oldest first."""
+    if (checkout_request_id is None) == (receipt is None):
+        raise ValueError("Pass exactly one of checkout_request_id or receipt.")
+    if checkout_request_id is not None:
+        rows = AuditRecord.objects.filter(checkout_request_id=checkout_request_id)
+    else:
+        rows = AuditRecord.objects.filter(receipt=receipt)
+    return rows.order_by('created_at', 'id')
+
+
+def compact(days=None, batch_size=500, limit=None):
+    """Compress payloads of rows older than ``days``; returns the number compressed."""
+    days = settings.PAYMENTS_AUDIT_COMPRESS_AFTER_DAYS if days is None else days
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    done = 0
+    while limit is None or done < limit:
+        size = batch_size if limit is None else min(batch_size, limit - done)
+        rows = list(
+            AuditRecord.objects.filter(compressed__isnull=True, created_at__lt=cutoff)
+            .order_by('created_at', 'id')
+            .only('id', 'payload')[:size]
+        )
+        for row in rows:
+            row.compressed = zlib.compress(row.payload.encode('utf-8'), 9)
+            row.payload = ''
+        AuditRecord.objects.bulk_update(rows, ['compressed', 'payload'])
+        done += len(rows)
+        if len(rows) < size:
+            break
+    return done
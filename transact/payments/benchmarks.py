@@ -0,0 +1,206 @@
+"""Helpers shared by the benchmark and load-test management commands."""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from . import audit
+from .log import quiet
+from .models import Transaction
+
+
+@contextmanager
+def throwaway_database():
+    """Point the default connection at a fresh test database, destroyed on exit.
+
+    Uses the configured backend, so results still compare DB_ENGINE profiles,
+    but nothing is written to the real database.
+    """
+    setup_test_environment()
+    if connection.vendor == "sqlite" and not connection.settings_dict["TEST"].get("NAME"):
+        # Shared-cache in-memory SQLite fails concurrent writers with "table is
+        # locked" instead of waiting, so use a temporary file.
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(
+            tempfile.gettempdir(), f"transact-benchmark-{os.getpid()}.sqlite3"
+        )
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        audit.flush(force=True)  # buffered entries belong to the throwaway database
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    rank = max(int(round(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(samples):
+    """p50/p95/p99/max of latency samples given in seconds, reported in ms."""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3) if samples else 0,
+    }
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def seed_transactions(count, offset=0, batch_size=5000, pending_ratio=0.1):
+    """Bulk insert synthetic transactions; returns their checkout ids.
+
+    Row ``i`` gets phone ``2547`` + ``i`` and receipt ``R`` + ``i``, so pass
+    ``offset`` when growing a table that was seeded before.
+    """
+    checkout_ids = []
+    pending_every = max(int(1 / pending_ratio), 1) if pending_ratio else 0
+    for start in range(offset, offset + count, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, offset + count)):
+            checkout_id = f"ws_CO_bench_{uuid.uuid4().hex}"
+            checkout_ids.append(checkout_id)
+            pending = pending_every and i % pending_every == 0
+            batch.append(Transaction(
+                phone_number=f"2547{i % 100000000:08d}",
+                amount=1 + i % 1000,
+                checkout_request_id=checkout_id,
+                mpesa_receipt_number=None if pending else f"R{i:09d}",
+                status='PENDING' if pending else 'SUCCESS',
+            ))
+        Transaction.objects.bulk_create(batch, batch_size=batch_size)
+    return checkout_ids
+
+
+def run_concurrently(func, items, concurrency):
+    """Call ``func(item)`` for every item on ``concurrency`` threads.
+
+    Returns ``(wall_seconds, [(latency_seconds, result_or_exception), ...])``.
+    Worker threads close their database connections before exiting.
+    """
+    def call(item):
+        start = time.perf_counter()
+        try:
+            result = func(item)
+        except Exception as e:
+            result = e
+        return time.perf_counter() - start, result
+
+    def close_connections(barrier):
+        # The barrier makes every worker thread run exactly one of these.
+        barrier.wait()
+        connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, items))
+        elapsed = time.perf_counter() - started
+        barrier = threading.Barrier(concurrency)
+        list(pool.map(close_connections, [barrier] * concurrency))
+    return elapsed, results
+
+
+def measure(make_request, items, concurrency):
+    """Drive ``make_request(client, item)`` concurrently and summarise it.
+
+    Reports throughput, latency percentiles, status codes and the number of
+    SQL queries each request issued.
+    """
+    def call(item):
+        with CaptureQueriesContext(connection) as queries:
+            response = make_request(Client(), item)
+        return response.status_code, len(queries.captured_queries)
+
+    # Keep the views' per-request log lines out of the benchmark output.
+    with quiet():
+        elapsed, results = run_concurrently(call, items, concurrency)
+
+    latencies = [latency for latency, _ in results]
+    ok = [result for _, result in results if not isinstance(result, Exception)]
+    query_counts = [count for _, count in ok]
+    statuses = {}
+    for status, _ in ok:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "concurrency": concurrency,
+        "throughput_rps": round(len(results) / elapsed, 1) if elapsed else 0,
+        "latency": summarize(latencies),
+        "status_codes": statuses,
+        "exceptions": len(results) - len(ok),
+        "queries_per_request": {
+            "avg": round(sum(query_counts) / len(query_counts), 2) if query_counts else 0,
+            "max": max(query_counts, default=0),
+        },
+    }
+
+
+def callback_json(checkout_id, receipt):
+    return json.dumps({"Body": {"stkCallback": {
+        "CheckoutRequestID": checkout_id,
+        "ResultCode": 0,
+        "ResultDesc": "The service request is processed successfully.",
+        "CallbackMetadata": {"Item": [
+            {"Name": "MpesaReceiptNumber", "Value": receipt},
+            {"Name": "Amount", "Value": 1},
+        ]},
+    }}})
+
+
+def run_scenarios(requests=200, concurrency=8, seed_rows=10000):
+    """Exercise the payment views end to end; MPESA_BASE_URL should point at a FakeDaraja.
+
+    Returns a dict of per-view results suitable for JSON comparison between commits.
+    """
+    seed_transactions(seed_rows)
+    results = {}
+
+    results["initiate_stk_push"] = measure(
+        lambda client, i: client.post(reverse("stk_push"), {"phone_number": f"2547{i:08d}", "amount": "1"}),
+        range(requests), concurrency,
+    )
+
+    accepted = list(
+        Transaction.objects.pending().filter(checkout_request_id__startswith="ws_CO_fake_")
+        .values_list("checkout_request_id", flat=True)
+    )
+    results["stk_callback"] = measure(
+        lambda client, item: client.post(
+            reverse("stk_callback"), callback_json(item[1], f"BM{item[0]:010d}"),
+            content_type="application/json",
+        ),
+        list(enumerate(accepted)), concurrency,
+    )
+
+    results["transactions_list"] = measure(
+        lambda client, _: client.get(reverse("transactions_list")),
+        range(requests), concurrency,
+    )
+
+    seed_transactions(requests, offset=seed_rows, pending_ratio=1)
+    pending_ids = list(Transaction.objects.pending().values_list("pk", flat=True)[:requests])
+    results["query_stk_status"] = measure(
+        lambda client, pk: client.get(reverse("query_stk_status", args=[pk])),
+        pending_ids, concurrency,
+    )
+    return results
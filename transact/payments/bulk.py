@@ -0,0 +1,186 @@
+"""Bulk STK push for collection campaigns.
+
+Rows are validated up front and the whole campaign is inserted with
+``bulk_create``. Pushes are then dispatched on a bounded thread pool behind a
+per-second rate limit. CheckoutRequestIDs are written back with
+``bulk_update`` every ``batch_size`` completions. ``bulk_initiate`` yields a
+progress event after each batch so callers can stream it.
+"""
+import csv
+import io
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import audit
+from .client import get_client
+from .daraja import STK_PUSH_PATH, push_response_context, stk_push_request
+from .models import Transaction
+from .ratelimit import RateLimiter
+from .rollups import count_created_bulk
+from .signals import send_changed
+from .utils import get_access_token
+
+MSISDN_RE = re.compile(r'^254[17]\d{8}$')
+_amount_field = Transaction._meta.get_field('amount')
+# Largest whole amount Transaction.amount can store
+MAX_AMOUNT = 10 ** (_amount_field.max_digits - _amount_field.decimal_places) - 1
+
+
+def normalize_msisdn(raw):
+    """Return ``254XXXXXXXXX`` for a Kenyan mobile number, or None if invalid.
+
+    Accepts ``07..``/``01..``, ``7..``/``1..``, ``+254..`` and ``254..`` with
+    spaces or dashes.
+    """
+    digits = re.sub(r'[\s\-()+]', '', str(raw or ''))
+    if len(digits) == 10 and digits.startswith('0'):
+        digits = '254' + digits[1:]
+    elif len(digits) == 9:
+        digits = '254' + digits
+    return digits if MSISDN_RE.match(digits) else None
+
+
+def parse_rows(rows):
+    """Validate raw ``{"phone", "amount"}`` rows.
+
+    Returns ``(valid, errors)``: ``valid`` is a list of ``(index, phone,
+    amount)`` and ``errors`` a list of ``{"row", "error"}`` dicts.
+    """
+    valid, errors = [], []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({"row": index, "error": "Row must be an object with phone and amount."})
+            continue
+        phone = normalize_msisdn(row.get('phone') or row.get('phone_number'))
+        if phone is None:
+            errors.append({"row": index, "error": "Invalid phone number."})
+            continue
+        try:
+            amount = Decimal(str(row.get('amount', '')).strip())
+        except (InvalidOperation, ValueError):
+            errors.append({"row": index, "error": "Amount must be a number."})
+            continue
+        error = amount_error(amount)
+        if error:
+            errors.append({"row": index, "error": error})
+            continue
+        valid.append((index, phone, int(amount)))
+    return valid, errors
+
+
+def amount_error(amount):
+    """Why a parsed ``Decimal`` amount can't be pushed, or None if it can."""
+    if not amount.is_finite():
+        return "Amount must be a number."
+    if amount != amount.to_integral_value():
+        return "Amount must be a whole number."
+    if amount < 1:
+        return "Amount must be at least 1."
+    if amount > MAX_AMOUNT:
+        return f"Amount must be at most {MAX_AMOUNT}."
+    return None
+
+
+def read_rows(body, content_type):
+    """Decode a CSV (``phone,amount`` header) or JSON request body into row dicts."""
+    if 'csv' in content_type:
+        return list(csv.DictReader(io.StringIO(body.decode('utf-8-sig'))))
+    data = json.loads(body.decode('utf-8'))
+    return data.get('rows', []) if isinstance(data, dict) else data
+
+
+def send_push(phone_number, amount, access_token):
+    """Send one STK push; returns the CheckoutRequestID or raises on rejection."""
+    response = get_client().post(STK_PUSH_PATH, **stk_push_request(phone_number, amount, access_token))
+    context, checkout_id = push_response_context(response.status_code, response)
+    audit.record('push', response.text, checkout_id)
+    if not context.get('accepted') or not checkout_id:
+        raise ValueError(context.get('error') or f"STK push rejected with status {response.status_code}")
+    return checkout_id
+
+
+def _flush(accepted, failed, now):
+    if accepted:
+        for txn in accepted:
+            txn.updated_at = now
+        Transaction.objects.bulk_update(accepted, ['checkout_request_id', 'updated_at'])
+        send_changed(Transaction, {txn.pk: txn.status for txn in accepted})
+    if failed:
+        Transaction.objects.filter(pk__in=[txn.pk for txn in failed]).transition(status='FAILED')
+    audit.flush()
+
+
+def bulk_initiate(rows, workers=None, rate=None, batch_size=100, push=send_push):
+    """Initiate STK pushes for ``rows``; yields progress event dicts."""
+    workers = workers or settings.MPESA_BULK_WORKERS
+    rate = settings.MPESA_PUSH_RATE_LIMIT if rate is None else rate
+
+    valid, errors = parse_rows(rows)
+    for error in errors:
+        yield {"event": "invalid", **error}
+    summary = {"event": "done", "rows": len(rows), "invalid": len(errors),
+               "sent": 0, "accepted": 0, "failed": 0}
+    if not valid:
+        yield summary
+        return
+
+    txns = Transaction.objects.bulk_create(
+        [Transaction(phone_number=phone, amount=amount, status='PENDING') for _, phone, amount in valid],
+        batch_size=1000,
+    )
+    count_created_bulk(txns)
+    send_changed(Transaction, {txn.pk: txn.status for txn in txns})
+    yield {"event": "created", "count": len(txns)}
+
+    try:
+        access_token = get_access_token()
+    except Exception as e:
+        Transaction.objects.filter(pk__in=[txn.pk for txn in txns]).transition(status='FAILED')
+        summary["failed"] = len(txns)
+        yield {"event": "error", "error": f"Failed to obtain MPESA access token: {e}"}
+        yield summary
+        return
+
+    limiter = RateLimiter(rate)
+
+    def dispatch(txn):
+        limiter.acquire()
+        return push(txn.phone_number, int(txn.amount), access_token)
+
+    accepted, failed = [], []
+    handled = set()
+
+    def record(future, txn):
+        handled.add(future)
+        try:
+            txn.checkout_request_id = future.result()
+            accepted.append(txn)
+            summary["accepted"] += 1
+        except Exception:
+            failed.append(txn)
+            summary["failed"] += 1
+        summary["sent"] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(dispatch, txn): txn for txn in txns}
+        try:
+            for future in as_completed(futures):
+                record(future, futures[future])
+                if len(accepted) + len(failed) >= batch_size:
+                    _flush(accepted, failed, timezone.now())
+                    accepted, failed = [], []
+                    yield {"event": "progress", "sent": summary["sent"], "accepted": summary["accepted"],
+                           "failed": summary["failed"], "total": len(txns)}
+        finally:
+            # Also runs if the caller stops consuming (e.g. the client went
+            # away): pushes already submitted must still get their IDs saved.
+            for future, txn in futures.items():
+                if future not in handled:
+                    record(future, txn)
+            _flush(accepted, failed, timezone.now())
+    yield summary
@@ -0,0 +1,158 @@
+"""Applying Daraja STK callbacks to transactions, inline or from the inbox.
+
+Every path moves a transaction out of PENDING with a conditional UPDATE
+(see ``TransactionQuerySet.transition``), so Safaricom retries, duplicate
+inbox entries and a racing ``query_stk_status`` never overwrite a final
+status. A receipt number that is already recorded is treated as a duplicate.
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .daraja import callback_changes, parse_callback
+from .models import CallbackEvent, RollupDelta, Transaction, add_rollup_delta
+from .signals import send_changed
+
+
+def _fallback_queryset(parsed):
+    # Fallback: if no txn found by checkout_id, match latest pending by phone
+    return Transaction.objects.filter(phone_number=parsed["phone"], status='PENDING').order_by('-created_at')
+
+
+def _transition(queryset, changes):
+    try:
+        with transaction.atomic():
+            return queryset.transition(**changes) > 0
+    except IntegrityError:
+        # Receipt number already recorded on another row: duplicate delivery.
+        return False
+
+
+async def _atransition(queryset, changes):
+    try:
+        return await queryset.atransition(**changes) > 0
+    except IntegrityError:
+        return False
+
+
+def process_callback(data):
+    """Apply one decoded callback body; returns True if a transaction changed.
+
+    The common case is a single UPDATE keyed on CheckoutRequestID. Duplicate
+    deliveries for a known CheckoutRequestID cost one more indexed EXISTS and
+    never write.
+    """
+    parsed = parse_callback(data)
+    changes = callback_changes(parsed)
+    if parsed["checkout_id"]:
+        matched = Transaction.objects.filter(checkout_request_id=parsed["checkout_id"])
+        if _transition(matched, changes):
+            return True
+        if matched.exists():
+            return False
+    if parsed["phone"]:
+        txn = _fallback_queryset(parsed).only('pk').first()
+        if txn:
+            return _transition(Transaction.objects.filter(pk=txn.pk), changes)
+    return False
+
+
+async def aprocess_callback(data):
+    parsed = parse_callback(data)
+    changes = callback_changes(parsed)
+    if parsed["checkout_id"]:
+        matched = Transaction.objects.filter(checkout_request_id=parsed["checkout_id"])
+        if await _atransition(matched, changes):
+            return True
+        if await matched.aexists():
+            return False
+    if parsed["phone"]:
+        txn = await _fallback_queryset(parsed).only('pk').afirst()
+        if txn:
+            return await _atransition(Transaction.objects.filter(pk=txn.pk), changes)
+    return False
+
+
+def drain_inbox(batch_size=500):
+    """Apply one batch of queued callbacks; returns how many events were consumed.
+
+    Events are claimed with ``SKIP LOCKED`` so several workers can drain the
+    queue in parallel. Target transactions are locked and loaded with one
+    query, rows that are no longer PENDING or whose receipt is already known
+    are skipped, and the rest are written back with a single ``bulk_update``.
+
+    An event whose transaction isn't found (the push row may not be committed
+    or replicated yet) stays queued and is retried after
+    MPESA_CALLBACK_RETRY_DELAY * attempts seconds, up to
+    MPESA_CALLBACK_MAX_ATTEMPTS attempts.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            CallbackEvent.objects.due(now)
+            .select_for_update(skip_locked=True)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        parsed_events = []
+        for event in events:
+            event.error = ''  # clear a previous attempt's reason
+            try:
+                parsed_events.append((event, parse_callback(json.loads(event.payload))))
+            except (ValueError, AttributeError) as e:
+                event.error = f"Unparseable callback: {e}"
+
+        checkout_ids = [p["checkout_id"] for _, p in parsed_events if p["checkout_id"]]
+        by_checkout_id = Transaction.objects.select_for_update().in_bulk(
+            checkout_ids, field_name='checkout_request_id'
+        )
+        receipts = [p["receipt"] for _, p in parsed_events if p["receipt"]]
+        seen_receipts = set(
+            Transaction.objects.filter(mpesa_receipt_number__in=receipts)
+            .values_list('mpesa_receipt_number', flat=True)
+        )
+
+        changed, fields, deltas, unmatched = {}, set(), {}, set()
+        for event, parsed in parsed_events:
+            txn = by_checkout_id.get(parsed["checkout_id"])
+            if txn is None and parsed["phone"]:
+                txn = _fallback_queryset(parsed).select_for_update().exclude(pk__in=changed).first()
+            if txn is None:
+                unmatched.add(event.pk)
+                continue
+            if txn.status != 'PENDING' or parsed["receipt"] in seen_receipts:
+                # Duplicate delivery or already settled by a query
+                continue
+            changes = callback_changes(parsed)
+            add_rollup_delta(deltas, txn.created_at, 'PENDING', txn.amount, sign=-1)
+            add_rollup_delta(deltas, txn.created_at, changes["status"], changes.get("amount", txn.amount))
+            for name, value in changes.items():
+                setattr(txn, name, value)
+            if parsed["receipt"]:
+                seen_receipts.add(parsed["receipt"])
+            fields.update(changes)
+            # bulk_update() bypasses auto_now
+            txn.updated_at = now
+            changed[txn.pk] = txn
+
+        if changed:
+            Transaction.objects.bulk_update(changed.values(), sorted(fields | {'updated_at'}))
+            RollupDelta.objects.record(deltas)
+            send_changed(Transaction, {pk: txn.status for pk, txn in changed.items()})
+        for event in events:
+            event.attempts += 1
+            if event.pk not in unmatched:
+                event.processed_at = now
+            elif event.attempts < settings.MPESA_CALLBACK_MAX_ATTEMPTS:
+                event.error = f"No matching transaction after {event.attempts} attempts; will retry"
+                event.retry_at = now + datetime.timedelta(seconds=settings.MPESA_CALLBACK_RETRY_DELAY * event.attempts)
+            else:
+                event.error = f"No matching transaction after {event.attempts} attempts; giving up"
+                event.processed_at = now
+        CallbackEvent.objects.bulk_update(events, ['processed_at', 'attempts', 'retry_at', 'error'])
+    return len(events)
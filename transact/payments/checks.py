@@ -0,0 +1,64 @@
+"""Startup validation of the M-PESA settings.
+
+Run by ``manage.py check``, ``runserver`` and ``migrate``, so a malformed
+shortcode or base URL is reported when the process starts rather than as a
+Daraja error on the first push. Missing credentials are only reported by
+``check --deploy``: local development runs without them.
+"""
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+
+def _is_url(value, schemes):
+    parsed = urlparse(value or '')
+    return parsed.scheme in schemes and bool(parsed.netloc)
+
+
+@register()
+def check_mpesa_settings(app_configs, **kwargs):
+    errors = []
+    if not str(settings.MPESA_SHORTCODE).isdigit():
+        errors.append(Error(
+            "MPESA_SHORTCODE must be the numeric paybill or till number.",
+            obj="settings.MPESA_SHORTCODE", id="payments.E001",
+        ))
+    if not _is_url(settings.MPESA_BASE_URL, ('http', 'https')):
+        errors.append(Error(
+            f"MPESA_BASE_URL {settings.MPESA_BASE_URL!r} is not an http(s) URL.",
+            obj="settings.MPESA_BASE_URL", id="payments.E002",
+        ))
+    if not _is_url(settings.MPESA_CALLBACK_URL, ('https',)):
+        errors.append(Warning(
+            "MPESA_CALLBACK_URL is not an https URL; Daraja rejects STK pushes with plain-http callbacks.",
+            obj="settings.MPESA_CALLBACK_URL", id="payments.W001",
+        ))
+    return errors
+
+
+@register(Tags.security, deploy=True)
+def check_mpesa_credentials(app_configs, **kwargs):
+    missing = [name for name in ("MPESA_CONSUMER_KEY", "MPESA_CONSUMER_SECRET", "MPESA_PASSKEY")
+               if not getattr(settings, name)]
+    if not missing:
+        return []
+    return [Warning(
+        f"{', '.join(missing)} not set; OAuth and STK password generation will fail.",
+        id="payments.W002",
+    )]
+
+
+@register(Tags.caches, deploy=True)
+def check_list_cache(app_configs, **kwargs):
+    from .pagecache import is_shared
+
+    if is_shared():
+        return []
+    return [Warning(
+        f"PAYMENTS_LIST_CACHE_ALIAS {settings.PAYMENTS_LIST_CACHE_ALIAS!r} is a per-process "
+        "local-memory cache; other processes can't invalidate its list pages, so they are "
+        f"only cached for PAYMENTS_LIST_CACHE_LOCAL_TIMEOUT ({settings.PAYMENTS_LIST_CACHE_LOCAL_TIMEOUT}s).",
+        hint="Point the alias at a shared backend such as Redis or Memcached.",
+        obj="settings.PAYMENTS_LIST_CACHE_ALIAS", id="payments.W003",
+    )]
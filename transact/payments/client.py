@@ -0,0 +1,290 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .daraja import dumps
+from .metrics import record_upstream
+
+
+class DarajaError(Exception):
+    pass
+
+
+class CircuitOpenError(DarajaError):
+    pass
+
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream failures.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls for ``reset_timeout`` seconds. It then lets a single trial
+    call through (half-open); success closes it again, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Free the half-open trial slot after a call that neither succeeded nor failed."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+
+def backoff_delay(attempt, base, cap=5.0):
+    """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker():
+    """Return the circuit breaker shared by the sync and async clients."""
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    failure_threshold=settings.MPESA_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=settings.MPESA_CIRCUIT_RESET_TIMEOUT,
+                )
+    return _breaker
+
+
+class BaseDarajaClient:
+    def __init__(self, base_url=None, pool_size=None, connect_timeout=None,
+                 read_timeout=None, max_retries=None, retry_backoff=None, breaker=None):
+        self._base_url = base_url
+        self.pool_size = pool_size or settings.MPESA_HTTP_POOL_SIZE
+        self.connect_timeout = connect_timeout or settings.MPESA_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.MPESA_READ_TIMEOUT
+        self.max_retries = settings.MPESA_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = settings.MPESA_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.breaker = breaker or get_breaker()
+
+    @property
+    def base_url(self):
+        # Resolved per call so overriding MPESA_BASE_URL takes effect.
+        return (self._base_url or settings.MPESA_BASE_URL).rstrip("/")
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _record(self, path, status, started):
+        record_upstream(path.split("?", 1)[0], status, time.perf_counter() - started)
+
+    def _attempts(self, idempotent):
+        return 1 + (self.max_retries if idempotent else 0)
+
+    def _encode_json(self, kwargs, body_arg):
+        # Serialise ``json=`` bodies once, with the fast encoder, before retrying.
+        if "json" in kwargs:
+            headers = dict(kwargs.get("headers") or {})
+            headers.setdefault("Content-Type", "application/json")
+            kwargs["headers"] = headers
+            kwargs[body_arg] = dumps(kwargs.pop("json"))
+        return kwargs
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError("MPESA API circuit is open; failing fast")
+
+
+class DarajaClient(BaseDarajaClient):
+    """Pooled keep-alive HTTP client for the Daraja API.
+
+    Idempotent calls (OAuth, STK query) are retried on connection errors and
+    5xx responses; every call goes through a shared circuit breaker so that
+    workers stop waiting on Safaricom while it is degraded.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, path, idempotent=False, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs = self._encode_json(kwargs, "data")
+        attempts = self._attempts(idempotent)
+        for attempt in range(attempts):
+            self._check_breaker()
+            last_attempt = attempt == attempts - 1
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.url(path), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(path, type(e).__name__, started)
+                self.breaker.record_failure()
+                if last_attempt:
+                    raise
+            except BaseException:
+                # Bad encoding, redirect loops and the like say nothing about
+                # Daraja's health, but must not keep the trial slot forever.
+                self.breaker.release_trial()
+                raise
+            else:
+                self._record(path, response.status_code, started)
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if last_attempt:
+                    return response
+            time.sleep(backoff_delay(attempt, self.retry_backoff))
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, idempotent=True, **kwargs)
+
+    def post(self, path, idempotent=False, **kwargs):
+        return self.request("POST", path, idempotent=idempotent, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncDarajaClient(BaseDarajaClient):
+    """httpx-based counterpart of DarajaClient for the async views."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            ),
+        )
+
+    async def request(self, method, path, idempotent=False, **kwargs):
+        kwargs = self._encode_json(kwargs, "content")
+        attempts = self._attempts(idempotent)
+        for attempt in range(attempts):
+            self._check_breaker()
+            last_attempt = attempt == attempts - 1
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(method, self.url(path), **kwargs)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                self._record(path, type(e).__name__, started)
+                self.breaker.record_failure()
+                if last_attempt:
+                    raise
+            except BaseException:
+                # Includes CancelledError when the ASGI client disconnects.
+                self.breaker.release_trial()
+                raise
+            else:
+                self._record(path, response.status_code, started)
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if last_attempt:
+                    return response
+            await asyncio.sleep(backoff_delay(attempt, self.retry_backoff))
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, idempotent=True, **kwargs)
+
+    async def post(self, path, idempotent=False, **kwargs):
+        return await self.request("POST", path, idempotent=idempotent, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+# httpx pools are bound to the event loop they were first used on.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """Return the process-wide DarajaClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = DarajaClient()
+    return _client
+
+
+def get_async_client():
+    """Return the AsyncDarajaClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncDarajaClient()
+    return client
+
+
+def reset_client():
+    global _client, _breaker
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _async_clients.clear()
+    with _breaker_lock:
+        _breaker = None
@@ -0,0 +1,218 @@
+"""Payload building and response handling shared by the sync and async views.
+
+The static fields of the STK push and query payloads are built once per
+configuration and the base64 password once per one-second timestamp, so a
+bulk run signing thousands of requests mostly copies a small dict. Bodies
+are serialised with orjson when it is installed.
+"""
+import base64
+import datetime
+import functools
+import json
+from decimal import Decimal
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+OAUTH_PATH = "/oauth/v1/generate"
+STK_PUSH_PATH = "/mpesa/stkpush/v1/processrequest"
+STK_QUERY_PATH = "/mpesa/stkpushquery/v1/query"
+
+# Common non-success query codes; mark as FAILED to unblock
+QUERY_FAILED_CODES = {'1032', '2001', '1', '2'}
+
+
+def dumps(payload):
+    """Serialise a request body to compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def new_timestamp():
+    return datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+
+
+@functools.lru_cache(maxsize=16)
+def _password(shortcode, passkey, timestamp):
+    return base64.b64encode((shortcode + passkey + timestamp).encode()).decode('utf-8')
+
+
+def stk_password(timestamp):
+    # Settings are passed in so override_settings and key rotation take effect.
+    return _password(settings.MPESA_SHORTCODE, settings.MPESA_PASSKEY, timestamp)
+
+
+def auth_headers(access_token):
+    return {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+
+@functools.lru_cache(maxsize=8)
+def _push_template(shortcode, callback_url):
+    return {
+        "BusinessShortCode": shortcode,
+        "TransactionType": "CustomerPayBillOnline",
+        "PartyB": shortcode,
+        "CallBackURL": callback_url,
+        "AccountReference": "Transact Demo",
+        "TransactionDesc": "Testing STK Push"
+    }
+
+
+def build_stk_push_payload(phone_number, amount):
+    timestamp = new_timestamp()
+    return {
+        **_push_template(settings.MPESA_SHORTCODE, settings.MPESA_CALLBACK_URL),
+        "Password": stk_password(timestamp),
+        "Timestamp": timestamp,
+        "Amount": amount,
+        "PartyA": phone_number,
+        "PhoneNumber": phone_number,
+    }
+
+
+def build_stk_query_payload(checkout_request_id):
+    timestamp = new_timestamp()
+    return {
+        "BusinessShortCode": settings.MPESA_SHORTCODE,
+        "Password": stk_password(timestamp),
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+
+
+def stk_push_request(phone_number, amount, access_token):
+    """Keyword arguments for ``client.post(STK_PUSH_PATH, ...)``."""
+    return {"json": build_stk_push_payload(phone_number, amount), "headers": auth_headers(access_token)}
+
+
+def stk_query_request(checkout_request_id, access_token):
+    """Keyword arguments for ``client.post(STK_QUERY_PATH, idempotent=True, ...)``."""
+    return {"json": build_stk_query_payload(checkout_request_id), "headers": auth_headers(access_token)}
+
+
+def parse_push_form(data):
+    """Validate the STK push form.
+
+    Returns ``(phone_number, amount, context)``; ``amount`` is None and
+    ``context['error']`` is set when the input is invalid.
+    """
+    phone_number = data.get('phone_number', '').strip()
+    amount_str = data.get('amount', '1').strip()
+    context = {"phone_number": phone_number, "amount": amount_str}
+
+    # Basic validation
+    try:
+        amount = int(float(amount_str))
+    except ValueError:
+        context.update({"error": "Amount must be a number."})
+        return phone_number, None, context
+
+    if not phone_number:
+        context.update({"error": "Phone number is required in MSISDN format e.g. 2547XXXXXXXX."})
+        return phone_number, None, context
+
+    return phone_number, amount, context
+
+
+def push_response_context(status_code, response):
+    """Describe an STK push response for the template.
+
+    Returns ``(context, checkout_request_id)``; the id is None unless Daraja
+    accepted the push, in which case ``context['accepted']`` is True.
+    """
+    context = {"mpesa_status": status_code}
+    # Try to parse response JSON; if not, include text
+    try:
+        context["mpesa_body"] = response.json()
+    except Exception:
+        context["mpesa_body_text"] = response.text
+
+    body = context.get('mpesa_body')
+    if status_code != 200 or not isinstance(body, dict):
+        return context, None
+
+    # Success acceptance code from Daraja is usually ResponseCode == "0"
+    if str(body.get('ResponseCode')) == '0':
+        context.update({
+            "accepted": True,
+            "message": "STK Push sent. Enter your M-PESA PIN on your phone to authorize. The status below updates when M-PESA confirms the payment.",
+        })
+        return context, body.get('CheckoutRequestID')
+
+    context.update({
+        "error": body.get('errorMessage') or "STK Push was not accepted",
+        "details": body,
+    })
+    return context, None
+
+
+def parse_callback(data):
+    """Extract the fields we act on from a Daraja STK callback body."""
+    stk = data.get("Body", {}).get("stkCallback", {})
+    parsed = {
+        # Normalize result code comparison
+        "result_ok": str(stk.get("ResultCode")) == '0',
+        "checkout_id": stk.get("CheckoutRequestID"),
+        "receipt": None,
+        "phone": None,
+        "amount": None,
+    }
+
+    # Extract metadata: receipt, phone, amount if present
+    metadata = stk.get("CallbackMetadata", {}).get("Item", [])
+    for item in metadata:
+        name = item.get("Name")
+        if name == "MpesaReceiptNumber":
+            parsed["receipt"] = item.get("Value")
+        elif name == "PhoneNumber":
+            parsed["phone"] = str(item.get("Value")) if item.get("Value") is not None else None
+        elif name in ("Amount", "TransactionAmount"):
+            parsed["amount"] = item.get("Value")
+    return parsed
+
+
+def callback_changes(parsed):
+    """Field values a parsed callback sets on its PENDING transaction."""
+    if not parsed["result_ok"]:
+        return {"status": 'FAILED'}
+
+    changes = {"status": 'SUCCESS'}
+    if parsed["receipt"]:
+        changes["mpesa_receipt_number"] = parsed["receipt"]
+    # Optionally update amount from callback
+    try:
+        if parsed["amount"] is not None:
+            # keep as Decimal by casting via str
+            changes["amount"] = Decimal(str(parsed["amount"]))
+    except Exception:
+        pass
+    return changes
+
+
+def parse_query_body(response):
+    try:
+        return response.json()
+    except Exception:
+        return {"raw": response.text}
+
+
+def query_outcome(status_code, body):
+    """Map an STK query response to ``(new_status, message)``.
+
+    ``new_status`` is None while the payment is still pending or unknown.
+    """
+    # Heuristic: if query ResultCode == 0 then success; specific messages may vary
+    result_code = str(body.get('ResultCode')) if isinstance(body, dict) else None
+    if result_code == '0':
+        return 'SUCCESS', "Payment confirmed SUCCESS by query."
+    if result_code in QUERY_FAILED_CODES:
+        return 'FAILED', f"Payment marked FAILED by query (code {result_code})."
+    return None, f"Query returned status code {status_code}. Still pending or unknown."
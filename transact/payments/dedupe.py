@@ -0,0 +1,128 @@
+"""Duplicate suppression and rate limits for STK push submissions.
+
+A submission is identified by its ``Idempotency-Key`` header, when given,
+and by its shortcode, phone number and amount within a short window. The
+first request claims those keys in the cache with ``add``. Repeats get the
+stored result, or an "in progress" answer while the first is still running,
+without touching the database or Daraja. Failures that never reached
+Daraja release the keys so a retry goes through.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .ratelimit import SharedRateLimiter
+
+IN_PROGRESS = "in-progress"
+IN_PROGRESS_CONTEXT = {
+    "error": "This payment request is already being processed.",
+    "details": "Check Transactions for its status instead of submitting again.",
+}
+
+
+def _cache():
+    return caches[settings.MPESA_GUARD_CACHE_ALIAS]
+
+
+def submission_keys(request, phone_number, amount):
+    """Return ``{cache_key: timeout}`` for the submission guards that apply."""
+    keys = {
+        f"payments:push:dup:{settings.MPESA_SHORTCODE}:{phone_number}:{amount}": settings.MPESA_DUPLICATE_WINDOW,
+    }
+    idempotency_key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key')
+    if idempotency_key:
+        keys[f"payments:push:idem:{idempotency_key[:128]}"] = settings.MPESA_IDEMPOTENCY_TTL
+    return keys
+
+
+def _previous(found):
+    # An idempotency key's stored result wins over the phone/amount window.
+    for key in sorted(found, key=lambda k: ':idem:' not in k):
+        if found[key] != IN_PROGRESS:
+            return found[key]
+    return IN_PROGRESS_CONTEXT
+
+
+def claim(keys):
+    """Claim the submission keys; returns None for a new submission or the context to replay."""
+    cache = _cache()
+    claimed = [key for key, timeout in keys.items() if cache.add(key, IN_PROGRESS, timeout=timeout)]
+    if len(claimed) == len(keys):
+        return None
+    cache.delete_many(claimed)
+    return _previous(cache.get_many(list(keys)))
+
+
+async def aclaim(keys):
+    cache = _cache()
+    claimed = [key for key, timeout in keys.items() if await cache.aadd(key, IN_PROGRESS, timeout=timeout)]
+    if len(claimed) == len(keys):
+        return None
+    await cache.adelete_many(claimed)
+    return _previous(await cache.aget_many(list(keys)))
+
+
+def remember(keys, context):
+    """Store the final response context so duplicates replay it."""
+    cache = _cache()
+    for key, timeout in keys.items():
+        cache.set(key, context, timeout=timeout)
+
+
+async def aremember(keys, context):
+    cache = _cache()
+    for key, timeout in keys.items():
+        await cache.aset(key, context, timeout=timeout)
+
+
+def release(keys):
+    _cache().delete_many(list(keys))
+
+
+async def arelease(keys):
+    await _cache().adelete_many(list(keys))
+
+
+def abandon(keys):
+    """Release the keys still marked in progress; a stored result is kept."""
+    cache = _cache()
+    cache.delete_many([key for key, value in cache.get_many(list(keys)).items() if value == IN_PROGRESS])
+
+
+async def aabandon(keys):
+    cache = _cache()
+    found = await cache.aget_many(list(keys))
+    await cache.adelete_many([key for key, value in found.items() if value == IN_PROGRESS])
+
+
+def _limiters():
+    return (
+        SharedRateLimiter("payments:rl:phone", settings.MPESA_PHONE_PUSH_LIMIT,
+                          settings.MPESA_PHONE_PUSH_PERIOD, cache_alias=settings.MPESA_GUARD_CACHE_ALIAS),
+        SharedRateLimiter("payments:rl:shortcode", settings.MPESA_SHORTCODE_PUSH_LIMIT,
+                          settings.MPESA_SHORTCODE_PUSH_PERIOD, cache_alias=settings.MPESA_GUARD_CACHE_ALIAS),
+    )
+
+
+def allow_push(phone_number):
+    """Count one push against the phone's and the shortcode's limits.
+
+    The phone's call is refunded when the shortcode limit rejects the push,
+    so a caller's quota isn't spent on pushes that were never sent.
+    """
+    phone_limiter, shortcode_limiter = _limiters()
+    if not phone_limiter.allow(phone_number):
+        return False
+    if shortcode_limiter.allow(settings.MPESA_SHORTCODE):
+        return True
+    phone_limiter.refund(phone_number)
+    return False
+
+
+async def aallow_push(phone_number):
+    phone_limiter, shortcode_limiter = _limiters()
+    if not await phone_limiter.aallow(phone_number):
+        return False
+    if await shortcode_limiter.aallow(settings.MPESA_SHORTCODE):
+        return True
+    await phone_limiter.arefund(phone_number)
+    return False
@@ -0,0 +1,111 @@
+"""Live transaction status for the Server-Sent Events endpoint.
+
+Waiting clients subscribe to an in-process hub keyed by transaction id and
+sleep on an ``asyncio.Queue``, so an idle connection costs one queue and
+no polling of the database. ``transactions_changed`` publishes final statuses
+to the hub. It also writes them to the cache named by
+PAYMENTS_EVENTS_CACHE_ALIAS. With a shared backend (Redis, Memcached) that
+key carries changes applied by other processes. Waiting streams check it
+every PAYMENTS_EVENTS_POLL_INTERVAL seconds.
+"""
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Transaction
+
+FINAL_STATUSES = ('SUCCESS', 'FAILED')
+
+
+def status_key(pk):
+    return f"payments:txn-status:{pk}"
+
+
+def _cache():
+    return caches[settings.PAYMENTS_EVENTS_CACHE_ALIAS]
+
+
+class StatusHub:
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def subscribe(self, pk):
+        """Yield a queue receiving every status published for ``pk``; call from the event loop."""
+        entry = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.setdefault(pk, set()).add(entry)
+        try:
+            yield entry[1]
+        finally:
+            with self._lock:
+                waiting = self._subscribers.get(pk)
+                waiting.discard(entry)
+                if not waiting:
+                    del self._subscribers[pk]
+
+    def publish(self, pk, status):
+        """Deliver ``status`` to subscribers of ``pk``; safe to call from any thread."""
+        with self._lock:
+            waiting = list(self._subscribers.get(pk, ()))
+        for loop, queue in waiting:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, status)
+            except RuntimeError:
+                # Event loop already closed; its stream is gone.
+                pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(waiting) for waiting in self._subscribers.values())
+
+
+hub = StatusHub()
+
+
+def publish_changes(sender=None, statuses=None, **kwargs):
+    """``transactions_changed`` receiver fanning final statuses out to waiting streams."""
+    final = {pk: status for pk, status in (statuses or {}).items() if status in FINAL_STATUSES}
+    if not final:
+        return
+    _cache().set_many({status_key(pk): status for pk, status in final.items()},
+                      timeout=settings.PAYMENTS_EVENTS_TIMEOUT)
+    for pk, status in final.items():
+        hub.publish(pk, status)
+
+
+def sse_message(pk, status):
+    return f"event: status\ndata: {json.dumps({'id': pk, 'status': status})}\n\n"
+
+
+async def status_stream(pk, timeout=None, poll_interval=None):
+    """Async iterator of SSE messages for one transaction.
+
+    Sends the current status at once and then the final status as soon as it
+    is published, ending the stream. Keep-alive comments are sent while
+    waiting, and the stream closes after ``timeout`` seconds.
+    """
+    timeout = settings.PAYMENTS_EVENTS_TIMEOUT if timeout is None else timeout
+    poll_interval = poll_interval or settings.PAYMENTS_EVENTS_POLL_INTERVAL
+    loop = asyncio.get_running_loop()
+    # Subscribe before reading the row so a change in between is not missed.
+    with hub.subscribe(pk) as queue:
+        status = await Transaction.objects.filter(pk=pk).values_list('status', flat=True).afirst()
+        yield sse_message(pk, status)
+        if status in FINAL_STATUSES:
+            return
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            try:
+                status = await asyncio.wait_for(queue.get(), min(poll_interval, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                status = await _cache().aget(status_key(pk))
+            if status in FINAL_STATUSES:
+                yield sse_message(pk, status)
+                return
+            yield ": keep-alive\n\n"
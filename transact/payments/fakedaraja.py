@@ -0,0 +1,118 @@
+"""In-process stand-in for the Daraja API, for tests and offline benchmarks.
+
+Serves the OAuth, STK push and STK query endpoints on a local port with
+configurable latency and error injection::
+
+    with FakeDaraja(latency=0.05, error_rate=0.01) as fake:
+        with override_settings(MPESA_BASE_URL=fake.url):
+            ...
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDaraja:
+    def __init__(self, latency=0.0, error_rate=0.0, query_result_code='0', seed=None):
+        # ``latency`` is seconds per request, or a dict keyed by path.
+        self.latency = latency
+        self.error_rate = error_rate
+        self.query_result_code = query_result_code
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so clients can keep connections alive between calls.
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake._handle(self)
+
+            def do_POST(self):
+                fake._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _delay(self, path):
+        latency = self.latency.get(path, 0) if isinstance(self.latency, dict) else self.latency
+        if latency:
+            time.sleep(latency)
+
+    def _should_fail(self):
+        with self._lock:
+            return self.error_rate and self._random.random() < self.error_rate
+
+    def _handle(self, handler):
+        path = handler.path.split('?', 1)[0]
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = json.loads(handler.rfile.read(length) or b'{}') if length else {}
+        with self._lock:
+            self.requests[path] += 1
+        self._delay(path)
+
+        if self._should_fail():
+            status, payload = 503, {"errorCode": "503.001.01", "errorMessage": "Injected failure"}
+        elif path == "/oauth/v1/generate":
+            status, payload = 200, {"access_token": "fake-token", "expires_in": "3599"}
+        elif path == "/mpesa/stkpush/v1/processrequest":
+            n = next(self._ids)
+            status, payload = 200, {
+                "MerchantRequestID": f"fake-merchant-{n}",
+                "CheckoutRequestID": f"ws_CO_fake_{n}",
+                "ResponseCode": "0",
+                "ResponseDescription": "Success. Request accepted for processing",
+                "CustomerMessage": "Success. Request accepted for processing",
+            }
+        elif path == "/mpesa/stkpushquery/v1/query":
+            status, payload = 200, {
+                "ResponseCode": "0",
+                "ResponseDescription": "The service request has been accepted successsfully",
+                "MerchantRequestID": "fake-merchant",
+                "CheckoutRequestID": body.get("CheckoutRequestID"),
+                "ResultCode": self.query_result_code,
+                "ResultDesc": "The service request is processed successfully.",
+            }
+        else:
+            status, payload = 404, {"errorMessage": f"Unknown path {path}"}
+
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
@@ -0,0 +1,89 @@
+"""Non-blocking JSON-lines logging for the payment views.
+
+``QueueingHandler`` only puts records on an in-memory queue. A
+``QueueListener`` thread formats them as one JSON object per line and
+writes them to stdout, so a slow log pipe never stalls a request. When the
+queue is full (``maxsize``, PAYMENTS_LOG_QUEUE_SIZE in settings) records
+are dropped and counted rather than waited on. Fields passed with ``extra=`` become keys in the
+JSON object.
+
+This module is imported by ``LOGGING`` while settings load; keep it free of
+model and settings imports.
+"""
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from contextlib import contextmanager
+
+# Attributes every LogRecord has; anything else came in through ``extra=``.
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """Hands records to a background listener; never blocks the caller."""
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        target = logging.StreamHandler(stream or sys.stdout)
+        target.setFormatter(JsonFormatter())
+        self.dropped = 0
+        self._stopped = False
+        self.listener = logging.handlers.QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        # Resolve args and the traceback on the calling thread, while they are
+        # still valid; JSON encoding is left to the listener.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = self.listener.handlers[0].formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Drains the queue; logging.shutdown() calls this at exit.
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+        super().close()
+
+
+@contextmanager
+def quiet(name='payments', level=logging.WARNING):
+    """Drop records below ``level`` from logger ``name`` for the duration (benchmarks)."""
+    logger = logging.getLogger(name)
+    previous = logger.level
+    logger.setLevel(level)
+    try:
+        yield
+    finally:
+        logger.setLevel(previous)
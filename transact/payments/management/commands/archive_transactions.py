@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.archive import archive_settled
+
+
+class Command(BaseCommand):
+    help = "Move SUCCESS and FAILED transactions older than the retention window to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.PAYMENTS_ARCHIVE_AFTER_DAYS,
+                            help="Archive settled rows created more than this many days ago.")
+        parser.add_argument("--batch-size", type=int, default=settings.PAYMENTS_ARCHIVE_BATCH_SIZE,
+                            help="Rows moved per database transaction.")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many rows.")
+
+    def handle(self, *args, **options):
+        def progress(moved):
+            self.stdout.write(f"archived={moved}")
+
+        moved = archive_settled(
+            days=options["days"],
+            batch_size=options["batch_size"],
+            pause=options["pause"],
+            limit=options["limit"],
+            progress=progress if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} transactions older than {options['days']} days."))
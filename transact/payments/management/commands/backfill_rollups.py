@@ -0,0 +1,52 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from payments.models import ArchivedTransaction, Transaction, hour_bucket
+from payments.rollups import rebuild
+
+
+def _parse_day(value):
+    try:
+        day = datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}; use YYYY-MM-DD.")
+    return datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+
+
+class Command(BaseCommand):
+    help = "Recompute hourly TransactionRollup rows from live and archived transactions, one window at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="First day to rebuild (YYYY-MM-DD); defaults to the oldest transaction.")
+        parser.add_argument("--until", help="Day to stop before (YYYY-MM-DD); defaults to the current hour.")
+        parser.add_argument("--window-hours", type=int, default=24,
+                            help="Hours recomputed per database transaction.")
+
+    def handle(self, *args, **options):
+        if options["since"]:
+            start = _parse_day(options["since"])
+        else:
+            oldest = min((
+                created_at for model in (Transaction, ArchivedTransaction)
+                if (created_at := model.objects.aggregate(oldest=Min("created_at"))["oldest"])
+            ), default=None)
+            if oldest is None:
+                self.stdout.write("No transactions to roll up.")
+                return
+            start = hour_bucket(oldest)
+        # The current hour is still being written; the live deltas own it.
+        end = _parse_day(options["until"]) if options["until"] else hour_bucket(timezone.now())
+        step = datetime.timedelta(hours=max(options["window_hours"], 1))
+
+        windows = written = 0
+        while start < end:
+            stop = min(start + step, end)
+            written += rebuild(start, stop)
+            windows += 1
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{start:%Y-%m-%d %H:00} - {stop:%Y-%m-%d %H:00}")
+            start = stop
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {windows} windows, {written} rollup rows."))
@@ -0,0 +1,53 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from payments.benchmarks import seed_transactions, summarize, timed
+from payments.models import Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure stk_callback lookup latency (by CheckoutRequestID, by receipt and the "
+        "pending-by-phone fallback) as the Transaction table grows. Seed rows are "
+        "inserted inside a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000",
+                            help="Comma-separated table sizes to measure at.")
+        parser.add_argument("--lookups", type=int, default=500,
+                            help="Lookups of each kind per table size.")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(s) for s in options["sizes"].split(","))
+        self.stdout.write(f"{'rows':>10}  {'lookup':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        with transaction.atomic():
+            checkout_ids = []
+            for size in sizes:
+                checkout_ids += seed_transactions(size - len(checkout_ids), offset=len(checkout_ids))
+                for name, lookup in self.lookups(checkout_ids).items():
+                    samples = [timed(lookup)[0] for _ in range(options["lookups"])]
+                    stats = summarize(samples)
+                    self.stdout.write(
+                        f"{size:>10}  {name:<18}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+                    )
+            transaction.set_rollback(True)
+
+    def lookups(self, checkout_ids):
+        def by_checkout_id():
+            return Transaction.objects.filter(checkout_request_id=random.choice(checkout_ids)).first()
+
+        def by_receipt():
+            return Transaction.objects.filter(mpesa_receipt_number=f"R{random.randrange(len(checkout_ids)):09d}").first()
+
+        def pending_by_phone():
+            phone = f"2547{random.randrange(len(checkout_ids)):08d}"
+            return Transaction.objects.filter(phone_number=phone, status='PENDING').order_by('-created_at').first()
+
+        return {
+            "checkout_id": by_checkout_id,
+            "receipt": by_receipt,
+            "pending_by_phone": pending_by_phone,
+        }
@@ -0,0 +1,68 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from payments.benchmarks import run_scenarios, throwaway_database
+from payments.client import reset_client
+from payments.fakedaraja import FakeDaraja
+from payments.utils import token_manager
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark initiate_stk_push, stk_callback, transactions_list and query_stk_status "
+        "against an in-process fake Daraja server and a throwaway test database. Runs "
+        "offline and writes a JSON report for comparison between commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Requests per view.")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--seed-rows", type=int, default=10000,
+                            help="Transactions inserted before measuring.")
+        parser.add_argument("--latency", type=float, default=0.02,
+                            help="Fake Daraja latency per request, in seconds.")
+        parser.add_argument("--error-rate", type=float, default=0.0,
+                            help="Fraction of fake Daraja requests answered with a 503.")
+        parser.add_argument("--output", default="benchmark-results.json")
+
+    def handle(self, *args, **options):
+        with throwaway_database(), FakeDaraja(
+            latency=options["latency"], error_rate=options["error_rate"], seed=0,
+        ) as fake:
+            # Tiny backoff so injected errors don't dominate the numbers.
+            with override_settings(MPESA_BASE_URL=fake.url, MPESA_CALLBACK_MODE="inline",
+                                   MPESA_RETRY_BACKOFF=0.01):
+                reset_client()
+                token_manager.invalidate()
+                scenarios = run_scenarios(
+                    requests=options["requests"],
+                    concurrency=options["concurrency"],
+                    seed_rows=options["seed_rows"],
+                )
+                upstream_calls = dict(fake.requests)
+                reset_client()
+                token_manager.invalidate()
+
+        report = {
+            "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "backend": connection.vendor,
+            "config": {k: options[k] for k in ("requests", "concurrency", "seed_rows", "latency", "error_rate")},
+            "upstream_calls": upstream_calls,
+            "token_cache": token_manager.stats(),
+            "scenarios": scenarios,
+        }
+        with open(options["output"], "w") as fh:
+            json.dump(report, fh, indent=2)
+
+        for name, result in scenarios.items():
+            latency = result["latency"]
+            self.stdout.write(
+                f"{name:<20}{result['throughput_rps']:>9} req/s  p50 {latency['p50_ms']:>8} ms  "
+                f"p95 {latency['p95_ms']:>8} ms  p99 {latency['p99_ms']:>8} ms  "
+                f"queries {result['queries_per_request']['avg']:>5}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
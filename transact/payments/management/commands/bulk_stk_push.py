@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments import audit
+from payments.bulk import bulk_initiate, read_rows
+
+
+class Command(BaseCommand):
+    help = "Send STK pushes for every phone,amount row in a CSV or JSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV with a phone,amount header, or a JSON list of rows.")
+        parser.add_argument("--workers", type=int, default=settings.MPESA_BULK_WORKERS,
+                            help="Concurrent upstream pushes.")
+        parser.add_argument("--rate", type=float, default=settings.MPESA_PUSH_RATE_LIMIT,
+                            help="Maximum pushes per second (0 = unlimited).")
+        parser.add_argument("--batch-size", type=int, default=100,
+                            help="Write CheckoutRequestIDs back every this many pushes.")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        content_type = "text/csv" if path.suffix.lower() == ".csv" else "application/json"
+        try:
+            rows = read_rows(path.read_bytes(), content_type)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read {path}: {e}")
+
+        for event in bulk_initiate(rows, workers=options["workers"], rate=options["rate"],
+                                   batch_size=options["batch_size"]):
+            kind = event["event"]
+            if kind == "invalid":
+                self.stderr.write(f"row {event['row']}: {event['error']}")
+            elif kind == "error":
+                raise CommandError(event["error"])
+            elif kind == "created":
+                self.stdout.write(f"Created {event['count']} PENDING transactions")
+            elif kind == "progress":
+                self.stdout.write(
+                    f"sent={event['sent']}/{event['total']} accepted={event['accepted']} failed={event['failed']}"
+                )
+            elif kind == "done":
+                audit.flush(force=True)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{event['rows']} rows: {event['accepted']} accepted, {event['failed']} failed, "
+                    f"{event['invalid']} invalid"
+                ))
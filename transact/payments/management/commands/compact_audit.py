@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.audit import compact
+
+
+class Command(BaseCommand):
+    help = "Compress the payloads of audit records older than the retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.PAYMENTS_AUDIT_COMPRESS_AFTER_DAYS,
+                            help="Compress records created more than this many days ago.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows compressed per UPDATE batch.")
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many rows.")
+
+    def handle(self, *args, **options):
+        done = compact(days=options["days"], batch_size=options["batch_size"], limit=options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"Compressed {done} audit records older than {options['days']} days."))
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.export import FORMATS, export_chunks
+from payments.pagination import clean_filters
+
+
+class Command(BaseCommand):
+    help = "Stream transactions as CSV or JSON Lines for settlement and accounting."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--status", default="", help="PENDING, SUCCESS or FAILED.")
+        parser.add_argument("--phone", default="")
+        parser.add_argument("--start", default="", help="First day to include (YYYY-MM-DD).")
+        parser.add_argument("--end", default="", help="Last day to include (YYYY-MM-DD).")
+        parser.add_argument("--output", default="-", help="File to write; '-' for stdout.")
+        parser.add_argument("--chunk-size", type=int, default=settings.PAYMENTS_EXPORT_CHUNK_SIZE,
+                            help="Rows fetched per database round trip.")
+
+    def handle(self, *args, **options):
+        filters = clean_filters({name: options[name] for name in ("status", "phone", "start", "end")})
+        for name in ("status", "start", "end"):
+            if options[name] and name not in filters:
+                raise CommandError(f"Invalid --{name}: {options[name]!r}")
+
+        chunks = export_chunks(filters, options["format"], options["chunk_size"])
+        if options["output"] == "-":
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+        with open(options["output"], "w", encoding="utf-8", newline="") as out:
+            for chunk in chunks:
+                out.write(chunk)
+        self.stderr.write(f"Wrote {options['output']}")
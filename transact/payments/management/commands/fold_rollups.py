@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.rollups import fold_deltas
+
+
+class Command(BaseCommand):
+    help = "Fold appended rollup deltas into the hourly TransactionRollup rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--once", action="store_true",
+                            help="Fold the pending deltas once and exit instead of polling.")
+        parser.add_argument("--idle-sleep", type=float, default=2.0,
+                            help="Seconds to wait when no deltas are pending.")
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                folded = fold_deltas(options["batch_size"])
+                total += folded
+                if folded:
+                    self.stdout.write(f"Folded {folded} deltas ({total} total)")
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["idle_sleep"])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Folded {total} rollup deltas"))
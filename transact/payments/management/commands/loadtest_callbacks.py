@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from payments.benchmarks import run_concurrently, seed_transactions, summarize, throwaway_database
+from payments.log import quiet
+
+
+def callback_payload(checkout_id, receipt):
+    return {"Body": {"stkCallback": {
+        "CheckoutRequestID": checkout_id,
+        "ResultCode": 0,
+        "ResultDesc": "The service request is processed successfully.",
+        "CallbackMetadata": {"Item": [
+            {"Name": "MpesaReceiptNumber", "Value": receipt},
+            {"Name": "Amount", "Value": 1},
+        ]},
+    }}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent STK callbacks at stk_callback against a throwaway test database "
+        "on the configured backend and report throughput and latency. Run once per "
+        "DB_ENGINE to compare backends."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--callbacks", type=int, default=2000)
+        parser.add_argument("--concurrency", default="1,4,16",
+                            help="Comma-separated worker thread counts to run in turn.")
+
+    def handle(self, *args, **options):
+        url = reverse("stk_callback")
+        levels = [int(c) for c in options["concurrency"].split(",")]
+        self.stdout.write(f"backend={connection.vendor} callbacks/level={options['callbacks']}")
+        self.stdout.write(f"{'threads':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+
+        seeded = 0
+        with throwaway_database():
+            for level in levels:
+                checkout_ids = seed_transactions(
+                    options["callbacks"], offset=seeded, pending_ratio=1,
+                )
+                seeded += len(checkout_ids)
+                bodies = [callback_payload(c, f"LT{seeded}{i:08d}") for i, c in enumerate(checkout_ids)]
+
+                def post(body):
+                    response = Client(SERVER_NAME="localhost").post(url, body, content_type="application/json")
+                    if response.status_code != 200:
+                        raise RuntimeError(f"status {response.status_code}")
+
+                # Keep the view's per-callback log lines out of the report.
+                with quiet():
+                    elapsed, results = run_concurrently(post, bodies, level)
+                errors = sum(isinstance(result, Exception) for _, result in results)
+                stats = summarize([latency for latency, _ in results])
+                self.stdout.write(
+                    f"{level:>8}{len(results) / elapsed:>10.1f}{stats['p50_ms']:>10}"
+                    f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{errors:>8}"
+                )
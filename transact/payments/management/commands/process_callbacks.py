@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.callbacks import drain_inbox
+
+
+class Command(BaseCommand):
+    help = "Apply queued STK callbacks (MPESA_CALLBACK_MODE=queue) in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--once", action="store_true",
+                            help="Drain the queue once and exit instead of polling.")
+        parser.add_argument("--idle-sleep", type=float, default=0.5,
+                            help="Seconds to wait when the queue is empty.")
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                consumed = drain_inbox(options["batch_size"])
+                total += consumed
+                if consumed:
+                    self.stdout.write(f"Applied {consumed} callbacks ({total} total)")
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["idle_sleep"])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} callbacks"))
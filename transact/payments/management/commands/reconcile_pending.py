@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments import audit
+from payments.reconcile import reconcile
+
+
+class Command(BaseCommand):
+    help = "Resolve stale PENDING transactions by querying Daraja's STK status API in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=settings.MPESA_RECONCILE_AFTER,
+                            help="Only rows created at least this many seconds ago.")
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many rows.")
+        parser.add_argument("--workers", type=int, default=settings.MPESA_RECONCILE_WORKERS,
+                            help="Concurrent upstream queries.")
+        parser.add_argument("--rate", type=float, default=settings.MPESA_QUERY_RATE_LIMIT,
+                            help="Maximum upstream queries per second (0 = unlimited).")
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--loop", action="store_true", help="Keep reconciling every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        def progress(report):
+            self.stdout.write(
+                f"scanned={report['scanned']} success={report['success']} failed={report['failed']} "
+                f"pending={report['pending']} errors={report['errors']}"
+            )
+
+        while True:
+            report = reconcile(
+                older_than=options["older_than"],
+                limit=options["limit"],
+                workers=options["workers"],
+                rate=options["rate"],
+                batch_size=options["batch_size"],
+                progress=progress if options["verbosity"] > 1 else None,
+            )
+            audit.flush(force=True)
+            self.stdout.write(self.style.SUCCESS(
+                f"Reconciled {report['scanned']} rows in {report['seconds']}s ({report['per_second']}/s): "
+                f"{report['success']} success, {report['failed']} failed, "
+                f"{report['pending']} still pending, {report['errors']} errors"
+            ))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,226 @@
+"""In-process metrics for the payment flows, exported in Prometheus text format.
+
+Counters and histograms are plain dicts behind a lock, so recording costs a
+few microseconds. Per-request stage timings are collected in a context
+variable. They are emitted as a ``Server-Timing`` header by
+``payments.middleware.ServerTimingMiddleware``.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        series = self._series.get(key)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}"
+                    )
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a callable returning extra exposition lines at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collector in self._collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "payments_request_seconds", "Time spent handling payment views.", ["view", "status"],
+))
+STAGE_SECONDS = registry.register(Histogram(
+    "payments_stage_seconds", "Time spent in each stage of a payment view.", ["view", "stage"],
+))
+UPSTREAM_SECONDS = registry.register(Histogram(
+    "payments_upstream_seconds", "Daraja call latency by endpoint and HTTP status.", ["endpoint", "status"],
+))
+UPSTREAM_REQUESTS = registry.register(Counter(
+    "payments_upstream_requests_total", "Daraja calls by endpoint and HTTP status.", ["endpoint", "status"],
+))
+DB_SECONDS = registry.register(Histogram(
+    "payments_db_seconds", "Database time per payment request.", ["view"],
+))
+QUERY_REQUESTS = registry.register(Counter(
+    "payments_stk_query_total", "STK status queries by how they were answered.", ["source"],
+))
+DB_QUERIES = registry.register(Histogram(
+    "payments_db_queries", "SQL queries per payment request.", ["view"],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100),
+))
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = ""
+        self.stages = {}
+        self.db_seconds = 0.0
+        self.db_queries = 0
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f'db;desc="{self.db_queries} queries";dur={self.db_seconds * 1000:.1f}')
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current = contextvars.ContextVar("payments_request_timings", default=None)
+
+
+def begin_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a named stage of the current payment request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+            STAGE_SECONDS.observe(elapsed, view=timings.view, stage=name)
+        else:
+            STAGE_SECONDS.observe(elapsed, view="", stage=name)
+
+
+def record_upstream(endpoint, status, seconds):
+    status = str(status)
+    UPSTREAM_SECONDS.observe(seconds, endpoint=endpoint, status=status)
+    UPSTREAM_REQUESTS.inc(endpoint=endpoint, status=status)
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    """Connection execute wrapper that charges query time to the current request."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_seconds += time.perf_counter() - start
+        timings.db_queries += 1
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    """``connection_created`` receiver adding db_execute_wrapper to new connections."""
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_wrapper)
+
+
+def runtime_collector():
+    """Token cache counters and circuit breaker state as exposition lines."""
+    from .client import CircuitBreaker, get_breaker
+    from .utils import token_manager
+
+    lines = ["# HELP payments_token_cache_total Daraja OAuth token cache events.",
+             "# TYPE payments_token_cache_total counter"]
+    for event, value in token_manager.stats().items():
+        lines.append(f'payments_token_cache_total{{event="{event}"}} {value}')
+    lines += ["# HELP payments_circuit_open Whether the Daraja circuit breaker is rejecting calls.",
+              "# TYPE payments_circuit_open gauge",
+              f"payments_circuit_open {int(get_breaker().state == CircuitBreaker.OPEN)}"]
+    return lines
@@ -0,0 +1,103 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+
+from . import routers
+from .metrics import DB_QUERIES, DB_SECONDS, REQUEST_SECONDS, begin_request, current_timings, end_request
+
+
+class ServerTimingMiddleware:
+    """Times each request and adds a ``Server-Timing`` header.
+
+    Stage timings recorded with ``payments.metrics.stage`` and the database
+    time and query count of the request are reported in the header and fed
+    into the histograms served at ``/metrics``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(response, timings)
+
+    async def __acall__(self, request):
+        timings, token = begin_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(response, timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current_timings()
+        if timings is not None and request.resolver_match:
+            timings.view = request.resolver_match.view_name
+
+    def finish(self, response, timings):
+        total = time.perf_counter() - timings.started
+        response["Server-Timing"] = timings.server_timing(total)
+        if timings.view:
+            REQUEST_SECONDS.observe(total, view=timings.view, status=response.status_code)
+            DB_SECONDS.observe(timings.db_seconds, view=timings.view)
+            DB_QUERIES.observe(timings.db_queries, view=timings.view)
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """Read-your-writes stickiness for ``payments.routers.PrimaryReplicaRouter``.
+
+    Requests that write set a short-lived cookie. While it is present, and
+    for any non-GET/HEAD request, reads go to the primary instead of a
+    possibly lagging replica.
+    """
+
+    COOKIE = "payments_pin_primary"
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _begin(self, request):
+        pinned = request.method not in ("GET", "HEAD") or self.COOKIE in request.COOKIES
+        return routers.begin_request(pinned)
+
+    def _finish(self, response, state):
+        if state.wrote:
+            response.set_cookie(self.COOKIE, "1", max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self._begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.end_request(token)
+        return self._finish(response, state)
+
+    async def __acall__(self, request):
+        state, token = self._begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.end_request(token)
+        return self._finish(response, state)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(fields=["-created_at", "-id"], name="txn_created_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(fields=["status", "-created_at", "-id"], name="txn_status_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(fields=["phone_number", "-created_at", "-id"], name="txn_phone_created_idx"),
+        ),
+    ]
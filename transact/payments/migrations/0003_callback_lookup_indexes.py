@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0002_transaction_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="transaction",
+            name="checkout_request_id",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="mpesa_receipt_number",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["phone_number", "-created_at"],
+                name="txn_pending_phone_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0005_transactionrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedTransaction",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("phone_number", models.CharField(max_length=13)),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "checkout_request_id",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                (
+                    "mpesa_receipt_number",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("SUCCESS", "Success"),
+                            ("FAILED", "Failed"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("created_at", models.DateTimeField()),
+                ("updated_at", models.DateTimeField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["checkout_request_id"], name="archive_checkout_idx"
+                    ),
+                    models.Index(
+                        fields=["mpesa_receipt_number"], name="archive_receipt_idx"
+                    ),
+                    models.Index(
+                        fields=["phone_number", "-created_at"],
+                        name="archive_phone_created_idx",
+                    ),
+                    models.Index(
+                        fields=["-created_at", "-id"], name="archive_created_id_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
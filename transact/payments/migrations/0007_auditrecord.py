@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0006_archivedtransaction"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuditRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("callback", "STK callback"),
+                            ("push", "STK push response"),
+                            ("query", "STK query response"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "checkout_request_id",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                ("receipt", models.CharField(blank=True, max_length=100, null=True)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("payload", models.TextField(blank=True, default="")),
+                ("compressed", models.BinaryField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["checkout_request_id"], name="audit_checkout_idx"
+                    ),
+                    models.Index(fields=["receipt"], name="audit_receipt_idx"),
+                    models.Index(
+                        condition=models.Q(("compressed__isnull", True)),
+                        fields=["created_at", "id"],
+                        name="audit_uncompressed_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0008_rollupdelta"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="rollupdelta",
+            index=models.Index(
+                fields=["bucket", "status"], name="rollupdelta_bucket_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0009_rollupdelta_bucket_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="callbackevent",
+            name="retry_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
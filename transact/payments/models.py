@@ -1,4 +1,58 @@
-from django.db import models
+import datetime
+import zlib
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .signals import send_changed
+
+
+def hour_bucket(moment):
+    """Start of the UTC hour containing ``moment``; rollups are kept per hour."""
+    return moment.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def add_rollup_delta(deltas, created_at, status, amount, sign=1):
+    """Accumulate one row's contribution into a ``{(bucket, status): [count, amount]}`` dict."""
+    delta = deltas.setdefault((hour_bucket(created_at), status), [0, 0])
+    delta[0] += sign
+    delta[1] += sign * Decimal(str(amount))
+    return deltas
+
+
+class TransactionQuerySet(models.QuerySet):
+    def pending(self):
+        return self.filter(status='PENDING')
+
+    def transition(self, **changes):
+        """Apply ``changes`` to the PENDING rows of this queryset only.
+
+        Final states are never overwritten, so a retried callback or a query
+        racing a callback becomes a no-op. The move between rollup status
+        buckets is appended as ``RollupDelta`` rows in the same database
+        transaction. Returns the number of rows changed.
+        """
+        with transaction.atomic():
+            rows = list(self.pending().select_for_update().values_list('pk', 'created_at', 'amount'))
+            if not rows:
+                return 0
+            changed = self.model.objects.filter(pk__in=[pk for pk, _, _ in rows]).pending().update(
+                updated_at=timezone.now(), **changes
+            )
+            deltas = {}
+            for _, created_at, amount in rows:
+                add_rollup_delta(deltas, created_at, 'PENDING', amount, sign=-1)
+                add_rollup_delta(deltas, created_at, changes.get('status', 'PENDING'), changes.get('amount', amount))
+            RollupDelta.objects.record(deltas)
+            send_changed(self.model, {pk: changes.get('status', 'PENDING') for pk, _, _ in rows})
+            return changed
+
+    async def atransition(self, **changes):
+        return await sync_to_async(self.transition)(**changes)
+
 
 class Transaction(models.Model):
     STATUS_CHOICES = [
@@ -9,11 +63,220 @@ class Transaction(models.Model):
 
     phone_number = models.CharField(max_length=13)  # e.g. 2547XXXXXXXX
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    checkout_request_id = models.CharField(max_length=100, blank=True, null=True)  # from Daraja
-    mpesa_receipt_number = models.CharField(max_length=100, blank=True, null=True)  # after success
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True, unique=True)  # from Daraja
+    mpesa_receipt_number = models.CharField(max_length=100, blank=True, null=True, unique=True)  # after success
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the transactions list, newest first
+            models.Index(fields=['-created_at', '-id'], name='txn_created_id_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='txn_status_created_idx'),
+            models.Index(fields=['phone_number', '-created_at', '-id'], name='txn_phone_created_idx'),
+            # stk_callback fallback: latest PENDING row for a phone number
+            models.Index(
+                fields=['phone_number', '-created_at'],
+                condition=models.Q(status='PENDING'),
+                name='txn_pending_phone_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.phone_number} - {self.amount} - {self.status}"
+
+
+class ArchivedTransaction(models.Model):
+    """A settled Transaction moved out of the hot table by archive_transactions.
+
+    Keeps the original primary key, so ids stay valid across both tiers.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    phone_number = models.CharField(max_length=13)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True)
+    mpesa_receipt_number = models.CharField(max_length=100, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=Transaction.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Historical lookups by Daraja ids and per-customer history
+            models.Index(fields=['checkout_request_id'], name='archive_checkout_idx'),
+            models.Index(fields=['mpesa_receipt_number'], name='archive_receipt_idx'),
+            models.Index(fields=['phone_number', '-created_at'], name='archive_phone_created_idx'),
+            models.Index(fields=['-created_at', '-id'], name='archive_created_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.phone_number} - {self.amount} - {self.status} (archived)"
+
+
+class TransactionRollupQuerySet(models.QuerySet):
+    def add(self, deltas):
+        """Add ``{(bucket, status): [count, amount]}`` deltas to the rollup rows.
+
+        Each bucket costs one ``UPDATE ... SET count = count + n``; a missing
+        bucket is inserted, and an insert race falls back to the update.
+        Keys are applied in sorted order so concurrent writers lock rows in
+        the same order. Only ``rollups.fold_deltas`` and ``rebuild`` write
+        here; request paths append ``RollupDelta`` rows instead.
+        """
+        for (bucket, status), (count, amount) in sorted(deltas.items()):
+            if not count and not amount:
+                continue
+            rows = self.filter(bucket=bucket, status=status)
+            increment = {"count": F('count') + count, "amount": F('amount') + amount}
+            if rows.update(**increment):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(bucket=bucket, status=status, count=count, amount=amount)
+            except IntegrityError:
+                rows.update(**increment)
+
+
+class TransactionRollup(models.Model):
+    """Transaction count and summed amount per UTC hour and status.
+
+    Rows are bucketed by ``Transaction.created_at``, so a transaction
+    contributes to the same hour from creation through its final status.
+    """
+
+    bucket = models.DateTimeField()  # start of the hour, UTC
+    status = models.CharField(max_length=10, choices=Transaction.STATUS_CHOICES)
+    count = models.BigIntegerField(default=0)
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    objects = TransactionRollupQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'status'], name='rollup_bucket_status_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.status}: {self.count}"
+
+
+class RollupDeltaQuerySet(models.QuerySet):
+    def record(self, deltas):
+        """Append ``{(bucket, status): [count, amount]}`` deltas with one INSERT."""
+        self.bulk_create([
+            RollupDelta(bucket=bucket, status=status, count=count, amount=amount)
+            for (bucket, status), (count, amount) in sorted(deltas.items())
+            if count or amount
+        ])
+
+
+class RollupDelta(models.Model):
+    """A pending change to one ``TransactionRollup`` row.
+
+    Pushes and callbacks only ever insert these, so concurrent writers in
+    the same hour never wait on a shared counter row.
+    ``rollups.fold_deltas`` (run by fold_rollups, or by ``summary`` once
+    more than PAYMENTS_ROLLUP_FOLD_THRESHOLD are pending) sums them into the
+    hourly rows and deletes them.
+    """
+
+    bucket = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Transaction.STATUS_CHOICES)
+    count = models.BigIntegerField()
+    amount = models.DecimalField(max_digits=16, decimal_places=2)
+
+    objects = RollupDeltaQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # summary() and rebuild() filter unfolded deltas by hour
+            models.Index(fields=['bucket', 'status'], name='rollupdelta_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.status}: {self.count:+d}"
+
+
+class CallbackEventQuerySet(models.QuerySet):
+    def pending(self):
+        return self.filter(processed_at__isnull=True)
+
+    def due(self, now):
+        """Pending events that aren't waiting out a retry delay."""
+        return self.pending().filter(models.Q(retry_at__isnull=True) | models.Q(retry_at__lte=now))
+
+
+class CallbackEvent(models.Model):
+    """Raw Daraja callback queued for the process_callbacks worker."""
+
+    payload = models.TextField()  # request body exactly as received
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Set while an event whose transaction wasn't found waits to be retried
+    retry_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+
+    objects = CallbackEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Worker scans only the unprocessed tail of the queue
+            models.Index(
+                fields=['id'],
+                condition=models.Q(processed_at__isnull=True),
+                name='callback_unprocessed_idx',
+            ),
+        ]
+
+    def __str__(self):
+        state = 'processed' if self.processed_at else 'queued'
+        return f"Callback {self.pk} ({state})"
+
+
+class AuditRecord(models.Model):
+    """Raw Daraja callback or response body, kept for disputes.
+
+    Append-only: written in batches by ``payments.audit`` and compressed in
+    place by compact_audit once older than PAYMENTS_AUDIT_COMPRESS_AFTER_DAYS.
+    """
+
+    KIND_CHOICES = [
+        ('callback', 'STK callback'),
+        ('push', 'STK push response'),
+        ('query', 'STK query response'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True)
+    receipt = models.CharField(max_length=100, blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    payload = models.TextField(blank=True, default='')  # emptied once compressed
+    compressed = models.BinaryField(blank=True, null=True)  # zlib of the payload
+
+    class Meta:
+        indexes = [
+            # Dispute lookups by Daraja ids
+            models.Index(fields=['checkout_request_id'], name='audit_checkout_idx'),
+            models.Index(fields=['receipt'], name='audit_receipt_idx'),
+            # compact_audit walks the uncompressed rows oldest first
+            models.Index(
+                fields=['created_at', 'id'],
+                condition=models.Q(compressed__isnull=True),
+                name='audit_uncompressed_idx',
+            ),
+        ]
+
+    def body(self):
+        """The payload as recorded, decompressing if needed."""
+        if self.compressed is not None:
+            return zlib.decompress(self.compressed).decode('utf-8')
+        return self.payload
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.checkout_request_id or self.pk}"
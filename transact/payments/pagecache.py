@@ -0,0 +1,72 @@
+"""Cache of rendered transactions list pages.
+
+Keys combine a global list version with the page's filters and cursor. Any
+``transactions_changed`` signal bumps the version, so every cached page goes
+stale at once and old entries simply expire. A repeated view of unchanged
+data costs two cache reads and no database queries.
+
+The bump only reaches other processes (callback workers, archiving,
+reconcile, other web workers) through a shared cache backend. With the
+per-process local-memory cache, pages are kept for at most
+PAYMENTS_LIST_CACHE_LOCAL_TIMEOUT seconds instead.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from .pagination import clean_filters
+
+VERSION_KEY = "payments:list:version"
+
+
+def _cache():
+    return caches[settings.PAYMENTS_LIST_CACHE_ALIAS]
+
+
+def is_shared():
+    """Whether a version bump in one process is seen by the others."""
+    return not isinstance(_cache(), LocMemCache)
+
+
+def page_timeout():
+    if is_shared():
+        return settings.PAYMENTS_LIST_CACHE_TIMEOUT
+    return min(settings.PAYMENTS_LIST_CACHE_TIMEOUT, settings.PAYMENTS_LIST_CACHE_LOCAL_TIMEOUT)
+
+
+def list_version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seeded from the clock so an evicted counter never reuses old keys.
+        version = time.time_ns()
+        if not cache.add(VERSION_KEY, version, timeout=None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump_version(sender=None, **kwargs):
+    """``transactions_changed`` receiver invalidating every cached page."""
+    cache = _cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def page_key(params):
+    page = {**clean_filters(params), 'cursor': params.get('cursor', '')}
+    digest = hashlib.sha1(urlencode(sorted(page.items())).encode()).hexdigest()
+    return f"payments:list:{list_version()}:{digest}"
+
+
+def get_page(key):
+    return _cache().get(key)
+
+
+def set_page(key, content):
+    _cache().set(key, content, timeout=page_timeout())
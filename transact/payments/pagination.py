@@ -0,0 +1,120 @@
+"""Keyset pagination and filtering for the transactions list.
+
+Pages are ordered by ``(created_at, id)`` descending and continue from an
+opaque cursor instead of an OFFSET, so every page is an index range scan of
+``page_size + 1`` rows no matter how deep the page or how large the table.
+"""
+import base64
+import binascii
+import datetime
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Transaction
+
+ORDERING = ('-created_at', '-id')
+FILTER_PARAMS = ('status', 'phone', 'start', 'end')
+
+
+def encode_cursor(txn):
+    raw = f"{txn.created_at.isoformat()}|{txn.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id)`` or None for a missing or malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _parse_date(value):
+    try:
+        day = datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def clean_filters(params):
+    """Keep only recognised, well-formed filter values from a QueryDict."""
+    filters = {}
+    status = params.get('status', '').strip().upper()
+    if status in dict(Transaction.STATUS_CHOICES):
+        filters['status'] = status
+    phone = params.get('phone', '').strip()
+    if phone:
+        filters['phone'] = phone
+    for name in ('start', 'end'):
+        value = params.get(name, '').strip()
+        if _parse_date(value):
+            filters[name] = value
+    return filters
+
+
+def date_range(filters):
+    """Return ``(start, end)`` datetimes for the start/end filters; ``end`` is exclusive."""
+    start = _parse_date(filters['start']) if 'start' in filters else None
+    end = _parse_date(filters['end']) + datetime.timedelta(days=1) if 'end' in filters else None
+    return start, end
+
+
+def filter_transactions(queryset, filters):
+    # Each filter is a leading column of one of the Transaction indexes.
+    if 'status' in filters:
+        queryset = queryset.filter(status=filters['status'])
+    if 'phone' in filters:
+        queryset = queryset.filter(phone_number=filters['phone'])
+    start, end = date_range(filters)
+    if start:
+        queryset = queryset.filter(created_at__gte=start)
+    if end:
+        queryset = queryset.filter(created_at__lt=end)
+    return queryset
+
+
+def page_queryset(filters, cursor=None, page_size=None):
+    """Return the sliced queryset for one page plus one look-ahead row."""
+    page_size = page_size or settings.PAYMENTS_PAGE_SIZE
+    queryset = filter_transactions(Transaction.objects.all(), filters)
+    position = decode_cursor(cursor)
+    if position:
+        created_at, pk = position
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+    return queryset.order_by(*ORDERING)[:page_size + 1]
+
+
+def page_context(rows, filters, page_size=None):
+    """Build the template context from the rows fetched by page_queryset."""
+    page_size = page_size or settings.PAYMENTS_PAGE_SIZE
+    rows = list(rows)
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    next_query = urlencode({**filters, 'cursor': encode_cursor(rows[-1])}) if has_next else None
+    return {
+        "transactions": rows,
+        "filters": filters,
+        "first_query": urlencode(filters),
+        "next_query": next_query,
+    }
+
+
+def transactions_page(params):
+    filters = clean_filters(params)
+    rows = page_queryset(filters, params.get('cursor'))
+    return page_context(rows, filters)
+
+
+async def atransactions_page(params):
+    filters = clean_filters(params)
+    rows = [t async for t in page_queryset(filters, params.get('cursor'))]
+    return page_context(rows, filters)
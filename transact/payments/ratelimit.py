@@ -0,0 +1,109 @@
+import threading
+import time
+
+from django.core.cache import caches
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing ``rate`` calls per second.
+
+    Up to ``burst`` calls may go through back to back after an idle period.
+    A ``rate`` of 0 or less disables limiting.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """Block until a call is allowed."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class SharedRateLimiter:
+    """Per-key fixed-window counter shared by every process through the Django cache.
+
+    Each key gets ``limit`` calls per ``period`` seconds, counted in a window
+    that resets at the start of each period. Unlike a token bucket, which
+    refills continuously, it needs only the atomic ``add``, ``incr`` and
+    ``decr`` every cache backend provides, at the cost of allowing up to
+    twice ``limit`` across a window boundary. A ``limit`` of 0 or less
+    disables limiting.
+    """
+
+    def __init__(self, prefix, limit, period, cache_alias="default", clock=time.time):
+        self.prefix = prefix
+        self.limit = limit
+        self.period = period
+        self.cache_alias = cache_alias
+        self._clock = clock
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}:{int(self._clock() // self.period)}"
+
+    def allow(self, key):
+        if self.limit <= 0:
+            return True
+        cache, bucket = caches[self.cache_alias], self._key(key)
+        cache.add(bucket, 0, timeout=int(self.period) + 1)
+        try:
+            return cache.incr(bucket) <= self.limit
+        except ValueError:
+            # Evicted between add and incr: let the call through.
+            return True
+
+    async def aallow(self, key):
+        if self.limit <= 0:
+            return True
+        cache, bucket = caches[self.cache_alias], self._key(key)
+        await cache.aadd(bucket, 0, timeout=int(self.period) + 1)
+        try:
+            return await cache.aincr(bucket) <= self.limit
+        except ValueError:
+            return True
+
+    def refund(self, key):
+        """Give back a call taken by ``allow`` in the current window."""
+        if self.limit <= 0:
+            return
+        try:
+            caches[self.cache_alias].decr(self._key(key))
+        except ValueError:
+            pass
+
+    async def arefund(self, key):
+        if self.limit <= 0:
+            return
+        try:
+            await caches[self.cache_alias].adecr(self._key(key))
+        except ValueError:
+            pass
@@ -0,0 +1,128 @@
+"""Batch resolution of transactions stuck in PENDING via Daraja's STK query."""
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .daraja import query_outcome
+from .models import Transaction
+from .ratelimit import RateLimiter
+from .stkquery import cached_query, query_status
+from .utils import get_access_token
+
+
+def query_remote_status(checkout_request_id):
+    """Ask Daraja for the outcome of one STK push.
+
+    Returns ``(new_status, body)``; ``new_status`` is None while the payment
+    is still pending or unknown. Network and OAuth errors propagate.
+    """
+    status_code, body = cached_query(checkout_request_id) or query_status(
+        checkout_request_id, get_access_token(),
+    )
+    new_status, _ = query_outcome(status_code, body)
+    return new_status, body
+
+
+def stale_pending(older_than, after=None):
+    """PENDING rows with a CheckoutRequestID created more than ``older_than`` seconds ago.
+
+    Ordered oldest first on the (status, created_at, id) index; ``after`` is
+    the ``(created_at, id)`` of the last row already visited.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=older_than)
+    queryset = Transaction.objects.pending().filter(
+        created_at__lt=cutoff, checkout_request_id__isnull=False,
+    )
+    if after:
+        created_at, pk = after
+        queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+    return queryset.order_by('created_at', 'id')
+
+
+def _settle(batch, pool, check, report):
+    """Query ``(pk, checkout_request_id)`` rows on ``pool`` and apply the final answers."""
+    outcomes = {}
+    for (pk, _), status in zip(batch, pool.map(check, [row[1] for row in batch])):
+        outcomes.setdefault(status, []).append(pk)
+    for status in ('SUCCESS', 'FAILED'):
+        if outcomes.get(status):
+            report[status.lower()] += Transaction.objects.filter(pk__in=outcomes[status]).transition(status=status)
+    report["pending"] += len(outcomes.get(None, []))
+    report["errors"] += len(outcomes.get('ERROR', []))
+    report["scanned"] += len(batch)
+
+
+def _checker(query, rate):
+    limiter = RateLimiter(rate)
+
+    def check(checkout_request_id):
+        limiter.acquire()
+        try:
+            return query(checkout_request_id)[0]
+        except Exception:
+            return 'ERROR'
+    return check
+
+
+def _finish(report, started):
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["per_second"] = round(report["scanned"] / elapsed, 1) if elapsed else 0.0
+    return report
+
+
+def reconcile(older_than=None, limit=None, workers=None, rate=None, batch_size=200,
+              query=query_remote_status, progress=None):
+    """Query Daraja for stale PENDING transactions and settle the answers.
+
+    Upstream calls run on a bounded thread pool behind a shared rate limiter;
+    database work stays on the calling thread and results are applied with
+    one conditional UPDATE per batch and status. Returns a report dict.
+    """
+    older_than = settings.MPESA_RECONCILE_AFTER if older_than is None else older_than
+    workers = workers or settings.MPESA_RECONCILE_WORKERS
+    rate = settings.MPESA_QUERY_RATE_LIMIT if rate is None else rate
+    check = _checker(query, rate)
+    report = {"scanned": 0, "success": 0, "failed": 0, "pending": 0, "errors": 0}
+    started = time.perf_counter()
+
+    after = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while limit is None or report["scanned"] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - report["scanned"])
+            batch = list(stale_pending(older_than, after).values_list('pk', 'created_at', 'checkout_request_id')[:size])
+            if not batch:
+                break
+            after = batch[-1][1], batch[-1][0]
+            _settle([(pk, checkout_id) for pk, _, checkout_id in batch], pool, check, report)
+            if progress:
+                progress(report)
+    return _finish(report, started)
+
+
+def reconcile_selected(pks, workers=None, rate=None, batch_size=200, query=query_remote_status):
+    """Like ``reconcile`` for the given transaction ids, whatever their age.
+
+    Rows that are no longer PENDING or have no CheckoutRequestID are skipped.
+    """
+    workers = workers or settings.MPESA_RECONCILE_WORKERS
+    rate = settings.MPESA_QUERY_RATE_LIMIT if rate is None else rate
+    check = _checker(query, rate)
+    report = {"scanned": 0, "success": 0, "failed": 0, "pending": 0, "errors": 0}
+    started = time.perf_counter()
+
+    pks = sorted(pks)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(pks), batch_size):
+            batch = list(
+                Transaction.objects.pending()
+                .filter(pk__in=pks[i:i + batch_size], checkout_request_id__isnull=False)
+                .values_list('pk', 'checkout_request_id')
+            )
+            if batch:
+                _settle(batch, pool, check, report)
+    return _finish(report, started)
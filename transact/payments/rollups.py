@@ -0,0 +1,165 @@
+"""Hourly revenue rollups: incremental maintenance, backfill and summaries.
+
+``TransactionRollup`` holds a count and summed amount per UTC hour and
+status. New rows are counted by a ``post_save`` receiver (``bulk_create``
+callers add their own deltas), and status changes are moved between buckets
+by ``TransactionQuerySet.transition`` and ``drain_inbox``.
+
+Writers never update the hourly rows: they append ``RollupDelta`` rows,
+so pushes and callbacks in the same hour don't queue on one row lock.
+``fold_deltas`` (the fold_rollups command) sums the deltas into
+``TransactionRollup`` in the background. Summaries read the rollup table
+plus the not-yet-folded deltas, and fold first when more than
+PAYMENTS_ROLLUP_FOLD_THRESHOLD are pending, so an unscheduled folder can't
+leave every report scanning a growing delta table. A 30-day report touches at most 720
+rollup rows per status, however many transactions there are.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import (
+    ArchivedTransaction, RollupDelta, Transaction, TransactionRollup, add_rollup_delta, hour_bucket,
+)
+from .pagination import date_range
+
+PERIODS = {'hour': TruncHour, 'day': TruncDay}
+DEFAULT_SUMMARY_DAYS = 30
+
+
+def count_created(sender, instance, created, raw=False, **kwargs):
+    """``post_save`` receiver adding newly created transactions to their bucket."""
+    if created and not raw:
+        RollupDelta.objects.record(add_rollup_delta({}, instance.created_at, instance.status, instance.amount))
+
+
+def count_created_bulk(txns):
+    """Rollup deltas for rows inserted with ``bulk_create`` (which sends no signals)."""
+    deltas = {}
+    for txn in txns:
+        add_rollup_delta(deltas, txn.created_at, txn.status, txn.amount)
+    RollupDelta.objects.record(deltas)
+
+
+def fold_deltas(batch_size=5000):
+    """Fold one batch of ``RollupDelta`` rows into ``TransactionRollup``; returns how many.
+
+    Deltas are claimed with ``SKIP LOCKED``, summed per bucket and applied
+    with one UPDATE per (hour, status), then deleted in the same transaction.
+    """
+    with transaction.atomic():
+        rows = list(
+            RollupDelta.objects.select_for_update(skip_locked=True)
+            .order_by('id').values_list('id', 'bucket', 'status', 'count', 'amount')[:batch_size]
+        )
+        if not rows:
+            return 0
+        totals = {}
+        for _, bucket, status, count, amount in rows:
+            total = totals.setdefault((bucket, status), [0, 0])
+            total[0] += count
+            total[1] += amount
+        TransactionRollup.objects.add(totals)
+        RollupDelta.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def fold_backlog(threshold=None):
+    """Fold deltas while more than ``threshold`` are pending; returns how many."""
+    threshold = settings.PAYMENTS_ROLLUP_FOLD_THRESHOLD if threshold is None else threshold
+    folded = 0
+    while RollupDelta.objects.order_by()[threshold:threshold + 1].exists():
+        folded += fold_deltas()
+    return folded
+
+
+def rebuild(start, end):
+    """Recompute the rollup rows for the hours in ``[start, end)``.
+
+    Counts both live and archived transactions. Returns the number of rollup
+    rows written. Run it over closed windows: transitions landing in a
+    window while it is rebuilt may be counted twice.
+    """
+    start, end = hour_bucket(start), hour_bucket(end)
+    totals = {}
+    for model in (Transaction, ArchivedTransaction):
+        aggregated = (
+            model.objects.filter(created_at__gte=start, created_at__lt=end)
+            .annotate(bucket=TruncHour('created_at', tzinfo=datetime.timezone.utc))
+            .values_list('bucket', 'status')
+            .annotate(count=Count('id'), amount=Sum('amount'))
+            .order_by()
+        )
+        for bucket, status, count, amount in aggregated:
+            total = totals.setdefault((bucket, status), [0, 0])
+            total[0] += count
+            total[1] += amount
+    rows = [
+        TransactionRollup(bucket=bucket, status=status, count=count, amount=amount)
+        for (bucket, status), (count, amount) in totals.items()
+    ]
+    with transaction.atomic():
+        # Unfolded deltas for the window are already counted in the rebuild.
+        RollupDelta.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+        TransactionRollup.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+        TransactionRollup.objects.bulk_create(rows)
+    return len(rows)
+
+
+def summary(filters, period='day'):
+    """Counts, amounts and failure rate per period between the start/end filters.
+
+    Defaults to the last DEFAULT_SUMMARY_DAYS days. ``filters`` comes from
+    ``pagination.clean_filters``; a status filter limits the statuses reported.
+    """
+    start, end = date_range(filters)
+    if start is None:
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = today - datetime.timedelta(days=DEFAULT_SUMMARY_DAYS - 1)
+    fold_backlog()
+    merged = {}
+    # Folded hourly rows plus the deltas fold_rollups hasn't reached yet
+    for model in (TransactionRollup, RollupDelta):
+        queryset = model.objects.filter(bucket__gte=start)
+        if end:
+            queryset = queryset.filter(bucket__lt=end)
+        if 'status' in filters:
+            queryset = queryset.filter(status=filters['status'])
+        aggregated = (
+            queryset.annotate(period=PERIODS[period]('bucket'))
+            .values_list('period', 'status')
+            .annotate(count=Sum('count'), amount=Sum('amount'))
+            .order_by()
+        )
+        for bucket, status, count, amount in aggregated:
+            total = merged.setdefault((bucket, status), [0, 0])
+            total[0] += count
+            total[1] += amount
+    rows = [
+        {"period": bucket, "status": status, "count": count, "amount": amount}
+        for (bucket, status), (count, amount) in sorted(merged.items())
+    ]
+
+    buckets, totals = {}, {}
+    for row in rows:
+        bucket = buckets.setdefault(row['period'], {"bucket": row['period'].isoformat(), "counts": {}, "amounts": {}})
+        bucket["counts"][row['status']] = row['count']
+        bucket["amounts"][row['status']] = f"{row['amount']:.2f}"
+        total = totals.setdefault(row['status'], {"count": 0, "amount": 0})
+        total["count"] += row['count']
+        total["amount"] += row['amount']
+
+    for bucket in buckets.values():
+        settled = bucket["counts"].get('SUCCESS', 0) + bucket["counts"].get('FAILED', 0)
+        bucket["failure_rate"] = round(bucket["counts"].get('FAILED', 0) / settled, 4) if settled else None
+    return {
+        "period": period,
+        "start": start.isoformat(),
+        "end": end.isoformat() if end else None,
+        "buckets": list(buckets.values()),
+        "totals": {status: {"count": t["count"], "amount": f"{t['amount']:.2f}"} for status, t in totals.items()},
+    }
@@ -0,0 +1,138 @@
+"""Primary/replica database routing with read-your-writes stickiness.
+
+Writes always go to ``default``. Reads go to a randomly chosen healthy
+replica, except in these cases, which read from the primary:
+
+* Reads inside a transaction on the primary, so ``select_for_update`` and
+  read-modify-write sequences stay consistent.
+* Reads in a request that has written, or that came with the sticky cookie
+  set by ``ReplicaPinningMiddleware`` after a recent write. Non-GET
+  requests are pinned from the start.
+* Reads outside a request (management commands, background threads,
+  callback workers), which typically read and then write.
+* Reads inside ``primary_reads()``, used when the result is cached, so a
+  lagging replica can't store old content under a fresh cache key.
+* Reads while every replica lags by more than DATABASE_REPLICA_MAX_LAG
+  seconds. Lag is probed at most every DATABASE_REPLICA_LAG_CHECK_INTERVAL
+  seconds per replica.
+
+Replicas are the ``DATABASES`` aliases starting with ``replica`` (see
+DB_REPLICAS in settings).
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+PRIMARY = 'default'
+
+
+class RoutingState:
+    """Per-request routing flags, held in a context variable."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('payments_db_routing', default=None)
+
+
+def begin_request(pinned=False):
+    state = RoutingState(pinned)
+    return state, _state.set(state)
+
+
+def end_request(token):
+    _state.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Send this request's reads to the primary inside the block."""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    pinned, state.pinned = state.pinned, True
+    try:
+        yield
+    finally:
+        state.pinned = pinned
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+def replica_lag(alias):
+    """Seconds the replica is behind the primary (0 when fully replayed)."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        # Local SQLite "replicas" are files or mirrors with no replication stream.
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+class LagMonitor:
+    """Caches each replica's health for ``interval`` seconds."""
+
+    def __init__(self, probe=None, clock=time.monotonic):
+        self.probe = probe
+        self._clock = clock
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def healthy(self, alias):
+        now = self._clock()
+        with self._lock:
+            checked = self._checked.get(alias)
+            if checked and now - checked[0] < settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL:
+                return checked[1]
+        try:
+            healthy = (self.probe or replica_lag)(alias) <= settings.DATABASE_REPLICA_MAX_LAG
+        except DatabaseError:
+            healthy = False
+        with self._lock:
+            self._checked[alias] = (now, healthy)
+        return healthy
+
+
+class PrimaryReplicaRouter:
+    def __init__(self, replicas=None, monitor=None):
+        self.replicas = replica_aliases() if replicas is None else list(replicas)
+        self.monitor = monitor or LagMonitor()
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if not self.replicas or state is None or state.pinned:
+            return PRIMARY
+        if connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        healthy = [alias for alias in self.replicas if self.monitor.healthy(alias)]
+        return random.choice(healthy) if healthy else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # Read our own writes for the rest of this request and, via the
+            # middleware cookie, for the sticky window after it.
+            state.pinned = state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *self.replicas}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication.
+        return db == PRIMARY
@@ -0,0 +1,22 @@
+"""Signals for consumers that track transaction changes (page cache, live updates)."""
+from functools import partial
+
+from django.db import transaction
+from django.dispatch import Signal
+
+# Sent once the writing transaction commits, with ``statuses``: a
+# ``{pk: status}`` dict of the rows created or changed. Also covers writes
+# that send no post_save: update(), bulk_create() and bulk_update().
+transactions_changed = Signal()
+
+
+def send_changed(sender, statuses):
+    if statuses:
+        # send_robust: a cache outage must not fail a payment write.
+        transaction.on_commit(partial(transactions_changed.send_robust, sender=sender, statuses=statuses))
+
+
+def forward_saved(sender, instance, raw=False, **kwargs):
+    """``post_save`` receiver re-sending single-row saves as transactions_changed."""
+    if not raw:
+        send_changed(sender, {instance.pk: instance.status})
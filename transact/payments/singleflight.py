@@ -0,0 +1,76 @@
+"""Coalescing of concurrent identical calls ("single flight").
+
+While a call for a key is in flight, further callers with the same key wait
+for it and share its result or exception, instead of issuing their own.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    """Thread-based single flight for sync code."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Run ``fn()`` unless a call for ``key`` is in flight; returns ``(result, shared)``."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncGroup:
+    """Single flight for coroutines; calls are coalesced per event loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """Await ``fn()`` unless a call for ``key`` is in flight; returns ``(result, shared)``."""
+        loop = asyncio.get_running_loop()
+        future = self._calls.get((loop, key))
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = self._calls[(loop, key)] = loop.create_future()
+        try:
+            result = await fn()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved: waiters re-raise it, no "never retrieved" warning
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[(loop, key)]
+            if not future.done():
+                # Leader cancelled: waiters get CancelledError rather than hang.
+                future.cancel()
+        return result, False
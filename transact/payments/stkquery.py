@@ -0,0 +1,82 @@
+"""STK status queries, coalesced per CheckoutRequestID and briefly cached.
+
+Concurrent queries for the same CheckoutRequestID share one upstream call
+(see ``singleflight``). A non-final answer is cached for
+MPESA_QUERY_CACHE_TTL seconds, so operators refreshing a pending payment
+don't each cost a Daraja query. Final answers are not cached. They are
+written to the transaction, and callers answer settled rows locally
+without querying at all.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from . import audit
+from .client import get_async_client, get_client
+from .daraja import STK_QUERY_PATH, parse_query_body, query_outcome, stk_query_request
+from .metrics import QUERY_REQUESTS
+from .singleflight import AsyncGroup, Group
+from .utils import token_manager
+
+_group = Group()
+_async_group = AsyncGroup()
+
+
+def _cache():
+    return caches[settings.MPESA_QUERY_CACHE_ALIAS]
+
+
+def _key(checkout_request_id):
+    return f"payments:stkquery:{checkout_request_id}"
+
+
+def _finish(checkout_request_id, response):
+    if response.status_code == 401:
+        # Token was revoked or expired early; force a refresh next time.
+        token_manager.invalidate()
+    audit.record('query', response.text, checkout_request_id)
+    result = (response.status_code, parse_query_body(response))
+    # Only a real "still pending" answer is cached; 4xx (e.g. a stale token)
+    # and 5xx are retried on the next query.
+    if query_outcome(*result)[0] is None and response.status_code < 400:
+        _cache().set(_key(checkout_request_id), result, timeout=settings.MPESA_QUERY_CACHE_TTL)
+    return result
+
+
+def cached_query(checkout_request_id):
+    """A recent non-final ``(status_code, body)`` for this id, or None."""
+    result = _cache().get(_key(checkout_request_id))
+    if result is not None:
+        QUERY_REQUESTS.inc(source="cache")
+    return result
+
+
+async def acached_query(checkout_request_id):
+    result = await _cache().aget(_key(checkout_request_id))
+    if result is not None:
+        QUERY_REQUESTS.inc(source="cache")
+    return result
+
+
+def query_status(checkout_request_id, access_token):
+    """Query Daraja for one STK push; returns ``(status_code, body)``. Errors propagate."""
+    def call():
+        response = get_client().post(
+            STK_QUERY_PATH, idempotent=True, **stk_query_request(checkout_request_id, access_token),
+        )
+        return _finish(checkout_request_id, response)
+
+    result, shared = _group.do(checkout_request_id, call)
+    QUERY_REQUESTS.inc(source="coalesced" if shared else "upstream")
+    return result
+
+
+async def aquery_status(checkout_request_id, access_token):
+    async def call():
+        response = await get_async_client().post(
+            STK_QUERY_PATH, idempotent=True, **stk_query_request(checkout_request_id, access_token),
+        )
+        return _finish(checkout_request_id, response)
+
+    result, shared = await _async_group.do(checkout_request_id, call)
+    QUERY_REQUESTS.inc(source="coalesced" if shared else "upstream")
+    return result
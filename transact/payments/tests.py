@@ -1,3 +1,1176 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import logging
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, connection
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import audit, pagecache
+from .archive import archive_settled, find_transaction
+from .bulk import bulk_initiate, normalize_msisdn, parse_rows
+from .callbacks import drain_inbox, process_callback
+from .checks import check_list_cache, check_mpesa_settings
+from .client import CircuitBreaker, CircuitOpenError, DarajaClient, reset_client
+from .daraja import build_stk_push_payload, dumps, stk_password
+from .dedupe import allow_push
+from .events import hub, publish_changes, status_key, status_stream
+from .export import export_chunks
+from .fakedaraja import FakeDaraja
+from .log import QueueingHandler
+from .metrics import Histogram
+from .middleware import ReplicaPinningMiddleware
+from .models import (
+    ArchivedTransaction, AuditRecord, CallbackEvent, RollupDelta, Transaction, TransactionRollup, hour_bucket,
+)
+from .ratelimit import RateLimiter, SharedRateLimiter
+from .reconcile import reconcile
+from .admin import EstimatedCountPaginator
+from .routers import LagMonitor, PrimaryReplicaRouter, begin_request, end_request, primary_reads
+from .rollups import fold_deltas, rebuild, summary as rollup_summary
+from .singleflight import AsyncGroup, Group
+from .stkquery import query_status
+from .utils import TokenManager, token_manager
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(MPESA_TOKEN_REFRESH_MARGIN=60)
+class TokenManagerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def fetch(self):
+        self.calls += 1
+        return f"token-{self.calls}", 3600
+
+    def test_token_is_reused_until_refresh_margin(self):
+        clock = FakeClock()
+        manager = TokenManager(fetch=self.fetch, clock=clock)
+        self.assertEqual(manager.get_token(), "token-1")
+        clock.now += 3000
+        self.assertEqual(manager.get_token(), "token-1")
+        clock.now += 550  # inside the 60s refresh margin
+        self.assertEqual(manager.get_token(), "token-2")
+        self.assertEqual(manager.stats(), {"hits": 1, "misses": 2, "refreshes": 2, "errors": 0})
+
+    def test_token_is_shared_through_cache(self):
+        TokenManager(fetch=self.fetch).get_token()
+        other = TokenManager(fetch=self.fetch)
+        self.assertEqual(other.get_token(), "token-1")
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(other.stats()["hits"], 1)
+
+    def test_concurrent_misses_share_one_refresh(self):
+        def slow_fetch():
+            time.sleep(0.05)
+            return self.fetch()
+
+        manager = TokenManager(fetch=slow_fetch)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(manager.get_token())) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(set(results), {"token-1"})
+
+    def test_invalidate_forces_refresh(self):
+        manager = TokenManager(fetch=self.fetch)
+        manager.get_token()
+        manager.invalidate()
+        self.assertEqual(manager.get_token(), "token-2")
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None):
+        self.status_code = status_code
+        self._body = body or {}
+        self.text = str(self._body)
+
+    def json(self):
+        return self._body
+
+
+class CircuitBreakerTests(TestCase):
+    def test_opens_after_threshold_and_half_opens_after_timeout(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        clock.now += 10
+        self.assertTrue(breaker.allow())   # single trial call
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class DarajaClientTests(TestCase):
+    def make_client(self, responses, **kwargs):
+        kwargs.setdefault("breaker", CircuitBreaker())
+        client = DarajaClient(base_url="http://daraja.test", retry_backoff=0, **kwargs)
+        client.session.request = mock.Mock(side_effect=responses)
+        return client
+
+    def test_idempotent_calls_are_retried(self):
+        client = self.make_client([FakeResponse(503), requests.ConnectionError(), FakeResponse(200)])
+        response = client.post("/mpesa/stkpushquery/v1/query", idempotent=True, json={})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.session.request.call_count, 3)
+        _, kwargs = client.session.request.call_args
+        self.assertEqual(kwargs["timeout"], client.timeout)
+
+    def test_non_idempotent_calls_are_not_retried(self):
+        client = self.make_client([FakeResponse(503), FakeResponse(200)])
+        response = client.post("/mpesa/stkpush/v1/processrequest", json={})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(client.session.request.call_count, 1)
+
+    def test_open_circuit_fails_fast(self):
+        client = self.make_client(
+            [requests.Timeout()] * 3,
+            max_retries=0,
+            breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60),
+        )
+        with self.assertRaises(requests.Timeout):
+            client.get("/oauth/v1/generate")
+        with self.assertRaises(CircuitOpenError):
+            client.get("/oauth/v1/generate")
+        self.assertEqual(client.session.request.call_count, 1)
+
+    def test_abandoned_trial_releases_half_open_slot(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        client = self.make_client([requests.TooManyRedirects(), FakeResponse(200)], breaker=breaker)
+        breaker.record_failure()
+        clock.now += 10
+        with self.assertRaises(requests.TooManyRedirects):
+            client.get("/oauth/v1/generate")
+        self.assertEqual(client.get("/oauth/v1/generate").status_code, 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+def callback_body(checkout_id, result_code=0, receipt="QKX1", amount=10, phone=254700000001):
+    stk = {"CheckoutRequestID": checkout_id, "ResultCode": result_code}
+    if result_code == 0:
+        stk["CallbackMetadata"] = {"Item": [
+            {"Name": "MpesaReceiptNumber", "Value": receipt},
+            {"Name": "Amount", "Value": amount},
+            {"Name": "PhoneNumber", "Value": phone},
+        ]}
+    return json.dumps({"Body": {"stkCallback": stk}})
+
+
+ACCEPTED = {"ResponseCode": "0", "CheckoutRequestID": "ws_CO_1"}
+
+
+@mock.patch("payments.views.get_access_token", return_value="token")
+@mock.patch("payments.views.get_client")
+class StkViewTests(TestCase):
+    def setUp(self):
+        # Submission guards live in the cache and would leak between tests.
+        cache.clear()
+
+    def test_push_accepted_stores_checkout_id(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(200, ACCEPTED)
+        response = self.client.post(reverse("stk_push"), {"phone_number": "254700000001", "amount": "10"})
+        self.assertContains(response, "STK Push sent")
+        txn = Transaction.objects.get()
+        self.assertEqual((txn.status, txn.checkout_request_id), ("PENDING", "ws_CO_1"))
+        payload = get_client.return_value.post.call_args.kwargs["json"]
+        self.assertEqual(payload["PhoneNumber"], "254700000001")
+
+    def test_push_rejected_marks_failed(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(200, {"ResponseCode": "1", "errorMessage": "nope"})
+        response = self.client.post(reverse("stk_push"), {"phone_number": "254700000001", "amount": "10"})
+        self.assertContains(response, "nope")
+        self.assertEqual(Transaction.objects.get().status, "FAILED")
+
+    def test_query_updates_status(self, get_client, _):
+        txn = Transaction.objects.create(phone_number="254700000001", amount=10, checkout_request_id="ws_CO_1")
+        get_client.return_value.post.return_value = FakeResponse(200, {"ResultCode": "1032"})
+        with mock.patch("payments.stkquery.get_client", get_client):
+            self.client.get(reverse("query_stk_status", args=[txn.id]))
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, "FAILED")
+
+
+class CallbackViewTests(TestCase):
+    def test_success_callback(self):
+        txn = Transaction.objects.create(phone_number="254700000001", amount=1, checkout_request_id="ws_CO_1")
+        self.client.post(reverse("stk_callback"), callback_body("ws_CO_1"), content_type="application/json")
+        txn.refresh_from_db()
+        self.assertEqual((txn.status, txn.mpesa_receipt_number, txn.amount), ("SUCCESS", "QKX1", 10))
+
+    def test_falls_back_to_latest_pending_for_phone(self):
+        txn = Transaction.objects.create(phone_number="254700000001", amount=10)
+        self.client.post(reverse("stk_callback"), callback_body("unknown"), content_type="application/json")
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, "SUCCESS")
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def test_async_push_and_callback(self):
+        client = mock.Mock()
+        client.post = mock.AsyncMock(return_value=FakeResponse(200, ACCEPTED))
+        with mock.patch("payments.views.aget_access_token", mock.AsyncMock(return_value="token")), \
+                mock.patch("payments.views.get_async_client", return_value=client):
+            response = await self.async_client.post(
+                reverse("stk_push_async"), {"phone_number": "254700000001", "amount": "10"}
+            )
+        self.assertContains(response, "STK Push sent")
+        await self.async_client.post(
+            reverse("stk_callback_async"), callback_body("ws_CO_1", result_code=1032),
+            content_type="application/json",
+        )
+        txn = await Transaction.objects.aget(checkout_request_id="ws_CO_1")
+        self.assertEqual(txn.status, "FAILED")
+
+
+@override_settings(PAYMENTS_PAGE_SIZE=2)
+class TransactionsListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        for i in range(5):
+            txn = Transaction.objects.create(phone_number=f"25470000000{i % 2}", amount=i + 1)
+            # Two rows share a timestamp to exercise the id tie-breaker.
+            Transaction.objects.filter(pk=txn.pk).update(created_at=now - datetime.timedelta(minutes=i // 2))
+
+    def walk(self, params):
+        seen, query = [], params
+        while True:
+            response = self.client.get(reverse("transactions_list") + "?" + query)
+            seen += [t.pk for t in response.context["transactions"]]
+            query = response.context["next_query"]
+            if not query:
+                return seen
+
+    def test_keyset_pages_cover_every_row_once(self):
+        expected = list(Transaction.objects.order_by("-created_at", "-id").values_list("pk", flat=True))
+        self.assertEqual(self.walk(""), expected)
+
+    def test_filters_are_kept_across_pages(self):
+        seen = self.walk("phone=254700000000")
+        self.assertEqual(set(seen), set(Transaction.objects.filter(phone_number="254700000000").values_list("pk", flat=True)))
+
+    def test_page_is_bounded(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("transactions_list"), {"status": "pending", "cursor": "garbage"})
+        self.assertEqual(len(response.context["transactions"]), 2)
+        self.assertEqual(response.context["filters"], {"status": "PENDING"})
+
+
+@skipUnless(connection.vendor == "sqlite", "checks SQLite query plans")
+class CallbackLookupIndexTests(TestCase):
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertIn("USING INDEX", plan)
+        self.assertNotIn("SCAN payments_transaction", plan)
+
+    def test_callback_lookups_use_indexes(self):
+        self.assertUsesIndex(Transaction.objects.filter(checkout_request_id="ws_CO_1"))
+        self.assertUsesIndex(Transaction.objects.filter(mpesa_receipt_number="QKX1"))
+        self.assertUsesIndex(
+            Transaction.objects.filter(phone_number="254700000001", status="PENDING").order_by("-created_at")
+        )
+
+    def test_checkout_request_id_is_unique(self):
+        Transaction.objects.create(phone_number="254700000001", amount=1, checkout_request_id="ws_CO_1")
+        with self.assertRaises(IntegrityError):
+            Transaction.objects.create(phone_number="254700000001", amount=1, checkout_request_id="ws_CO_1")
+
+
+@override_settings(MPESA_CALLBACK_MODE="queue")
+class CallbackQueueTests(TestCase):
+    def test_callback_is_queued_without_touching_transactions(self):
+        txn = Transaction.objects.create(phone_number="254700000001", amount=1, checkout_request_id="ws_CO_1")
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse("stk_callback"), callback_body("ws_CO_1"), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CallbackEvent.objects.pending().count(), 1)
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, "PENDING")
+
+    def test_drain_applies_batch(self):
+        ok = Transaction.objects.create(phone_number="254700000001", amount=1, checkout_request_id="ws_CO_1")
+        failed = Transaction.objects.create(phone_number="254700000002", amount=1, checkout_request_id="ws_CO_2")
+        for body in (callback_body("ws_CO_1"), callback_body("ws_CO_2", result_code=1032), "not json"):
+            CallbackEvent.objects.create(payload=body)
+
+        self.assertEqual(drain_inbox(batch_size=10), 3)
+        self.assertEqual(drain_inbox(batch_size=10), 0)
+        ok.refresh_from_db()
+        failed.refresh_from_db()
+        self.assertEqual((ok.status, ok.mpesa_receipt_number), ("SUCCESS", "QKX1"))
+        self.assertEqual(failed.status, "FAILED")
+        self.assertIn("Unparseable", CallbackEvent.objects.get(payload="not json").error)
+
+    @override_settings(MPESA_CALLBACK_MAX_ATTEMPTS=2)
+    def test_unmatched_callback_is_retried_until_the_limit(self):
+        event = CallbackEvent.objects.create(payload=callback_body("ws_CO_late"))
+        self.assertEqual(drain_inbox(), 1)
+        event.refresh_from_db()
+        self.assertIsNone(event.processed_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn("will retry", event.error)
+        # Not due again until the retry delay has passed
+        self.assertEqual(drain_inbox(), 0)
+
+        txn = Transaction.objects.create(phone_number="254700000001", amount=1, checkout_request_id="ws_CO_late")
+        CallbackEvent.objects.update(retry_at=timezone.now())
+        self.assertEqual(drain_inbox(), 1)
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, "SUCCESS")
+        self.assertEqual(CallbackEvent.objects.pending().count(), 0)
+        self.assertEqual(CallbackEvent.objects.get(pk=event.pk).error, "")
+
+        orphan = CallbackEvent.objects.create(payload=callback_body("ws_CO_never"), attempts=1)
+        self.assertEqual(drain_inbox(), 1)
+        orphan.refresh_from_db()
+        self.assertIsNotNone(orphan.processed_at)
+        self.assertIn("giving up", orphan.error)
+
+
+class IdempotentCallbackTests(TestCase):
+    def setUp(self):
+        self.txn = Transaction.objects.create(phone_number="254700000001", amount=1, checkout_request_id="ws_CO_1")
+
+    def post_callback(self, body):
+        return self.client.post(reverse("stk_callback"), body, content_type="application/json")
+
+    def test_late_failure_does_not_overwrite_success(self):
+        self.post_callback(callback_body("ws_CO_1"))
+        self.post_callback(callback_body("ws_CO_1", result_code=1032))
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.status, "SUCCESS")
+
+    def test_duplicate_delivery_does_not_write(self):
+        self.assertTrue(process_callback(json.loads(callback_body("ws_CO_1"))))
+        self.txn.refresh_from_db()
+        settled_at = self.txn.updated_at
+        self.assertFalse(process_callback(json.loads(callback_body("ws_CO_1"))))
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.updated_at, settled_at)
+
+    def test_known_receipt_is_treated_as_duplicate(self):
+        Transaction.objects.create(phone_number="254700000009", amount=1, mpesa_receipt_number="QKX1", status="SUCCESS")
+        self.assertFalse(process_callback(json.loads(callback_body("ws_CO_1"))))
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.status, "PENDING")
+
+    def test_drain_skips_duplicates_in_batch(self):
+        for body in (callback_body("ws_CO_1"), callback_body("ws_CO_1", result_code=1032)):
+            CallbackEvent.objects.create(payload=body)
+        drain_inbox()
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.status, "SUCCESS")
+
+    @mock.patch("payments.views.get_access_token", return_value="token")
+    @mock.patch("payments.views.get_client")
+    def test_query_does_not_overwrite_callback_result(self, get_client, _):
+        self.post_callback(callback_body("ws_CO_1", result_code=1032))
+        get_client.return_value.post.return_value = FakeResponse(200, {"ResultCode": "0"})
+        response = self.client.get(reverse("query_stk_status", args=[self.txn.id]))
+        self.assertContains(response, "already final")
+        get_client.return_value.post.assert_not_called()
+        self.txn.refresh_from_db()
+        self.assertEqual(self.txn.status, "FAILED")
+
+
+class RateLimiterTests(TestCase):
+    def test_blocks_once_burst_is_spent(self):
+        clock = FakeClock()
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock.now += seconds
+
+        limiter = RateLimiter(rate=2, burst=2, clock=clock, sleep=sleep)
+        for _ in range(4):
+            limiter.acquire()
+        self.assertEqual(sleeps, [0.5, 0.5])
+        self.assertFalse(limiter.try_acquire())
+
+
+class ReconcileTests(TestCase):
+    def test_resolves_only_stale_pending_rows(self):
+        old = timezone.now() - datetime.timedelta(minutes=10)
+        rows = {}
+        for checkout_id in ("ok", "cancelled", "waiting", "boom", "fresh"):
+            rows[checkout_id] = Transaction.objects.create(
+                phone_number="254700000001", amount=1, checkout_request_id=checkout_id,
+            )
+        Transaction.objects.exclude(checkout_request_id="fresh").update(created_at=old)
+        answers = {"ok": "SUCCESS", "cancelled": "FAILED", "waiting": None}
+
+        def query(checkout_id):
+            if checkout_id == "boom":
+                raise requests.Timeout()
+            return answers[checkout_id], {}
+
+        report = reconcile(older_than=60, workers=2, rate=0, batch_size=2, query=query)
+        self.assertEqual(
+            {k: report[k] for k in ("scanned", "success", "failed", "pending", "errors")},
+            {"scanned": 4, "success": 1, "failed": 1, "pending": 1, "errors": 1},
+        )
+        statuses = dict(Transaction.objects.values_list("checkout_request_id", "status"))
+        self.assertEqual(statuses, {"ok": "SUCCESS", "cancelled": "FAILED", "waiting": "PENDING",
+                                    "boom": "PENDING", "fresh": "PENDING"})
+
+
+class FakeDarajaEndToEndTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fake = FakeDaraja().start()
+        self.addCleanup(self.fake.stop)
+        overrides = override_settings(MPESA_BASE_URL=self.fake.url, MPESA_RETRY_BACKOFF=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_client()
+        self.addCleanup(reset_client)
+        token_manager.invalidate()
+        self.addCleanup(token_manager.invalidate)
+
+    def test_push_then_query_over_http(self):
+        self.client.post(reverse("stk_push"), {"phone_number": "254700000001", "amount": "5"})
+        self.client.post(reverse("stk_push"), {"phone_number": "254700000002", "amount": "5"})
+        txn = Transaction.objects.get(phone_number="254700000001")
+        self.assertEqual((txn.status, txn.checkout_request_id), ("PENDING", "ws_CO_fake_1"))
+
+        self.client.get(reverse("query_stk_status", args=[txn.id]))
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, "SUCCESS")
+        self.assertEqual(self.fake.requests["/oauth/v1/generate"], 1)
+
+    def test_injected_errors_fail_the_push(self):
+        self.fake.error_rate = 1.0
+        response = self.client.post(reverse("stk_push"), {"phone_number": "254700000001", "amount": "5"})
+        self.assertContains(response, "Failed to obtain MPESA access token")
+        self.assertEqual(self.fake.requests["/oauth/v1/generate"], 1 + settings.MPESA_MAX_RETRIES)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch("payments.views.get_access_token", return_value="token")
+    @mock.patch("payments.views.get_client")
+    def test_server_timing_reports_stages(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(200, ACCEPTED)
+        response = self.client.post(reverse("stk_push"), {"phone_number": "254700000001", "amount": "10"})
+        timing = response["Server-Timing"]
+        for part in ("oauth;dur=", "db_insert;dur=", "stk_push;dur=", "render;dur=", 'db;desc="3 queries"', "total;dur="):
+            self.assertIn(part, timing)
+
+    def test_histograms_and_exposition(self):
+        histogram = Histogram("test_seconds", "Test.", ["endpoint"], buckets=(0.1, 1))
+        histogram.observe(0.05, endpoint="/a")
+        histogram.observe(5, endpoint="/a")
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{endpoint="/a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{endpoint="/a",le="+Inf"} 2', lines)
+        self.assertIn('test_seconds_count{endpoint="/a"} 2', lines)
+
+        self.client.get(reverse("transactions_list"))
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn('payments_request_seconds_count{view="transactions_list",status="200"}', body)
+        self.assertIn("payments_circuit_open 0", body)
+
+
+class BulkPushTests(TestCase):
+    def test_normalize_msisdn(self):
+        for raw in ("0712345678", "712345678", "+254 712 345 678", "254-712-345678"):
+            self.assertEqual(normalize_msisdn(raw), "254712345678")
+        self.assertEqual(normalize_msisdn("0112345678"), "254112345678")
+        for raw in ("", None, "0812345678", "25471234567", "phone"):
+            self.assertIsNone(normalize_msisdn(raw))
+
+    def test_parse_rows_reports_bad_amounts_per_row(self):
+        amounts = ["Infinity", "-inf", "NaN", "100000000", "10.5", "0", "abc", "99999999", "12.00"]
+        valid, errors = parse_rows([{"phone": "0712345678", "amount": amount} for amount in amounts])
+        self.assertEqual([(index, amount) for index, _, amount in valid], [(7, 99999999), (8, 12)])
+        self.assertEqual([error["error"] for error in errors], [
+            "Amount must be a number.", "Amount must be a number.", "Amount must be a number.",
+            "Amount must be at most 99999999.", "Amount must be a whole number.",
+            "Amount must be at least 1.", "Amount must be a number.",
+        ])
+
+    @mock.patch("payments.bulk.get_access_token", return_value="token")
+    def test_bulk_initiate_writes_back_checkout_ids(self, _):
+        def push(phone, amount, token):
+            if phone.endswith("3"):
+                raise ValueError("rejected")
+            return f"ws_{phone}"
+
+        rows = [{"phone": f"071234567{i}", "amount": "10"} for i in range(5)]
+        rows.append({"phone": "nope", "amount": "1"})
+        events = list(bulk_initiate(rows, workers=3, rate=0, batch_size=2, push=push))
+
+        self.assertEqual(events[0], {"event": "invalid", "row": 5, "error": "Invalid phone number."})
+        self.assertIn({"event": "created", "count": 5}, events)
+        self.assertEqual(sum(e["event"] == "progress" for e in events), 2)
+        self.assertEqual(events[-1], {"event": "done", "rows": 6, "invalid": 1, "sent": 5, "accepted": 4, "failed": 1})
+        rows = dict(Transaction.objects.values_list("phone_number", "checkout_request_id"))
+        self.assertEqual(rows["254712345670"], "ws_254712345670")
+        self.assertIsNone(rows["254712345673"])
+        self.assertEqual(Transaction.objects.get(phone_number="254712345673").status, "FAILED")
+
+    @mock.patch("payments.bulk.get_access_token", return_value="token")
+    @mock.patch("payments.bulk.get_client")
+    def test_bulk_endpoint_streams_ndjson(self, get_client, _):
+        get_client.return_value.post.side_effect = [
+            FakeResponse(200, {"ResponseCode": "0", "CheckoutRequestID": f"ws_CO_{n}"}) for n in (1, 2)
+        ]
+        body = "phone,amount\n0712345678,10\n0712345679,20\n"
+        url = reverse("bulk_stk_push")
+        self.assertEqual(self.client.post(url, body, content_type="text/csv").status_code, 403)
+
+        self.client.force_login(User.objects.create_user("ops", is_staff=True))
+        response = self.client.post(url, body, content_type="text/csv")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        events = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(events[-1]["accepted"], 2)
+        self.assertEqual(Transaction.objects.filter(checkout_request_id__isnull=False).count(), 2)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        Transaction.objects.create(phone_number="254700000001", amount="10.50", status="SUCCESS",
+                                   mpesa_receipt_number="QKX1")
+        Transaction.objects.create(phone_number="254700000002", amount=5, status="FAILED")
+
+    def test_csv_export_streams_filtered_rows(self):
+        response = self.client.get(reverse("export_transactions"), {"status": "success"})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="transactions.csv"')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:4], ["id", "phone_number", "amount", "status"])
+        self.assertEqual(len(lines), 2)
+        self.assertIn("254700000001,10.50,SUCCESS", lines[1])
+
+    def test_jsonl_export_is_chunked(self):
+        with mock.patch("payments.export.LINES_PER_CHUNK", 1):
+            chunks = list(export_chunks({}, "jsonl", chunk_size=1))
+        self.assertEqual(len(chunks), 2)
+        first = json.loads(chunks[0])
+        self.assertEqual((first["phone_number"], first["amount"]), ("254700000001", "10.50"))
+
+    def test_unknown_format_is_rejected(self):
+        self.assertEqual(self.client.get(reverse("export_transactions"), {"format": "xml"}).status_code, 400)
+
+
+class RollupTests(TestCase):
+    def counts(self):
+        fold_deltas()
+        return {
+            status: (count, str(amount))
+            for status, count, amount in TransactionRollup.objects.values_list("status", "count", "amount")
+            if count
+        }
+
+    def test_creates_and_callbacks_move_counts_between_statuses(self):
+        Transaction.objects.create(phone_number="254700000001", amount=5, checkout_request_id="ok")
+        Transaction.objects.create(phone_number="254700000002", amount=7, checkout_request_id="cancelled")
+        self.assertEqual(self.counts(), {"PENDING": (2, "12.00")})
+
+        process_callback(json.loads(callback_body("ok", amount=6)))
+        process_callback(json.loads(callback_body("ok", amount=6)))  # duplicate delivery
+        process_callback(json.loads(callback_body("cancelled", result_code=1032)))
+        self.assertEqual(self.counts(), {"SUCCESS": (1, "6.00"), "FAILED": (1, "7.00")})
+
+    def test_queued_callbacks_update_rollups(self):
+        Transaction.objects.create(phone_number="254700000001", amount=5, checkout_request_id="ok")
+        CallbackEvent.objects.create(payload=callback_body("ok", amount=5))
+        drain_inbox()
+        self.assertEqual(self.counts(), {"SUCCESS": (1, "5.00")})
+
+    def test_rebuild_matches_incremental_counts(self):
+        for n in range(3):
+            Transaction.objects.create(phone_number="254700000001", amount=n + 1, checkout_request_id=f"c{n}")
+        process_callback(json.loads(callback_body("c0", receipt="R0", amount=1)))
+        expected = self.counts()
+        TransactionRollup.objects.update(count=0, amount=0)
+        Transaction.objects.create(phone_number="254700000001", amount=9, checkout_request_id="late")
+        expected["PENDING"] = (3, "14.00")
+
+        this_hour = hour_bucket(timezone.now())
+        rebuild(this_hour, this_hour + datetime.timedelta(hours=1))
+        self.assertEqual(self.counts(), expected)
+
+    def test_summary_reads_rollups_only(self):
+        Transaction.objects.create(phone_number="254700000001", amount=5, checkout_request_id="ok")
+        Transaction.objects.create(phone_number="254700000002", amount=7, checkout_request_id="no")
+        process_callback(json.loads(callback_body("ok", amount=5)))
+        process_callback(json.loads(callback_body("no", result_code=1)))
+
+        fold_deltas()
+        Transaction.objects.create(phone_number="254700000003", amount=9, checkout_request_id="late")  # unfolded
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("transactions_summary"), {"period": "hour"})
+        data = response.json()
+        self.assertEqual(len(data["buckets"]), 1)
+        self.assertEqual(data["buckets"][0]["failure_rate"], 0.5)
+        self.assertEqual(data["totals"]["SUCCESS"], {"count": 1, "amount": "5.00"})
+        self.assertEqual(data["totals"]["PENDING"], {"count": 1, "amount": "9.00"})
+        self.assertEqual(self.client.get(reverse("transactions_summary"), {"period": "week"}).status_code, 400)
+
+    def test_writes_append_deltas_that_fold_into_hourly_rows(self):
+        Transaction.objects.create(phone_number="254700000001", amount=5, checkout_request_id="ok")
+        process_callback(json.loads(callback_body("ok", amount=5)))
+        self.assertEqual(RollupDelta.objects.count(), 3)
+        self.assertFalse(TransactionRollup.objects.exists())
+        # Unfolded deltas already show up in the summary
+        self.assertEqual(rollup_summary({}, "hour")["totals"]["SUCCESS"], {"count": 1, "amount": "5.00"})
+
+        self.assertEqual(fold_deltas(batch_size=2), 2)
+        self.assertEqual(fold_deltas(), 1)
+        self.assertEqual(fold_deltas(), 0)
+        self.assertFalse(RollupDelta.objects.exists())
+        self.assertEqual(self.counts(), {"SUCCESS": (1, "5.00")})
+
+    def test_summary_folds_once_the_backlog_passes_the_threshold(self):
+        for n in range(3):
+            Transaction.objects.create(phone_number="254700000001", amount=1, checkout_request_id=f"c{n}")
+        with override_settings(PAYMENTS_ROLLUP_FOLD_THRESHOLD=3):
+            rollup_summary({}, "hour")
+            self.assertEqual(RollupDelta.objects.count(), 3)
+        with override_settings(PAYMENTS_ROLLUP_FOLD_THRESHOLD=2):
+            self.assertEqual(rollup_summary({}, "hour")["totals"]["PENDING"]["count"], 3)
+        self.assertFalse(RollupDelta.objects.exists())
+        self.assertEqual(TransactionRollup.objects.get().count, 3)
+
+
+class RequestBuildingTests(TestCase):
+    @override_settings(MPESA_SHORTCODE="174379", MPESA_PASSKEY="key", MPESA_CALLBACK_URL="https://example.test/cb/")
+    def test_push_payload_reuses_static_parts(self):
+        with mock.patch("payments.daraja.new_timestamp", return_value="20261018120000"):
+            first = build_stk_push_payload("254700000001", 10)
+            second = build_stk_push_payload("254700000002", 20)
+        self.assertEqual(first["Password"], "MTc0Mzc5a2V5MjAyNjEwMTgxMjAwMDA=")
+        self.assertEqual(first["CallBackURL"], "https://example.test/cb/")
+        self.assertEqual((second["PartyA"], second["PhoneNumber"], second["Amount"]), ("254700000002",) * 2 + (20,))
+        with override_settings(MPESA_PASSKEY="rotated"):
+            self.assertNotEqual(stk_password("20261018120000"), first["Password"])
+
+    def test_client_sends_compact_json_bytes(self):
+        client = DarajaClient(base_url="http://daraja.test", breaker=CircuitBreaker())
+        client.session.request = mock.Mock(return_value=FakeResponse(200))
+        client.post("/mpesa/stkpush/v1/processrequest", json={"Amount": 1}, headers={"Authorization": "Bearer t"})
+        kwargs = client.session.request.call_args.kwargs
+        self.assertEqual(kwargs["data"], b'{"Amount":1}')
+        self.assertEqual(kwargs["headers"]["Content-Type"], "application/json")
+        self.assertEqual(dumps({"a": [1, "b"]}), b'{"a":[1,"b"]}')
+
+    @override_settings(MPESA_SHORTCODE="not-a-code", MPESA_CALLBACK_URL="http://insecure.test/")
+    def test_system_check_reports_bad_config(self):
+        self.assertEqual([e.id for e in check_mpesa_settings(None)], ["payments.E001", "payments.W001"])
+
+
+class ListPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.txn = Transaction.objects.create(phone_number="254700000001", amount=5, checkout_request_id="ok")
+
+    def test_unchanged_pages_are_served_without_queries(self):
+        first = self.client.get(reverse("transactions_list"))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse("transactions_list"))
+        self.assertEqual(first.content, second.content)
+        # Different filters are cached separately
+        self.assertNotContains(self.client.get(reverse("transactions_list"), {"status": "success"}), "254700000001")
+
+    def test_status_change_invalidates_cached_pages(self):
+        self.assertContains(self.client.get(reverse("transactions_list")), "pill-pending")
+        with self.captureOnCommitCallbacks(execute=True):
+            process_callback(json.loads(callback_body("ok", receipt="QKX9")))
+        self.assertContains(self.client.get(reverse("transactions_list")), "QKX9")
+
+    def test_new_transaction_invalidates_cached_pages(self):
+        self.client.get(reverse("transactions_list"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(phone_number="254700000999", amount=1)
+        self.assertContains(self.client.get(reverse("transactions_list")), "254700000999")
+
+
+    def test_per_process_cache_falls_back_to_a_short_ttl(self):
+        self.assertFalse(pagecache.is_shared())
+        self.assertEqual(pagecache.page_timeout(), settings.PAYMENTS_LIST_CACHE_LOCAL_TIMEOUT)
+        self.assertEqual([e.id for e in check_list_cache(None)], ["payments.W003"])
+        with mock.patch("payments.pagecache.is_shared", return_value=True):
+            self.assertEqual(pagecache.page_timeout(), settings.PAYMENTS_LIST_CACHE_TIMEOUT)
+            self.assertEqual(check_list_cache(None), [])
+
+class StatusEventsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def test_stream_ends_with_published_status(self):
+        txn = await Transaction.objects.acreate(phone_number="254700000001", amount=5)
+        stream = status_stream(txn.pk, timeout=5, poll_interval=5)
+        self.assertIn('"status": "PENDING"', await anext(stream))
+        self.assertEqual(hub.subscriber_count(), 1)
+
+        # Published from a worker thread, as a sync callback view would.
+        threading.Timer(0.01, publish_changes, kwargs={"statuses": {txn.pk: "SUCCESS"}}).start()
+        message = await asyncio.wait_for(anext(stream), 1)
+        self.assertEqual(message, f'event: status\ndata: {{"id": {txn.pk}, "status": "SUCCESS"}}\n\n')
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertEqual(hub.subscriber_count(), 0)
+
+    async def test_changes_from_other_processes_arrive_through_the_cache(self):
+        txn = await Transaction.objects.acreate(phone_number="254700000001", amount=5)
+        stream = status_stream(txn.pk, timeout=5, poll_interval=0.01)
+        await anext(stream)
+        await cache.aset(status_key(txn.pk), "FAILED")
+        self.assertIn('"status": "FAILED"', await asyncio.wait_for(anext(stream), 1))
+        await stream.aclose()
+
+    async def test_events_endpoint(self):
+        txn = await Transaction.objects.acreate(phone_number="254700000001", amount=5, status="SUCCESS")
+        response = await self.async_client.get(reverse("transaction_events", args=[txn.pk]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertIn(b'"status": "SUCCESS"', body)
+        missing = await self.async_client.get(reverse("transaction_events", args=[txn.pk + 1]))
+        self.assertEqual(missing.status_code, 404)
+
+    @mock.patch("payments.views.get_access_token", return_value="token")
+    @mock.patch("payments.views.get_client")
+    def test_wsgi_pages_poll_instead_of_streaming(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(200, ACCEPTED)
+        response = self.client.post(reverse("stk_push"), {"phone_number": "254700000001", "amount": "10"})
+        txn = Transaction.objects.get()
+        self.assertContains(response, f"/payments/transactions/{txn.pk}/status/")
+        self.assertNotContains(response, "EventSource")
+        self.assertEqual(self.client.get(reverse("transaction_events", args=[txn.pk])).status_code, 501)
+
+
+class StatusApiTests(TestCase):
+    def test_conditional_get(self):
+        txn = Transaction.objects.create(phone_number="254700000001", amount=5, checkout_request_id="ok")
+        url = reverse("transaction_status", args=[txn.pk])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()["status"], "PENDING")
+        self.assertEqual(set(response.json()), {"id", "status", "amount", "mpesa_receipt_number",
+                                                "checkout_request_id", "updated_at"})
+        etag = response["ETag"]
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+
+        process_callback(json.loads(callback_body("ok")))
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()["mpesa_receipt_number"], "QKX1")
+        self.assertNotEqual(changed["ETag"], etag)
+
+    def test_unknown_transaction(self):
+        self.assertEqual(self.client.get(reverse("transaction_status", args=[999])).status_code, 404)
+
+
+@mock.patch("payments.views.get_access_token", return_value="token")
+@mock.patch("payments.views.get_client")
+class SubmissionGuardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def push(self, phone="254700000001", amount="10", **extra):
+        return self.client.post(reverse("stk_push"), {"phone_number": phone, "amount": amount}, **extra)
+
+    def test_duplicate_is_answered_from_cache(self, get_client, _):
+        get_client.return_value.post.side_effect = [
+            FakeResponse(200, {"ResponseCode": "0", "CheckoutRequestID": f"ws_CO_{n}"}) for n in range(2)
+        ]
+        self.push()
+        with self.assertNumQueries(0):
+            response = self.push()
+        self.assertContains(response, "Repeated submission")
+        self.assertContains(response, "STK Push sent")
+        self.assertEqual(get_client.return_value.post.call_count, 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+        # A different amount is a new payment
+        self.push(amount="11")
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    @override_settings(MPESA_DUPLICATE_WINDOW=0)
+    def test_idempotency_key_replays_result(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(200, {"ResponseCode": "1", "errorMessage": "nope"})
+        self.push(HTTP_IDEMPOTENCY_KEY="order-1")
+        self.assertContains(self.push(HTTP_IDEMPOTENCY_KEY="order-1"), "nope")
+        self.assertEqual(get_client.return_value.post.call_count, 1)
+        self.push(HTTP_IDEMPOTENCY_KEY="order-2")
+        self.assertEqual(get_client.return_value.post.call_count, 2)
+
+    def test_unexpected_error_releases_the_claim(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(200, ACCEPTED)
+        with mock.patch.object(Transaction.objects, "create", side_effect=DatabaseError("down")):
+            with self.assertRaises(DatabaseError):
+                self.push(HTTP_IDEMPOTENCY_KEY="abc")
+        self.assertContains(self.push(HTTP_IDEMPOTENCY_KEY="abc"), "STK Push sent")
+
+    @override_settings(MPESA_DUPLICATE_WINDOW=0, MPESA_PHONE_PUSH_LIMIT=2)
+    def test_per_phone_rate_limit(self, get_client, _):
+        get_client.return_value.post.side_effect = [
+            FakeResponse(200, {"ResponseCode": "0", "CheckoutRequestID": f"ws_CO_{n}"}) for n in range(3)
+        ]
+        self.push(amount="1")
+        self.push(amount="2")
+        limited = self.push(amount="3")
+        self.assertEqual(limited.status_code, 429)
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(self.push(phone="254700000002").status_code, 200)
+
+    def test_shared_rate_limiter_refills_each_period(self, *_):
+        now = [1000.0]
+        limiter = SharedRateLimiter("test:rl", limit=2, period=10, clock=lambda: now[0])
+        self.assertEqual([limiter.allow("a") for _ in range(3)], [True, True, False])
+        self.assertTrue(limiter.allow("b"))
+        now[0] += 10
+        self.assertTrue(limiter.allow("a"))
+
+    @override_settings(MPESA_PHONE_PUSH_LIMIT=1, MPESA_SHORTCODE_PUSH_LIMIT=1, MPESA_SHORTCODE_PUSH_PERIOD=60)
+    def test_shortcode_rejection_refunds_the_phone_limit(self, *_):
+        self.assertTrue(allow_push("254700000001"))
+        self.assertFalse(allow_push("254700000002"))
+        # The shortcode rejected it, so 254700000002 still has its call
+        with override_settings(MPESA_SHORTCODE_PUSH_LIMIT=5):
+            self.assertTrue(allow_push("254700000002"))
+            self.assertFalse(allow_push("254700000002"))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        old = timezone.now() - datetime.timedelta(days=100)
+        for n, status in enumerate(["SUCCESS", "FAILED", "PENDING", "SUCCESS", "SUCCESS"]):
+            Transaction.objects.create(phone_number="254700000001", amount=n + 1, status=status,
+                                       checkout_request_id=f"c{n}", mpesa_receipt_number=f"R{n}")
+        Transaction.objects.exclude(checkout_request_id="c4").update(created_at=old)
+
+    def test_moves_old_settled_rows_in_batches(self):
+        batches = []
+        moved = archive_settled(days=90, batch_size=2, progress=batches.append)
+        self.assertEqual((moved, batches), (3, [2, 3]))
+        self.assertEqual(set(Transaction.objects.values_list("checkout_request_id", flat=True)), {"c2", "c4"})
+        archived = ArchivedTransaction.objects.get(checkout_request_id="c0")
+        self.assertEqual((archived.status, archived.amount, archived.created_at.date()),
+                         ("SUCCESS", 1, (timezone.now() - datetime.timedelta(days=100)).date()))
+
+    def test_lookups_span_both_tiers(self):
+        hot_pk = Transaction.objects.get(checkout_request_id="c4").pk
+        cold_pk = Transaction.objects.get(checkout_request_id="c0").pk
+        archive_settled(days=90)
+
+        self.assertFalse(find_transaction(pk=hot_pk)["archived"])
+        self.assertEqual(find_transaction(receipt="R0")["id"], cold_pk)
+        self.assertTrue(find_transaction(checkout_request_id="c0")["archived"])
+        self.assertIsNone(find_transaction(receipt="missing"))
+
+        self.assertEqual(self.client.get(reverse("transaction_status", args=[cold_pk])).json()["status"], "SUCCESS")
+        lookup = self.client.get(reverse("transaction_lookup"), {"receipt": "R1"}).json()
+        self.assertEqual((lookup["status"], lookup["archived"]), ("FAILED", True))
+        self.assertEqual(self.client.get(reverse("transaction_lookup")).status_code, 400)
+
+    def test_exports_and_rollup_rebuilds_include_archived_rows(self):
+        archive_settled(days=90)
+        rows = list(export_chunks({}, "jsonl"))
+        exported = [json.loads(line)["checkout_request_id"] for line in "".join(rows).splitlines()]
+        self.assertEqual(exported, ["c0", "c1", "c2", "c3", "c4"])
+
+        old_hour = hour_bucket(timezone.now() - datetime.timedelta(days=100))
+        rebuild(old_hour - datetime.timedelta(hours=1), old_hour + datetime.timedelta(hours=1))
+        counts = dict(TransactionRollup.objects.filter(bucket=old_hour).values_list("status", "count"))
+        self.assertEqual(counts, {"SUCCESS": 2, "FAILED": 1, "PENDING": 1})
+
+
+@override_settings(DATABASE_REPLICA_MAX_LAG=10, DATABASE_REPLICA_LAG_CHECK_INTERVAL=5)
+class ReplicaRouterTests(SimpleTestCase):
+    # SimpleTestCase: TestCase wraps each test in a transaction, which pins
+    # every read to the primary.
+    def setUp(self):
+        self.lag = {"replica_1": 0.0}
+        self.clock = FakeClock()
+        self.router = PrimaryReplicaRouter(
+            replicas=["replica_1"], monitor=LagMonitor(probe=self.lag.__getitem__, clock=self.clock),
+        )
+
+    def test_reads_use_replica_until_the_request_writes(self):
+        # Outside a request (commands, workers) reads stay on the primary
+        self.assertEqual(self.router.db_for_read(Transaction), "default")
+        state, token = begin_request()
+        try:
+            self.assertEqual(self.router.db_for_read(Transaction), "replica_1")
+            with primary_reads():
+                self.assertEqual(self.router.db_for_read(Transaction), "default")
+            self.assertEqual(self.router.db_for_read(Transaction), "replica_1")
+            self.assertEqual(self.router.db_for_write(Transaction), "default")
+            self.assertEqual(self.router.db_for_read(Transaction), "default")
+            self.assertTrue(state.wrote)
+        finally:
+            end_request(token)
+        self.assertFalse(self.router.allow_migrate("replica_1", "payments"))
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        _, token = begin_request()
+        try:
+            self.lag["replica_1"] = 30.0
+            self.assertEqual(self.router.db_for_read(Transaction), "default")
+            self.lag["replica_1"] = 0.0
+            # Health is cached for the check interval
+            self.assertEqual(self.router.db_for_read(Transaction), "default")
+            self.clock.now += 5
+            self.assertEqual(self.router.db_for_read(Transaction), "replica_1")
+        finally:
+            end_request(token)
+
+    def test_middleware_sets_and_honours_sticky_cookie(self):
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Transaction))
+            if request.GET.get("write"):
+                self.router.db_for_write(Transaction)
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.get("/", {"write": "1"}))
+        self.assertIn(ReplicaPinningMiddleware.COOKIE, response.cookies)
+        self.assertNotIn(ReplicaPinningMiddleware.COOKIE, middleware(factory.get("/")).cookies)
+
+        pinned = factory.get("/")
+        pinned.COOKIES[ReplicaPinningMiddleware.COOKIE] = "1"
+        middleware(pinned)
+        middleware(factory.post("/"))
+        self.assertEqual(seen, ["replica_1", "replica_1", "default", "default"])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_result(self):
+        group, started, release = Group(), threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "done"
+
+        leader = threading.Thread(target=lambda: results.append(group.do("k", fn)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(group.do("k", fn))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("done", False)] + [("done", True)] * 3)
+        # The key is forgotten once the call finishes.
+        self.assertEqual(group.do("k", lambda: "again"), ("again", False))
+
+    def test_async_error_reaches_every_waiter(self):
+        group = AsyncGroup()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def run():
+            return await asyncio.gather(*(group.do("k", fail) for _ in range(3)), return_exceptions=True)
+
+        errors = asyncio.run(run())
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+
+    def test_async_waiters_fail_over_when_leader_is_cancelled(self):
+        group = AsyncGroup()
+
+        async def run():
+            leader = asyncio.ensure_future(group.do("k", lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(group.do("k", lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.wait_for(waiter, 1)
+            # The next caller leads a fresh call.
+            return await group.do("k", lambda: asyncio.sleep(0, "fresh"))
+
+        self.assertEqual(asyncio.run(run()), ("fresh", False))
+
+
+@mock.patch("payments.views.get_access_token", return_value="token")
+@mock.patch("payments.stkquery.get_client")
+class StkQueryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.txn = Transaction.objects.create(phone_number="254700000001", amount=10, checkout_request_id="ws_CO_1")
+
+    def test_pending_result_is_cached_briefly(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(200, {"ResultCode": "4999"})
+        for _ in range(3):
+            response = self.client.get(reverse("query_stk_status", args=[self.txn.id]))
+        self.assertContains(response, "Still pending")
+        self.assertEqual(get_client.return_value.post.call_count, 1)
+
+    def test_unauthorized_result_is_not_cached(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(401, {"errorMessage": "Invalid Access Token"})
+        query_status("ws_CO_1", "token")
+        query_status("ws_CO_1", "token")
+        self.assertEqual(get_client.return_value.post.call_count, 2)
+
+    def test_final_result_is_not_cached(self, get_client, _):
+        get_client.return_value.post.return_value = FakeResponse(200, {"ResultCode": "0"})
+        self.assertEqual(query_status("ws_CO_1", "token"), (200, {"ResultCode": "0"}))
+        query_status("ws_CO_1", "token")
+        self.assertEqual(get_client.return_value.post.call_count, 2)
+
+    def test_settled_transaction_is_answered_locally(self, get_client, _):
+        Transaction.objects.filter(pk=self.txn.pk).update(status="SUCCESS")
+        response = self.client.get(reverse("query_stk_status", args=[self.txn.id]))
+        self.assertContains(response, "already final (SUCCESS)")
+        get_client.return_value.post.assert_not_called()
+
+
+class AuditTests(TestCase):
+    def setUp(self):
+        audit.buffer.take(force=True)
+
+    @override_settings(PAYMENTS_AUDIT_FLUSH_INTERVAL=60)
+    def test_callbacks_are_buffered_and_looked_up_by_id(self):
+        Transaction.objects.create(phone_number="254700000001", amount=10, checkout_request_id="ws_CO_1")
+        self.client.post(reverse("stk_callback"), callback_body("ws_CO_1"), content_type="application/json")
+        self.assertEqual(AuditRecord.objects.count(), 0)
+        self.assertEqual(audit.flush(force=True), 1)
+        row = audit.lookup(receipt="QKX1").get()
+        self.assertEqual((row.kind, row.checkout_request_id), ("callback", "ws_CO_1"))
+        self.assertEqual(json.loads(row.body()), json.loads(callback_body("ws_CO_1")))
+
+    @override_settings(PAYMENTS_AUDIT_BATCH_SIZE=2, PAYMENTS_AUDIT_FLUSH_INTERVAL=60)
+    def test_full_batch_is_written_when_the_request_finishes(self):
+        self.client.post(reverse("stk_callback"), callback_body("ws_CO_1"), content_type="application/json")
+        self.assertEqual(len(audit.buffer), 1)
+        self.client.post(reverse("stk_callback"), callback_body("ws_CO_2"), content_type="application/json")
+        self.assertEqual(audit.lookup(checkout_request_id="ws_CO_2").count(), 1)
+        self.assertEqual(len(audit.buffer), 0)
+
+    @override_settings(PAYMENTS_AUDIT_BACKGROUND_FLUSH=True, PAYMENTS_AUDIT_FLUSH_INTERVAL=2)
+    @mock.patch("payments.audit.atexit.register")
+    @mock.patch("payments.audit.threading.Thread")
+    def test_timer_thread_and_exit_hook_start_once(self, thread, register):
+        with mock.patch("payments.audit._flusher_pid", None):
+            audit.record("query", "{}")
+            audit.record("query", "{}")
+        thread.assert_called_once()
+        self.assertEqual(thread.call_args.kwargs["args"], (2,))
+        register.assert_called_once_with(audit.flush, force=True)
+
+    def test_unparseable_callback_is_still_recorded(self):
+        audit.record_callback("not json")
+        audit.flush(force=True)
+        self.assertEqual(AuditRecord.objects.get().body(), "not json")
+
+    def test_compact_compresses_old_payloads(self):
+        old = timezone.now() - datetime.timedelta(days=30)
+        AuditRecord.objects.create(kind="query", checkout_request_id="ws_CO_1", payload='{"ResultCode": "0"}', created_at=old)
+        AuditRecord.objects.create(kind="query", checkout_request_id="ws_CO_2", payload='{"ResultCode": "1"}')
+        self.assertEqual(audit.compact(days=7), 1)
+        row = audit.lookup(checkout_request_id="ws_CO_1").get()
+        self.assertEqual((row.payload, row.body()), ("", '{"ResultCode": "0"}'))
+        self.assertIsNone(AuditRecord.objects.get(checkout_request_id="ws_CO_2").compressed)
+
+
+class JsonLogTests(SimpleTestCase):
+    def test_records_are_written_as_json_lines_off_thread(self):
+        stream = io.StringIO()
+        handler = QueueingHandler(stream=stream)
+        logger = logging.getLogger("tests.jsonlog")
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        logger.warning("callback %s", "ws_CO_1", extra={"checkout_request_id": "ws_CO_1"})
+        handler.close()  # stops the listener after draining the queue
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry["message"], "callback ws_CO_1")
+        self.assertEqual((entry["level"], entry["checkout_request_id"]), ("WARNING", "ws_CO_1"))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = QueueingHandler(stream=io.StringIO(), maxsize=1)
+        handler.close()  # nothing drains the queue any more
+        record = logging.makeLogRecord({"msg": "x"})
+        handler.handle(record)
+        handler.handle(record)
+        self.assertEqual(handler.dropped, 1)
+
+
+class TransactionAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin"))
+        self.url = reverse("admin:payments_transaction_changelist")
+        self.pending = Transaction.objects.create(phone_number="254700000001", amount=10, checkout_request_id="ws_CO_1")
+        self.settled = Transaction.objects.create(phone_number="254700000002", amount=20, status="SUCCESS",
+                                                  checkout_request_id="ws_CO_2", mpesa_receipt_number="QKX12345")
+
+    def test_search_uses_exact_and_prefix_lookups(self):
+        for term, expected in (("0700000001", self.pending), ("qkx1", self.settled), ("ws_CO_2", self.settled)):
+            response = self.client.get(self.url, {"q": term})
+            self.assertEqual(list(response.context["cl"].result_list), [expected], term)
+
+    def test_changelist_date_filter_uses_ranges(self):
+        today = timezone.localdate()
+        params = {"created_at__gte": str(today), "created_at__lt": str(today + datetime.timedelta(days=1))}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context["cl"].full_result_count)
+        self.assertEqual(len(response.context["cl"].result_list), 2)
+        self.assertFalse([q["sql"] for q in queries if "DISTINCT" in q["sql"]])
+
+    @override_settings(PAYMENTS_ADMIN_COUNT_LIMIT=1)
+    def test_count_is_capped(self):
+        self.assertEqual(EstimatedCountPaginator(Transaction.objects.order_by("pk"), 10).count, 1)
+
+    @mock.patch("payments.reconcile.get_access_token", return_value="token")
+    @mock.patch("payments.stkquery.get_client")
+    def test_requery_action_reconciles_pending_rows(self, get_client, _):
+        cache.clear()
+        get_client.return_value.post.return_value = FakeResponse(200, {"ResultCode": "0"})
+        with mock.patch("payments.admin.run_in_background", lambda fn, *args: fn(*args)):
+            response = self.client.post(self.url, {
+                "action": "requery_pending", "_selected_action": [self.pending.pk, self.settled.pk],
+            }, follow=True)
+        self.assertContains(response, "Re-querying 1 PENDING")
+        self.assertEqual(get_client.return_value.post.call_count, 1)
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, "SUCCESS")
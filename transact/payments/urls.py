@@ -3,8 +3,18 @@ from . import views
 
 urlpatterns = [
     path('stk_push/', views.initiate_stk_push, name='stk_push'),
+    path('bulk/stk_push/', views.bulk_stk_push, name='bulk_stk_push'),
     path('callback/', views.stk_callback, name='stk_callback'),
     path('transactions/', views.transactions_list, name='transactions_list'),
+    path('transactions/export/', views.export_transactions, name='export_transactions'),
+    path('transactions/lookup/', views.transaction_lookup, name='transaction_lookup'),
+    path('transactions/summary/', views.transactions_summary, name='transactions_summary'),
     path('callback/test/', views.callback_test, name='callback_test'),
+    path('transactions/<int:txn_id>/status/', views.transaction_status, name='transaction_status'),
+    path('transactions/<int:txn_id>/events/', views.transaction_events, name='transaction_events'),
     path('transactions/<int:txn_id>/query/', views.query_stk_status, name='query_stk_status'),
+    # Async variants for ASGI deployments (same behaviour, non-blocking I/O)
+    path('async/stk_push/', views.initiate_stk_push_async, name='stk_push_async'),
+    path('async/callback/', views.stk_callback_async, name='stk_callback_async'),
+    path('async/transactions/<int:txn_id>/query/', views.query_stk_status_async, name='query_stk_status_async'),
 ]
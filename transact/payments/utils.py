@@ -1,14 +1,21 @@
-import requests
+import threading
+import time
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import caches
 from requests.auth import HTTPBasicAuth
 
-def get_access_token():
-    url = f"{settings.MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-    response = requests.get(
-        url,
+from .client import get_client
+
+
+def fetch_access_token():
+    """Perform the OAuth round trip and return ``(token, expires_in_seconds)``."""
+    response = get_client().get(
+        "/oauth/v1/generate",
+        params={"grant_type": "client_credentials"},
         auth=HTTPBasicAuth(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET),
         headers={"Accept": "application/json"},
-        timeout=30,
     )
     # Ensure we have a successful response and valid JSON
     if response.status_code != 200:
@@ -25,4 +32,141 @@ def get_access_token():
         raise Exception(
             f"MPESA OAuth JSON missing access_token: {data}"
         )
-    return data["access_token"]
+    try:
+        expires_in = int(data.get("expires_in", 3599))
+    except (TypeError, ValueError):
+        expires_in = 3599
+    return data["access_token"], expires_in
+
+
+class TokenManager:
+    """Caches the Daraja OAuth token and refreshes it shortly before expiry.
+
+    The token lives in a local memo and in Django's cache so that every
+    worker process sharing that cache reuses one token. Threads that miss at
+    the same time wait on a single refresh instead of each calling OAuth, and
+    processes coordinate through a short-lived lock key in the cache.
+    """
+
+    CACHE_KEY = "payments:mpesa:oauth:token"
+    LOCK_KEY = "payments:mpesa:oauth:lock"
+
+    def __init__(self, fetch=fetch_access_token, clock=time.time):
+        self._fetch = fetch
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    @property
+    def cache(self):
+        return caches[settings.MPESA_TOKEN_CACHE_ALIAS]
+
+    @property
+    def refresh_margin(self):
+        return settings.MPESA_TOKEN_REFRESH_MARGIN
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _fresh(self, expires_at):
+        return self._clock() < expires_at - self.refresh_margin
+
+    def _valid(self, expires_at):
+        return self._clock() < expires_at
+
+    def _from_cache(self):
+        entry = self.cache.get(self.CACHE_KEY)
+        if entry:
+            self._token, self._expires_at = entry["token"], entry["expires_at"]
+        return entry
+
+    def get_token(self):
+        if self._token and self._fresh(self._expires_at):
+            self._count("hits")
+            return self._token
+
+        entry = self._from_cache()
+        if entry and self._fresh(entry["expires_at"]):
+            self._count("hits")
+            return entry["token"]
+
+        self._count("misses")
+        with self._lock:
+            # Another thread may have refreshed while we were waiting.
+            if self._token and self._fresh(self._expires_at):
+                return self._token
+            return self._refresh()
+
+    async def aget_token(self):
+        # Fast path stays on the event loop; refreshes run in a worker thread
+        # so they still share the single-flight lock with sync callers.
+        if self._token and self._fresh(self._expires_at):
+            self._count("hits")
+            return self._token
+        return await sync_to_async(self.get_token, thread_sensitive=False)()
+
+    def _refresh(self):
+        lock_timeout = settings.MPESA_TOKEN_LOCK_TIMEOUT
+        have_lock = self.cache.add(self.LOCK_KEY, 1, timeout=lock_timeout)
+        if not have_lock:
+            # Another process is refreshing: keep serving a still-valid token,
+            # otherwise wait briefly for the shared entry to appear.
+            if self._token and self._valid(self._expires_at):
+                return self._token
+            deadline = self._clock() + lock_timeout
+            while self._clock() < deadline:
+                time.sleep(0.05)
+                entry = self._from_cache()
+                if entry and self._valid(entry["expires_at"]):
+                    return entry["token"]
+        try:
+            try:
+                token, expires_in = self._fetch()
+            except Exception:
+                self._count("errors")
+                raise
+            expires_at = self._clock() + expires_in
+            self.cache.set(
+                self.CACHE_KEY,
+                {"token": token, "expires_at": expires_at},
+                timeout=max(int(expires_in), 1),
+            )
+            self._token, self._expires_at = token, expires_at
+            self._count("refreshes")
+            return token
+        finally:
+            if have_lock:
+                self.cache.delete(self.LOCK_KEY)
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after Daraja rejects it with a 401."""
+        with self._lock:
+            self._token, self._expires_at = None, 0.0
+            self.cache.delete(self.CACHE_KEY)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+            }
+
+
+token_manager = TokenManager()
+
+
+def get_access_token():
+    return token_manager.get_token()
+
+
+async def aget_access_token():
+    return await token_manager.aget_token()
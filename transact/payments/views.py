@@ -1,117 +1,226 @@
+import logging
+
 from django.shortcuts import render
 
 # Create your views here.
-import requests
-import datetime
-import base64
-from django.http import JsonResponse
 from django.conf import settings
-from .utils import get_access_token
-from .models import Transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from . import audit
+from .archive import find_transaction
+from .bulk import bulk_initiate, read_rows
+from .callbacks import aprocess_callback, process_callback
+from .client import get_async_client, get_client
+from .daraja import (
+    STK_PUSH_PATH,
+    parse_push_form,
+    push_response_context,
+    query_outcome,
+    stk_push_request,
+)
+from .dedupe import (
+    aabandon,
+    aallow_push,
+    abandon,
+    aclaim,
+    allow_push,
+    arelease,
+    aremember,
+    claim,
+    release,
+    remember,
+    submission_keys,
+)
+from .events import FINAL_STATUSES, status_stream
+from .export import FORMATS, export_chunks
+from .metrics import QUERY_REQUESTS, registry, stage
+from .pagecache import get_page, page_key, set_page
+from .pagination import atransactions_page, clean_filters, transactions_page
+from .rollups import PERIODS, summary
+from .routers import primary_reads
+from .stkquery import acached_query, aquery_status, cached_query, query_status
+from .utils import aget_access_token, get_access_token, token_manager
+from .models import ArchivedTransaction, CallbackEvent, Transaction
+
+logger = logging.getLogger(__name__)
+
+def _render(request, template_name, context=None, status=None):
+    # Pages only open the SSE stream when an ASGI server can hold it open.
+    context = {**(context or {}), "live_events": isinstance(request, ASGIRequest)}
+    with stage('render'):
+        return render(request, template_name, context, status=status)
 
 def initiate_stk_push(request):
     if request.method == 'GET':
-        return render(request, 'payments/stk_push.html')
+        return _render(request, 'payments/stk_push.html')
 
     # POST flow: read inputs and initiate STK push
-    phone_number = request.POST.get('phone_number', '').strip()
-    amount_str = request.POST.get('amount', '1').strip()
-    context = {"phone_number": phone_number, "amount": amount_str}
-
-    # Basic validation
+    phone_number, amount, context = parse_push_form(request.POST)
+    if amount is None:
+        return _render(request, 'payments/stk_push.html', context)
+
+    # Double submits and retrying terminals get the first result back
+    with stage('dedupe'):
+        keys = submission_keys(request, phone_number, amount)
+        previous = claim(keys)
+    if previous is not None:
+        return _render(request, 'payments/stk_push.html', {**context, **previous, "duplicate": True})
     try:
-        amount = int(float(amount_str))
-    except ValueError:
-        context.update({"error": "Amount must be a number."})
-        return render(request, 'payments/stk_push.html', context)
+        return _push(request, keys, phone_number, amount, context)
+    except BaseException:
+        # Unexpected failure (database, malformed response, cancellation):
+        # let a retry through instead of answering "in progress" until the TTL
+        abandon(keys)
+        raise
+
 
-    if not phone_number:
-        context.update({"error": "Phone number is required in MSISDN format e.g. 2547XXXXXXXX."})
-        return render(request, 'payments/stk_push.html', context)
+def _push(request, keys, phone_number, amount, context):
+    if not allow_push(phone_number):
+        release(keys)
+        context.update({"error": "Too many STK push requests for this number or shortcode; try again shortly."})
+        return _render(request, 'payments/stk_push.html', context, status=429)
 
     try:
-        access_token = get_access_token()
+        with stage('oauth'):
+            access_token = get_access_token()
     except Exception as e:
+        release(keys)
         context.update({"error": "Failed to obtain MPESA access token", "details": str(e)})
-        return render(request, 'payments/stk_push.html', context)
-
-    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    password_str = settings.MPESA_SHORTCODE + settings.MPESA_PASSKEY + timestamp
-    password = base64.b64encode(password_str.encode()).decode('utf-8')
+        return _render(request, 'payments/stk_push.html', context)
 
     # Create a pending transaction record
-    txn = Transaction.objects.create(
-        phone_number=phone_number,
-        amount=amount,
-        status='PENDING',
-    )
-
-    payload = {
-        "BusinessShortCode": settings.MPESA_SHORTCODE,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",
-        "Amount": amount,
-        "PartyA": phone_number,
-        "PartyB": settings.MPESA_SHORTCODE,
-        "PhoneNumber": phone_number,
-        "CallBackURL": settings.MPESA_CALLBACK_URL,
-        "AccountReference": "Transact Demo",
-        "TransactionDesc": "Testing STK Push"
-    }
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    with stage('db_insert'):
+        txn = Transaction.objects.create(
+            phone_number=phone_number,
+            amount=amount,
+            status='PENDING',
+        )
 
     try:
-        response = requests.post(
-            f"{settings.MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest",
-            json=payload,
-            headers=headers,
-            timeout=30,
-        )
+        # Not retried: a repeated push would prompt the customer twice.
+        with stage('stk_push'):
+            response = get_client().post(
+                STK_PUSH_PATH,
+                **stk_push_request(phone_number, amount, access_token),
+            )
     except Exception as e:
-        txn.status = 'FAILED'
-        txn.save(update_fields=['status', 'updated_at'])
+        Transaction.objects.filter(pk=txn.pk).transition(status='FAILED')
         context.update({"error": "Failed to reach MPESA STK API", "details": str(e)})
-        return render(request, 'payments/stk_push.html', context)
+        remember(keys, context)
+        return _render(request, 'payments/stk_push.html', context)
+
+    if response.status_code == 401:
+        # Token was revoked or expired early; force a refresh next time.
+        token_manager.invalidate()
+
+    response_context, checkout_id = push_response_context(response.status_code, response)
+    audit.record('push', response.text, checkout_id)
+    context.update(response_context)
+    if context.get('accepted'):
+        context["transaction_id"] = txn.pk
+        # Save CheckoutRequestID for correlating callback
+        if checkout_id:
+            txn.checkout_request_id = checkout_id
+            txn.save(update_fields=['checkout_request_id', 'updated_at'])
+    else:
+        Transaction.objects.filter(pk=txn.pk).transition(status='FAILED')
+
+    remember(keys, context)
+    return _render(request, 'payments/stk_push.html', context)
 
-    context.update({"mpesa_status": response.status_code})
-    # Try to parse response JSON; if not, include text
+
+async def initiate_stk_push_async(request):
+    if request.method == 'GET':
+        return _render(request, 'payments/stk_push.html')
+
+    phone_number, amount, context = parse_push_form(request.POST)
+    if amount is None:
+        return _render(request, 'payments/stk_push.html', context)
+
+    with stage('dedupe'):
+        keys = submission_keys(request, phone_number, amount)
+        previous = await aclaim(keys)
+    if previous is not None:
+        return _render(request, 'payments/stk_push.html', {**context, **previous, "duplicate": True})
     try:
-        body = response.json()
-        context.update({"mpesa_body": body})
-    except Exception:
-        context.update({"mpesa_body_text": response.text})
-
-    # Handle STK response semantics
-    if response.status_code == 200 and isinstance(context.get('mpesa_body'), dict):
-        body = context['mpesa_body']
-        # Success acceptance code from Daraja is usually ResponseCode == "0"
-        if str(body.get('ResponseCode')) == '0':
-            # Save CheckoutRequestID for correlating callback
-            checkout_id = body.get('CheckoutRequestID')
-            if checkout_id:
-                txn.checkout_request_id = checkout_id
-                txn.save(update_fields=['checkout_request_id', 'updated_at'])
-            context.update({
-                "accepted": True,
-                "message": "STK Push sent. Enter your M-PESA PIN on your phone to authorize. This page will not auto-update; check Transactions for final status after callback.",
-            })
-        else:
-            txn.status = 'FAILED'
-            txn.save(update_fields=['status', 'updated_at'])
-            context.update({
-                "error": body.get('errorMessage') or "STK Push was not accepted",
-                "details": body,
-            })
+        return await _apush(request, keys, phone_number, amount, context)
+    except BaseException:
+        await aabandon(keys)
+        raise
+
+
+async def _apush(request, keys, phone_number, amount, context):
+    if not await aallow_push(phone_number):
+        await arelease(keys)
+        context.update({"error": "Too many STK push requests for this number or shortcode; try again shortly."})
+        return _render(request, 'payments/stk_push.html', context, status=429)
+
+    try:
+        with stage('oauth'):
+            access_token = await aget_access_token()
+    except Exception as e:
+        await arelease(keys)
+        context.update({"error": "Failed to obtain MPESA access token", "details": str(e)})
+        return _render(request, 'payments/stk_push.html', context)
+
+    with stage('db_insert'):
+        txn = await Transaction.objects.acreate(
+            phone_number=phone_number,
+            amount=amount,
+            status='PENDING',
+        )
+
+    try:
+        with stage('stk_push'):
+            response = await get_async_client().post(
+                STK_PUSH_PATH,
+                **stk_push_request(phone_number, amount, access_token),
+            )
+    except Exception as e:
+        await Transaction.objects.filter(pk=txn.pk).atransition(status='FAILED')
+        context.update({"error": "Failed to reach MPESA STK API", "details": str(e)})
+        await aremember(keys, context)
+        return _render(request, 'payments/stk_push.html', context)
+
+    if response.status_code == 401:
+        token_manager.invalidate()
+
+    response_context, checkout_id = push_response_context(response.status_code, response)
+    audit.record('push', response.text, checkout_id)
+    context.update(response_context)
+    if context.get('accepted'):
+        context["transaction_id"] = txn.pk
+        if checkout_id:
+            txn.checkout_request_id = checkout_id
+            await txn.asave(update_fields=['checkout_request_id', 'updated_at'])
     else:
-        txn.status = 'FAILED'
-        txn.save(update_fields=['status', 'updated_at'])
+        await Transaction.objects.filter(pk=txn.pk).atransition(status='FAILED')
+
+    await aremember(keys, context)
+    return _render(request, 'payments/stk_push.html', context)
+
 
-    return render(request, 'payments/stk_push.html', context)
+def bulk_stk_push(request):
+    # Staff-only: one POST can prompt thousands of customers.
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST a JSON list or CSV of phone,amount rows."}, status=405)
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Staff login required."}, status=403)
+
+    try:
+        rows = read_rows(request.body, request.content_type)
+    except (ValueError, UnicodeDecodeError) as e:
+        return JsonResponse({"error": f"Could not parse body: {e}"}, status=400)
+    if not isinstance(rows, list):
+        return JsonResponse({"error": "Expected a list of rows."}, status=400)
+    if len(rows) > settings.MPESA_BULK_MAX_ROWS:
+        return JsonResponse({"error": f"At most {settings.MPESA_BULK_MAX_ROWS} rows per request."}, status=400)
+
+    # One JSON object per line as batches complete
+    events = (json.dumps(event) + "\n" for event in bulk_initiate(rows))
+    return StreamingHttpResponse(events, content_type='application/x-ndjson')
 
 
 
@@ -121,148 +230,248 @@ import json
 
 @csrf_exempt
 def stk_callback(request):
-    data = json.loads(request.body.decode('utf-8'))
-    print("Callback data:", data)
-    stk = data.get("Body", {}).get("stkCallback", {})
-    result_code = stk.get("ResultCode")
-    checkout_id = stk.get("CheckoutRequestID")
-
-    # Find matching transaction by checkout_request_id
-    txn = None
-    if checkout_id:
-        try:
-            txn = Transaction.objects.get(checkout_request_id=checkout_id)
-        except Transaction.DoesNotExist:
-            txn = None
-
-    # Extract metadata: receipt, phone, amount if present
-    receipt = None
-    phone_meta = None
-    amount_meta = None
-    metadata = stk.get("CallbackMetadata", {}).get("Item", [])
-    for item in metadata:
-        name = item.get("Name")
-        if name == "MpesaReceiptNumber":
-            receipt = item.get("Value")
-        elif name == "PhoneNumber":
-            phone_meta = str(item.get("Value")) if item.get("Value") is not None else None
-        elif name in ("Amount", "TransactionAmount"):
-            amount_meta = item.get("Value")
-
-    # Fallback: if no txn found by checkout_id, match latest pending by phone
-    if txn is None and phone_meta:
-        try:
-            txn = Transaction.objects.filter(phone_number=phone_meta, status='PENDING').order_by('-created_at').first()
-        except Exception:
-            txn = None
-
-    # Normalize result code comparison
-    result_ok = str(result_code) == '0'
-
-    if txn:
-        if result_ok:
-            txn.status = 'SUCCESS'
-            if receipt:
-                txn.mpesa_receipt_number = receipt
-            # Optionally update amount from callback
-            try:
-                if amount_meta is not None:
-                    # keep as Decimal by casting via str
-                    from decimal import Decimal
-                    txn.amount = Decimal(str(amount_meta))
-            except Exception:
-                pass
-            txn.save(update_fields=['status', 'mpesa_receipt_number', 'amount', 'updated_at'])
-        else:
-            txn.status = 'FAILED'
-            txn.save(update_fields=['status', 'updated_at'])
+    raw = request.body.decode('utf-8')
+    if settings.MPESA_CALLBACK_MODE == 'queue':
+        # Acknowledge immediately; process_callbacks applies it later.
+        with stage('enqueue'):
+            CallbackEvent.objects.create(payload=raw)
+        parsed = audit.record_callback(raw)
+        logger.info("STK callback queued", extra={"checkout_request_id": parsed["checkout_id"]})
+        return HttpResponse(status=200)
+
+    data = json.loads(raw)
+    parsed = audit.record_callback(raw, data)
+    with stage('apply'):
+        changed = process_callback(data)
+    logger.info("STK callback", extra={
+        "checkout_request_id": parsed["checkout_id"], "result_ok": parsed["result_ok"], "changed": changed,
+    })
+    return HttpResponse(status=200)
 
+
+@csrf_exempt
+async def stk_callback_async(request):
+    raw = request.body.decode('utf-8')
+    if settings.MPESA_CALLBACK_MODE == 'queue':
+        with stage('enqueue'):
+            await CallbackEvent.objects.acreate(payload=raw)
+        parsed = audit.record_callback(raw)
+        logger.info("STK callback queued", extra={"checkout_request_id": parsed["checkout_id"]})
+        return HttpResponse(status=200)
+
+    data = json.loads(raw)
+    parsed = audit.record_callback(raw, data)
+    with stage('apply'):
+        changed = await aprocess_callback(data)
+    logger.info("STK callback", extra={
+        "checkout_request_id": parsed["checkout_id"], "result_ok": parsed["result_ok"], "changed": changed,
+    })
     return HttpResponse(status=200)
 
+def _render_list(request, context=None):
+    # One keyset page (honouring any filters in the query string), never the whole table
+    with stage('list_query'):
+        page = transactions_page(request.GET)
+    page.update(context or {})
+    return _render(request, 'payments/transactions_list.html', page)
+
 def transactions_list(request):
-    transactions = Transaction.objects.order_by('-created_at')
-    return render(request, 'payments/transactions_list.html', {"transactions": transactions})
+    # Served from cache until a transaction is created or changes
+    with stage('cache'):
+        key = page_key(request.GET)
+        content = get_page(key)
+    if content is not None:
+        return HttpResponse(content)
+    # Cached pages are filled from the primary: the version was bumped on
+    # commit, and a lagging replica would store old rows under the new key.
+    with primary_reads():
+        response = _render_list(request)
+    set_page(key, response.content)
+    return response
+
+def export_transactions(request):
+    # Same status/phone/start/end filters as the list, streamed in full
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in FORMATS:
+        return JsonResponse({"error": f"Unknown format {fmt!r}; use csv or jsonl."}, status=400)
+    content_type, extension = FORMATS[fmt]
+    response = StreamingHttpResponse(export_chunks(clean_filters(request.GET), fmt), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="transactions.{extension}"'
+    return response
+
+STATUS_FIELDS = ('id', 'status', 'amount', 'mpesa_receipt_number', 'checkout_request_id', 'updated_at')
+
+def transaction_status(request, txn_id):
+    # One primary-key read; pollers revalidate with If-None-Match / If-Modified-Since
+    with stage('status_query'):
+        row = Transaction.objects.filter(pk=txn_id).values(*STATUS_FIELDS).first()
+        if row is None:
+            row = ArchivedTransaction.objects.filter(pk=txn_id).values(*STATUS_FIELDS).first()
+    if row is None:
+        return JsonResponse({"error": f"Transaction {txn_id} not found"}, status=404)
+
+    updated_at = row['updated_at']
+    etag = quote_etag(f"{row['id']}-{updated_at.timestamp():.6f}")
+    last_modified = int(updated_at.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse({
+            **row,
+            "amount": str(row['amount']),
+            "updated_at": updated_at.isoformat(),
+        })
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'no-cache'  # always revalidate, never serve stale
+    return response
+
+def transaction_lookup(request):
+    # Historical lookups across the hot and archive tables
+    params = {name: request.GET[name] for name in ('checkout_request_id', 'receipt') if request.GET.get(name)}
+    if len(params) != 1:
+        return JsonResponse({"error": "Pass exactly one of checkout_request_id or receipt."}, status=400)
+    row = find_transaction(**params)
+    if row is None:
+        return JsonResponse({"error": "Transaction not found"}, status=404)
+    return JsonResponse({
+        **row,
+        "amount": str(row['amount']),
+        "created_at": row['created_at'].isoformat(),
+        "updated_at": row['updated_at'].isoformat(),
+    })
+
+async def transaction_events(request, txn_id):
+    # Server-Sent Events: current status now, final status as soon as it lands.
+    # Under WSGI the async stream would be buffered to its end and pin a
+    # worker thread for PAYMENTS_EVENTS_TIMEOUT, so it needs ASGI.
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            "error": "Live events need an ASGI server; poll transactions/<id>/status/ instead.",
+        }, status=501)
+    if not await Transaction.objects.filter(pk=txn_id).aexists():
+        return JsonResponse({"error": f"Transaction {txn_id} not found"}, status=404)
+    response = StreamingHttpResponse(status_stream(txn_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx buffering the stream
+    return response
+
+def transactions_summary(request):
+    # Served from the hourly rollups (plus unfolded deltas), never from Transaction
+    period = request.GET.get('period', 'day')
+    if period not in PERIODS:
+        return JsonResponse({"error": f"Unknown period {period!r}; use hour or day."}, status=400)
+    with stage('summary_query'):
+        data = summary(clean_filters(request.GET), period)
+    return JsonResponse(data)
 
 def callback_test(request):
     return HttpResponse("OK", status=200)
 
+def metrics(request):
+    # Prometheus text exposition of the in-process payment metrics
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def query_stk_status(request, txn_id):
     try:
         txn = Transaction.objects.get(id=txn_id)
     except Transaction.DoesNotExist:
-        return render(request, 'payments/transactions_list.html', {
-            "transactions": Transaction.objects.order_by('-created_at'),
+        return _render_list(request, {
             "error": f"Transaction {txn_id} not found"
         })
 
     if not txn.checkout_request_id:
-        return render(request, 'payments/transactions_list.html', {
-            "transactions": Transaction.objects.order_by('-created_at'),
+        return _render_list(request, {
             "error": "Cannot query status: missing CheckoutRequestID on this transaction."
         })
 
-    try:
-        access_token = get_access_token()
-    except Exception as e:
-        return render(request, 'payments/transactions_list.html', {
-            "transactions": Transaction.objects.order_by('-created_at'),
-            "error": "Failed to obtain MPESA access token",
-            "details": str(e),
-        })
+    if txn.status in FINAL_STATUSES:
+        # Settled rows never change again; answer without asking Daraja.
+        QUERY_REQUESTS.inc(source="local")
+        return _render_list(request, {"message": f"Transaction already final ({txn.status}); no query needed."})
 
-    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    password_str = settings.MPESA_SHORTCODE + settings.MPESA_PASSKEY + timestamp
-    password = base64.b64encode(password_str.encode()).decode('utf-8')
-
-    payload = {
-        "BusinessShortCode": settings.MPESA_SHORTCODE,
-        "Password": password,
-        "Timestamp": timestamp,
-        "CheckoutRequestID": txn.checkout_request_id,
-    }
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    result = cached_query(txn.checkout_request_id)
+    if result is None:
+        try:
+            with stage('oauth'):
+                access_token = get_access_token()
+        except Exception as e:
+            return _render_list(request, {
+                "error": "Failed to obtain MPESA access token",
+                "details": str(e),
+            })
+
+        try:
+            with stage('stk_query'):
+                result = query_status(txn.checkout_request_id, access_token)
+        except Exception as e:
+            return _render_list(request, {
+                "error": "Failed to reach MPESA STK Query API",
+                "details": str(e),
+            })
+
+    status_code, body = result
+    new_status, message = query_outcome(status_code, body)
+    # Conditional update: never overwrite a status a callback already settled
+    if new_status and not Transaction.objects.filter(pk=txn.pk).transition(status=new_status):
+        message = f"Transaction already final; query result ({new_status}) ignored."
+
+    return _render_list(request, {
+        "query_result": body,
+        "message": message,
+        "mpesa_status": status_code,
+    })
 
+
+async def _arender_list(request, context):
+    # Rows are fetched up front: templates cannot evaluate querysets from async code.
+    with stage('list_query'):
+        page = await atransactions_page(request.GET)
+    page.update(context)
+    return _render(request, 'payments/transactions_list.html', page)
+
+
+async def query_stk_status_async(request, txn_id):
     try:
-        resp = requests.post(
-            f"{settings.MPESA_BASE_URL}/mpesa/stkpushquery/v1/query",
-            json=payload,
-            headers=headers,
-            timeout=30,
-        )
-    except Exception as e:
-        return render(request, 'payments/transactions_list.html', {
-            "transactions": Transaction.objects.order_by('-created_at'),
-            "error": "Failed to reach MPESA STK Query API",
-            "details": str(e),
+        txn = await Transaction.objects.aget(id=txn_id)
+    except Transaction.DoesNotExist:
+        return await _arender_list(request, {"error": f"Transaction {txn_id} not found"})
+
+    if not txn.checkout_request_id:
+        return await _arender_list(request, {
+            "error": "Cannot query status: missing CheckoutRequestID on this transaction."
         })
 
-    body = None
-    try:
-        body = resp.json()
-    except Exception:
-        body = {"raw": resp.text}
-
-    # Heuristic: if query ResultCode == 0 then success; specific messages may vary
-    result_code = str(body.get('ResultCode')) if isinstance(body, dict) else None
-    result_desc = body.get('ResultDesc') if isinstance(body, dict) else None
-    if result_code == '0':
-        txn.status = 'SUCCESS'
-        txn.save(update_fields=['status', 'updated_at'])
-        message = "Payment confirmed SUCCESS by query."
-    elif result_code in {'1032', '2001', '1', '2'}:
-        # Common non-success codes; mark as FAILED to unblock
-        txn.status = 'FAILED'
-        txn.save(update_fields=['status', 'updated_at'])
-        message = f"Payment marked FAILED by query (code {result_code})."
-    else:
-        message = f"Query returned status code {resp.status_code}. Still pending or unknown."
+    if txn.status in FINAL_STATUSES:
+        QUERY_REQUESTS.inc(source="local")
+        return await _arender_list(request, {"message": f"Transaction already final ({txn.status}); no query needed."})
+
+    result = await acached_query(txn.checkout_request_id)
+    if result is None:
+        try:
+            with stage('oauth'):
+                access_token = await aget_access_token()
+        except Exception as e:
+            return await _arender_list(request, {
+                "error": "Failed to obtain MPESA access token",
+                "details": str(e),
+            })
+
+        try:
+            with stage('stk_query'):
+                result = await aquery_status(txn.checkout_request_id, access_token)
+        except Exception as e:
+            return await _arender_list(request, {
+                "error": "Failed to reach MPESA STK Query API",
+                "details": str(e),
+            })
+
+    status_code, body = result
+    new_status, message = query_outcome(status_code, body)
+    if new_status and not await Transaction.objects.filter(pk=txn.pk).atransition(status=new_status):
+        message = f"Transaction already final; query result ({new_status}) ignored."
 
-    return render(request, 'payments/transactions_list.html', {
-        "transactions": Transaction.objects.order_by('-created_at'),
+    return await _arender_list(request, {
         "query_result": body,
         "message": message,
-        "mpesa_status": resp.status_code,
+        "mpesa_status": status_code,
     })
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import copy
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -30,6 +32,9 @@ SECRET_KEY = "django-insecure-qf10tgp$dz6co$5!hwgx4a&44&oqbezyx7wn6@bluy#f*5ytd(
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# `manage.py test`: quieter logs and no background audit flushing
+TESTING = sys.argv[1:2] == ["test"]
+
 ALLOWED_HOSTS = []
 
 
@@ -46,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "payments.middleware.ServerTimingMiddleware",
+    "payments.middleware.ReplicaPinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -78,12 +85,76 @@ WSGI_APPLICATION = "transact.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE=postgresql selects the production profile; anything else keeps the
+# local SQLite file, tuned for concurrent callback writes.
+
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite3")
+
+if DB_ENGINE in ("postgresql", "postgres"):
+    DB_POOL = os.getenv("DB_POOL", "false").lower() == "true"
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("DB_NAME", "transact"),
+            "USER": os.getenv("DB_USER", "transact"),
+            "PASSWORD": os.getenv("DB_PASSWORD", ""),
+            "HOST": os.getenv("DB_HOST", "localhost"),
+            "PORT": os.getenv("DB_PORT", "5432"),
+            # Persistent connections; must be 0 when Django's pool is enabled.
+            "CONN_MAX_AGE": 0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5")),
+            },
+        }
     }
-}
+    if DB_POOL:
+        # Django 5.1+ psycopg connection pool (requires psycopg[pool])
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "20")),
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("DB_NAME", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # WAL lets readers proceed during writes; IMMEDIATE takes the
+                # write lock up front so concurrent writers queue on
+                # busy_timeout instead of failing with "database is locked".
+                # busy_timeout is the only lock wait: sqlite3's "timeout"
+                # option sets the same handler and would be overridden by it.
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    f"PRAGMA busy_timeout={int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))};"
+                ),
+                "transaction_mode": "IMMEDIATE",
+            },
+        }
+    }
+
+
+# Read replicas: DB_REPLICAS is a comma-separated list of replica hosts
+# (PostgreSQL) or database files (SQLite). Each one becomes "replica_N", a copy
+# of the primary's settings. payments.routers.PrimaryReplicaRouter sends reads
+# there, except right after a write (sticky for DATABASE_REPLICA_STICKY_SECONDS),
+# outside a request (commands and workers read from the primary) or while
+# replication lag exceeds DATABASE_REPLICA_MAX_LAG seconds.
+DB_REPLICAS = [replica.strip() for replica in os.getenv("DB_REPLICAS", "").split(",") if replica.strip()]
+for n, replica in enumerate(DB_REPLICAS, 1):
+    DATABASES[f"replica_{n}"] = {
+        **copy.deepcopy(DATABASES["default"]),
+        ("HOST" if DB_ENGINE in ("postgresql", "postgres") else "NAME"): replica,
+        # Tests run against the primary's test database
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_ROUTERS = ["payments.routers.PrimaryReplicaRouter"] if DB_REPLICAS else []
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "5"))
+DATABASE_REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "10"))
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_LAG_CHECK_INTERVAL", "5"))
 
 
 # Password validation
@@ -127,6 +198,62 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Rows per page on the transactions list (keyset paginated)
+PAYMENTS_PAGE_SIZE = int(os.getenv("PAYMENTS_PAGE_SIZE", "50"))
+# Rows fetched per database round trip by the streaming exports
+PAYMENTS_EXPORT_CHUNK_SIZE = int(os.getenv("PAYMENTS_EXPORT_CHUNK_SIZE", "2000"))
+# Rendered transactions list pages; invalidated whenever a transaction changes.
+# Invalidation only crosses processes through a shared backend (Redis,
+# Memcached, database); with the default local-memory cache, pages live for
+# PAYMENTS_LIST_CACHE_LOCAL_TIMEOUT seconds at most.
+PAYMENTS_LIST_CACHE_ALIAS = os.getenv("PAYMENTS_LIST_CACHE_ALIAS", "default")
+PAYMENTS_LIST_CACHE_TIMEOUT = int(os.getenv("PAYMENTS_LIST_CACHE_TIMEOUT", "300"))  # seconds
+PAYMENTS_LIST_CACHE_LOCAL_TIMEOUT = int(os.getenv("PAYMENTS_LIST_CACHE_LOCAL_TIMEOUT", "5"))  # seconds
+# Rollup writes append deltas; `manage.py fold_rollups` should run
+# continuously to fold them into the hourly rows. The summary endpoint folds
+# on its own once more than this many are pending.
+PAYMENTS_ROLLUP_FOLD_THRESHOLD = int(os.getenv("PAYMENTS_ROLLUP_FOLD_THRESHOLD", "10000"))
+# Settled transactions older than this move to the archive table
+# (`manage.py archive_transactions`), in batches of this many rows
+PAYMENTS_ARCHIVE_AFTER_DAYS = int(os.getenv("PAYMENTS_ARCHIVE_AFTER_DAYS", "90"))
+PAYMENTS_ARCHIVE_BATCH_SIZE = int(os.getenv("PAYMENTS_ARCHIVE_BATCH_SIZE", "1000"))
+# Admin changelists count at most this many matching rows (see
+# payments.admin.EstimatedCountPaginator)
+PAYMENTS_ADMIN_COUNT_LIMIT = int(os.getenv("PAYMENTS_ADMIN_COUNT_LIMIT", "10000"))
+# Live status stream (transactions/<id>/events/). Point the cache alias at a
+# shared backend so changes applied by other processes reach waiting clients.
+PAYMENTS_EVENTS_CACHE_ALIAS = os.getenv("PAYMENTS_EVENTS_CACHE_ALIAS", "default")
+PAYMENTS_EVENTS_POLL_INTERVAL = float(os.getenv("PAYMENTS_EVENTS_POLL_INTERVAL", "2"))  # seconds
+PAYMENTS_EVENTS_TIMEOUT = int(os.getenv("PAYMENTS_EVENTS_TIMEOUT", "300"))  # seconds per stream
+# Raw Daraja callbacks and responses (payments.audit): buffered rows are
+# written in batches of this size or after this many seconds, and payloads
+# older than PAYMENTS_AUDIT_COMPRESS_AFTER_DAYS are compressed by compact_audit
+PAYMENTS_AUDIT_BATCH_SIZE = int(os.getenv("PAYMENTS_AUDIT_BATCH_SIZE", "100"))
+PAYMENTS_AUDIT_FLUSH_INTERVAL = float(os.getenv("PAYMENTS_AUDIT_FLUSH_INTERVAL", "2"))  # seconds
+# Timer thread flushing every interval, plus a flush at exit. Off under tests,
+# where it would write outside each test's transaction.
+PAYMENTS_AUDIT_BACKGROUND_FLUSH = os.getenv("PAYMENTS_AUDIT_BACKGROUND_FLUSH", "0" if TESTING else "1") == "1"
+PAYMENTS_AUDIT_COMPRESS_AFTER_DAYS = int(os.getenv("PAYMENTS_AUDIT_COMPRESS_AFTER_DAYS", "7"))
+
+# JSON-lines logs for the payments app, written to stdout by a background
+# thread (payments.log) so request threads never block on the log pipe
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "payments": {
+            "class": "payments.log.QueueingHandler",
+            "maxsize": int(os.getenv("PAYMENTS_LOG_QUEUE_SIZE", "10000")),  # records dropped beyond this
+        },
+    },
+    "loggers": {
+        "payments": {
+            "handlers": ["payments"],
+            "level": os.getenv("PAYMENTS_LOG_LEVEL", "WARNING" if TESTING else "INFO"),
+            "propagate": False,
+        },
+    },
+}
 
 
 
@@ -138,4 +265,54 @@ MPESA_SHORTCODE = os.getenv("MPESA_SHORTCODE", "174379")  # Sandbox default
 MPESA_PASSKEY = os.getenv("MPESA_PASSKEY", "")
 MPESA_BASE_URL = os.getenv("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke")
 MPESA_CALLBACK_URL = os.getenv("MPESA_CALLBACK_URL", "https://zoie-perigynous-alease.ngrok-free.dev/payments/callback/")
+
+# OAuth token caching: refresh this many seconds before Daraja's expiry and
+# share the token across processes through the named cache.
+MPESA_TOKEN_CACHE_ALIAS = os.getenv("MPESA_TOKEN_CACHE_ALIAS", "default")
+MPESA_TOKEN_REFRESH_MARGIN = int(os.getenv("MPESA_TOKEN_REFRESH_MARGIN", "300"))
+MPESA_TOKEN_LOCK_TIMEOUT = int(os.getenv("MPESA_TOKEN_LOCK_TIMEOUT", "10"))
+
+# Daraja HTTP client: keep-alive pool, split connect/read timeouts, retries for
+# idempotent calls and a circuit breaker that fails fast during incidents.
+MPESA_HTTP_POOL_SIZE = int(os.getenv("MPESA_HTTP_POOL_SIZE", "20"))
+MPESA_CONNECT_TIMEOUT = float(os.getenv("MPESA_CONNECT_TIMEOUT", "3.05"))
+MPESA_READ_TIMEOUT = float(os.getenv("MPESA_READ_TIMEOUT", "10"))
+MPESA_MAX_RETRIES = int(os.getenv("MPESA_MAX_RETRIES", "2"))
+MPESA_RETRY_BACKOFF = float(os.getenv("MPESA_RETRY_BACKOFF", "0.25"))
+MPESA_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("MPESA_CIRCUIT_FAILURE_THRESHOLD", "5"))
+MPESA_CIRCUIT_RESET_TIMEOUT = float(os.getenv("MPESA_CIRCUIT_RESET_TIMEOUT", "30"))
+
+# "inline" applies callbacks in the request; "queue" stores the raw body and
+# acknowledges at once, leaving `manage.py process_callbacks` to apply them.
+MPESA_CALLBACK_MODE = os.getenv("MPESA_CALLBACK_MODE", "inline")
+# Queued callbacks whose transaction isn't found yet are retried after
+# MPESA_CALLBACK_RETRY_DELAY * attempts seconds, up to this many attempts.
+MPESA_CALLBACK_MAX_ATTEMPTS = int(os.getenv("MPESA_CALLBACK_MAX_ATTEMPTS", "5"))
+MPESA_CALLBACK_RETRY_DELAY = float(os.getenv("MPESA_CALLBACK_RETRY_DELAY", "10"))  # seconds
+
+# Background reconciliation (`manage.py reconcile_pending`)
+MPESA_RECONCILE_AFTER = int(os.getenv("MPESA_RECONCILE_AFTER", "120"))  # seconds
+MPESA_RECONCILE_WORKERS = int(os.getenv("MPESA_RECONCILE_WORKERS", "8"))
+MPESA_QUERY_RATE_LIMIT = float(os.getenv("MPESA_QUERY_RATE_LIMIT", "5"))  # per second
+
+# STK status queries: concurrent queries for one CheckoutRequestID share a
+# single upstream call, and non-final answers are cached this long.
+MPESA_QUERY_CACHE_ALIAS = os.getenv("MPESA_QUERY_CACHE_ALIAS", "default")
+MPESA_QUERY_CACHE_TTL = int(os.getenv("MPESA_QUERY_CACHE_TTL", "5"))  # seconds
+
+# Bulk STK push (`bulk/stk_push/` and `manage.py bulk_stk_push`)
+MPESA_BULK_WORKERS = int(os.getenv("MPESA_BULK_WORKERS", "16"))
+MPESA_BULK_MAX_ROWS = int(os.getenv("MPESA_BULK_MAX_ROWS", "10000"))
+MPESA_PUSH_RATE_LIMIT = float(os.getenv("MPESA_PUSH_RATE_LIMIT", "20"))  # per second
+
+# STK push submission guards, kept in a shared cache: repeats of an
+# Idempotency-Key or of the same phone+amount within the window replay the
+# first result, and pushes are limited per phone and per shortcode.
+MPESA_GUARD_CACHE_ALIAS = os.getenv("MPESA_GUARD_CACHE_ALIAS", "default")
+MPESA_IDEMPOTENCY_TTL = int(os.getenv("MPESA_IDEMPOTENCY_TTL", "86400"))  # seconds
+MPESA_DUPLICATE_WINDOW = int(os.getenv("MPESA_DUPLICATE_WINDOW", "30"))  # seconds
+MPESA_PHONE_PUSH_LIMIT = int(os.getenv("MPESA_PHONE_PUSH_LIMIT", "3"))
+MPESA_PHONE_PUSH_PERIOD = int(os.getenv("MPESA_PHONE_PUSH_PERIOD", "60"))  # seconds
+MPESA_SHORTCODE_PUSH_LIMIT = int(os.getenv("MPESA_SHORTCODE_PUSH_LIMIT", "100"))
+MPESA_SHORTCODE_PUSH_PERIOD = int(os.getenv("MPESA_SHORTCODE_PUSH_PERIOD", "1"))  # seconds
 ALLOWED_HOSTS = ["127.0.0.1", "localhost", "zoie-perigynous-alease.ngrok-free.dev"]
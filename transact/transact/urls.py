@@ -17,9 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
+from payments.views import metrics
 
 urlpatterns = [
     path('', RedirectView.as_view(url='/payments/stk_push/', permanent=False)),
     path('admin/', admin.site.urls),
     path('payments/', include('payments.urls')),
+    path('metrics', metrics, name='metrics'),
 ]